@@ -0,0 +1,74 @@
+"""
+Per-series vs batched Holt-Winters forecasting throughput.
+
+Generates a synthetic fleet of equal-length metric series, runs
+model_prediction_report on each of them and model.batch_forecast on the
+whole (series x time) array, and checks that every report is the same:
+
+    python bench_forecast.py [--series 100] [--length 150]
+"""
+import argparse
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from model.batch_forecast import batch_reports
+from model.model import model_prediction_report
+
+
+def fleet(series, length, seed):
+    """Noisy seasonal series; some drift towards the 85.0 threshold."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(length)
+    rows = []
+    for _ in range(series):
+        base = rng.uniform(20, 80) + rng.uniform(-0.3, 0.4) * t
+        season = rng.uniform(0, 8) * np.sin(2 * np.pi * t / 30 + rng.uniform(0, 2 * np.pi))
+        noise = rng.normal(0, rng.uniform(0.2, 3), length)
+        if rng.random() < 0.3:
+            noise = np.cumsum(noise) * 0.3
+        rows.append(base + season + noise)
+    return np.array(rows)
+
+
+def same(a, b):
+    if a.keys() != b.keys():
+        return False
+    return all(a[k] == b[k] or (pd.isna(a[k]) and pd.isna(b[k])) for k in a)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--series", type=int, default=100)
+    parser.add_argument("--length", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # statsmodels предупреждает о несошедшейся оптимизации — для сравнения это шум
+    warnings.simplefilter("ignore")
+
+    matrix = fleet(args.series, args.length, args.seed)
+
+    started = time.perf_counter()
+    expected = [model_prediction_report(pd.Series(row)) for row in matrix]
+    per_series = time.perf_counter() - started
+
+    started = time.perf_counter()
+    actual = batch_reports(matrix)
+    batched = time.perf_counter() - started
+
+    mismatches = [i for i, (a, b) in enumerate(zip(expected, actual)) if not same(a, b)]
+    print(f"{'mode':12} {'seconds':>9} {'series/s':>9}")
+    print(f"{'per-series':12} {per_series:>9.2f} {args.series / per_series:>9.1f}")
+    print(f"{'batched':12} {batched:>9.2f} {args.series / batched:>9.1f}")
+    print(f"speedup {per_series / batched:.1f}x, mismatching reports: {len(mismatches)}")
+    for i in mismatches[:5]:
+        print(f"  row {i}: {expected[i]} != {actual[i]}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Query-count regression check for the listing endpoints.
+
+Seeds a throwaway SQLite database at two sizes and asserts that every
+endpoint issues the same number of SQL statements regardless of how many
+groups and devices exist (no N+1):
+
+    python bench_queries.py [--groups 200] [--devices-per-group 50]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# База задается до импорта приложения: database.py читает DATABASE_URL при импорте
+_tmpdir = tempfile.mkdtemp(prefix="bench_queries_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import models
+from database import Base, SessionLocal, engine
+from main import app
+from utils.presence import presence
+
+
+ENDPOINTS = [
+    "/groups",
+    "/groups?limit=10&fields=serial,status",
+    "/groups/1",
+    "/projects/1/dashboard",
+    "/projects/projects/1/groups",
+    "/devices",
+]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def seed(groups, devices_per_group):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add(models.Project(id=1, name="bench"))
+        db.add_all(models.Group(id=g, name=f"group-{g}", project_id=1) for g in range(1, groups + 1))
+        db.flush()
+        db.add_all(
+            models.Device(serial=f"dev-{g}-{d}", group_id=g)
+            for g in range(1, groups + 1)
+            for d in range(devices_per_group)
+        )
+        db.commit()
+
+
+def measure(client):
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    results = {}
+    try:
+        for path in ENDPOINTS:
+            counter.count = 0
+            started = time.perf_counter()
+            resp = client.get(path)
+            elapsed = time.perf_counter() - started
+            if resp.status_code != 200:
+                raise SystemExit(f"{path} -> {resp.status_code}: {resp.text[:200]}")
+            results[path] = (counter.count, elapsed)
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--devices-per-group", type=int, default=50)
+    args = parser.parse_args()
+
+    # Presence без Prometheus: статус только из памяти
+    presence.fallback = "off"
+    client = TestClient(app)
+
+    runs = {}
+    for groups, per_group in ((2, 2), (args.groups, args.devices_per_group)):
+        seed(groups, per_group)
+        runs[(groups, per_group)] = measure(client)
+
+    small, large = runs.values()
+    failed = False
+    print(f"{'endpoint':45} {'small':>6} {'large':>6} {'large ms':>9}")
+    for path in ENDPOINTS:
+        (q_small, _), (q_large, t_large) = small[path], large[path]
+        mark = "" if q_small == q_large else "  <-- grows with data"
+        failed |= q_small != q_large
+        print(f"{path:45} {q_small:>6} {q_large:>6} {t_large * 1000:>9.1f}{mark}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
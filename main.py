@@ -2,27 +2,71 @@ from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 import telemetry_pb2
 from fastapi_mqtt import FastMQTT, MQTTConfig
-from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
-import httpx
 import time
 from datetime import datetime, timezone
 import models
 from database import engine, SessionLocal
-import tempfile
 from sqlalchemy import update
-from utils.coredump import CoreDumpDecoder
-import json
 import asyncio
 from contextlib import asynccontextmanager
-from routers.model_alerts import run_predictive_background_task
+from utils.metrics_exporter import metrics_exporter, STATUS_METRIC
+from utils.http_clients import http_clients
+from utils.log_shipper import log_shipper
+from utils.coredump_jobs import coredump_jobs, store_raw_coredump, ensure_trace_columns
+from utils.last_seen import last_seen
+from utils.telemetry_writer import telemetry_writer, metric_timestamp
+from utils.telemetry_store import telemetry_store
+from utils.alert_cache import alert_cache
+from utils.presence import presence
+from utils.issue_stats import issue_stats
+from utils.trace_memory import ensure_segment_index
+from utils.predictive_scheduler import predictive_scheduler
+from utils.anomaly_scan import anomaly_scanner
+from utils.online_anomaly import online_anomalies
 
 
 
 models.Base.metadata.create_all(bind=engine)
+ensure_trace_columns()
+telemetry_store.ensure_schema()
+issue_stats.ensure_indexes()
+issue_stats.ensure_backfilled()
+ensure_segment_index()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics_exporter.start()
+    log_shipper.start()
+    coredump_jobs.start()
+    last_seen.start()
+    telemetry_writer.start()
+    telemetry_store.start()
+    alert_cache.start()
+    predictive_scheduler.start()
+    anomaly_scanner.start()
+    online_anomalies.start()
+    presence.start()
+    await mqtt_client.mqtt_startup()
+    yield
+    # Сначала перестаем принимать MQTT, потом досылаем накопленное
+    await mqtt_client.mqtt_shutdown()
+    await metrics_exporter.stop()
+    await log_shipper.stop()
+    await coredump_jobs.stop()
+    await last_seen.stop()
+    await telemetry_writer.stop()
+    await telemetry_store.stop()
+    await alert_cache.stop()
+    await predictive_scheduler.stop()
+    await anomaly_scanner.stop()
+    await online_anomalies.stop()
+    await http_clients.aclose()
 
 
 app = FastAPI(
     title="IoT Manager API (Hybrid Mode)",   
+    lifespan=lifespan,
 )
 
 origins = ["http://localhost:8280", "http://127.0.0.1:8280"]
@@ -34,7 +78,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-from routers import groups, devices, issues, projects, metadata, issues, traces, model_alerts
+from routers import groups, devices, issues, projects, metadata, issues, traces, model_alerts, system
 from model import model
 app.include_router(groups.router)
 app.include_router(devices.router)
@@ -44,62 +88,10 @@ app.include_router(metadata.router)
 app.include_router(traces.router)
 app.include_router(model.router)
 app.include_router(model_alerts.router)
+app.include_router(system.router)
 
 mqtt_config = MQTTConfig(host="hivemq_broker", port=1883)
 mqtt_client = FastMQTT(config=mqtt_config)
-mqtt_client.init_app(app)
-
-LOKI_URL = "http://loki:3100/loki/api/v1/push"
-PUSHGATEWAY_URL = "pushgateway:9091"
-
-
-async def send_logs_batch_to_loki(source_value, telemetry_logs):
-    if not telemetry_logs:
-        return
-
-    grouped_logs = {}
-    
-    try:
-        level_names = {v: k for k, v in telemetry_pb2.LogLevel.items()}
-    except Exception:
-        level_names = {}
-
-    for log in telemetry_logs:
-        # Проверяем, что log — это объект с нужными атрибутами
-        level_num = getattr(log, 'level', 0)
-        message = getattr(log, 'message', '')
-        timestamp = getattr(log, 'timestamp', None)
-        
-        level_name = level_names.get(level_num, "UNKNOWN")
-        
-        if level_name not in grouped_logs:
-            grouped_logs[level_name] = []
-        
-        current_ts_ns = str(int(time.time() * 10**9))
-        grouped_logs[level_name].append([current_ts_ns, message])
-
-    # 2. Формируем payload. ВАЖНО: используем 'serial', как в поиске
-    streams = []
-    for level, values in grouped_logs.items():
-        streams.append({
-            "stream": {
-                "serial": str(source_value), # Метка должна совпадать с тем, что ищем
-                "job": "device_logs",
-                "level": level
-            },
-            "values": values
-        })
-    
-    payload = {"streams": streams}
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.post(LOKI_URL, json=payload, timeout=5.0)
-            if resp.status_code not in [200, 204]:
-                print(f"Loki Push Error: {resp.status_code} - {resp.text}")
-        except Exception as e:
-            print(f"Loki Batch Error (Network/HTTP): {type(e).__name__} - {e}")
-
 
 @mqtt_client.on_connect()
 def connect(client, flags, rc, properties):
@@ -115,97 +107,54 @@ async def message(client, topic, payload, qos, properties):
         telemetry.ParseFromString(payload)
         device_serial = telemetry.info.device_id or "unknown"
 
-        registry = CollectorRegistry()
-        
-        status_g = Gauge("device_runtime_status", "Online status", ["serial"], registry=registry)
-        status_g.labels(serial=device_serial).set(1)
+        # 2. Метрики копим в памяти, в Pushgateway их отправляет фоновый flusher
+        values = {STATUS_METRIC: 1}
+        # Те же значения пишем в device_telemetry для предиктивной аналитики
+        received_at = datetime.now(timezone.utc)
+        samples = []
 
         # 3. Динамические метрики (из fake.py прилетят cpu_usage и ram_usage)
         for m in telemetry.metrics:
-            g = Gauge(f"device_{m.name.replace('.', '_')}", f"Metric: {m.name}", ["source"], registry=registry)
-            g.labels(source=device_serial).set(m.value)
+            name = f"device_{m.name.replace('.', '_')}"
+            values[name] = m.value
+            samples.append((name, m.value, metric_timestamp(m, received_at)))
 
         # 4. Состояние устройства
         if telemetry.state:
-            bat = Gauge("device_battery_level", "Battery level", ["source"], registry=registry)
-            bat.labels(source=device_serial).set(telemetry.state.battery_level)
-            
-            sig = Gauge("device_signal_strength", "Signal strength", ["source"], registry=registry)
-            sig.labels(source=device_serial).set(telemetry.state.signal_strength)
-
-        try:
-            push_to_gateway(
-                PUSHGATEWAY_URL, 
-                job="telemetry_processor", # Фиксированное имя job
-                registry=registry,
-                grouping_key={'serial': device_serial} # ID устройства передаем сюда
-            )
-        except Exception as e:
-            print(f"Pushgateway Error: {e}")    
+            values["device_battery_level"] = telemetry.state.battery_level
+            values["device_signal_strength"] = telemetry.state.signal_strength
+            samples.append(("device_battery_level", telemetry.state.battery_level, received_at))
+            samples.append(("device_signal_strength", telemetry.state.signal_strength, received_at))
+
+        metrics_exporter.update(device_serial, values)
+        telemetry_writer.submit(device_serial, samples)
+        # Потоковый детектор аномалий: событие появляется на этом же сообщении
+        online_anomalies.observe(device_serial, samples)
 
         # 6. Отправка логов в Loki
         if telemetry.logs:
-            await send_logs_batch_to_loki(device_serial, telemetry.logs)
+            log_shipper.submit(device_serial, telemetry.logs)
   
 
 
         if telemetry.coredump:
-
-            with tempfile.NamedTemporaryFile(mode='wb', suffix='.b64', delete=False) as tmp:
-                tmp.write(telemetry.coredump)
-                temp_core_path = tmp.name
-                
-            
-                decoder = CoreDumpDecoder(prog="utils/esp32.elf", core=temp_core_path)
-                coredump = decoder.info_corefile()
-
-                
-                type_mapping = {
-                    'abort': models.IssueTypeEnum.abort,
-                    'assert': models.IssueTypeEnum.assertion,
-                    'watchdog': models.IssueTypeEnum.watchdog
-                }
-                
-                coredump_type = type_mapping.get(coredump.get("type", "").lower())
-
-                with SessionLocal() as db:
-                    
-                    device = db.query(models.Device).filter(models.Device.serial == device_serial).first()
-    
-                    if not device:
-                        print(f"Device {device_serial} not found")
-                        return
-
-                    issue = db.query(models.Issue).filter(
-                        models.Issue.name == coredump["reason"]
-                    ).first()
-
-                    if not issue:
-                        issue = models.Issue(
-                            name=coredump["reason"],
-                            type=coredump_type,
-                            
-                        )
-                        db.add(issue)
-                        db.flush()
-
-                    new_trace = models.Trace(
-                        issue_id=issue.id,
-                        device_id=device.id,
-                        core_dump=json.dumps(coredump),
-                        occurrence=datetime.now()
-                    )
-
-                    db.add(new_trace)
-                    
-
-                    db.commit()
-                    
-        with SessionLocal() as db:
-            db.query(models.Device).filter(models.Device.serial == device_serial).update({
-                "last_sync": datetime.now(timezone.utc)
-            })
-            db.commit()
+            # Сохраняем сырой дамп, GDB-разбор выполнит пул воркеров
+            with SessionLocal() as db:
+                device = db.query(models.Device).filter(models.Device.serial == device_serial).first()
+
+                if not device:
+                    print(f"Device {device_serial} not found")
+                    return
+
+                store_raw_coredump(
+                    db, device, telemetry.coredump,
+                    occurrence=datetime.now(),
+                    firmware_version=telemetry.info.firmware_version,
+                )
+            coredump_jobs.notify()
+
+        # last_sync пишется в БД пачкой раз в LAST_SEEN_FLUSH_INTERVAL
+        last_seen.touch(device_serial, received_at)
 
     except Exception as e:
         print(f"MQTT Processing Error: {e}")
@@ -0,0 +1,409 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy
+import statsmodels
+from scipy.optimize import minimize
+
+
+EWM_SPAN = 5
+# Те же константы, что у statsmodels ExponentialSmoothing.fit() и L-BFGS-B по умолчанию
+LOWER_BOUND = np.sqrt(np.finfo(float).eps)
+PHI = 0.99
+PHI_BOUNDS = (0.8, 0.995)
+FD_STEP = 1e-8
+MAX_FUN = 15000
+# Сколько рядов оптимизируются одновременно (по потоку на ряд) и сколько рядов за раз идут по сетке;
+# выше ~32 батч целевой функции уже не дешевеет, а потоков становится больше
+LOCKSTEP_ROWS = int(os.getenv("BATCH_FORECAST_LOCKSTEP_ROWS", "32"))
+BRUTE_ROWS = int(os.getenv("BATCH_FORECAST_BRUTE_ROWS", "2"))
+
+# Код повторяет внутренности statsmodels/scipy; совпадение до бита проверено только на этих версиях
+VERIFIED_WITH = {"statsmodels": "0.15.0", "scipy": "1.17.1"}
+
+
+def verified():
+    """True when the installed statsmodels and scipy are the versions parity was checked against."""
+    return {"statsmodels": statsmodels.__version__, "scipy": scipy.__version__} == VERIFIED_WITH
+
+
+def smooth(matrix):
+    """pandas ewm(span=EWM_SPAN).mean() of every row of a (series x time) array."""
+    return pd.DataFrame(np.asarray(matrix, dtype=float).T).ewm(span=EWM_SPAN).mean().to_numpy().T
+
+
+def initial_states(smoothed, period):
+    """
+    statsmodels' heuristic initial level, trend and seasons for every row:
+    (l0 (N,), b0 (N,), s0 (N, period)).
+    """
+    n = smoothed.shape[1]
+    min_obs = 10 + 2 * (period // 2)
+    if n < max(min_obs, 2 * period):
+        raise ValueError(f"Need at least {max(min_obs, 2 * period)} points, got {n}")
+    cycles = max(min(5, n // period), int(np.ceil(min_obs / period)))
+
+    # Колонки DataFrame — ряды, чтобы rolling считался тем же кодом, что и для одного ряда
+    series = pd.DataFrame(smoothed[:, :period * cycles].T)
+    trend = series.rolling(period, center=True).mean()
+    if period % 2 == 0:
+        trend = trend.shift(-1).rolling(2).mean()
+
+    detrended = (series - trend).to_numpy().T
+    head = trend.dropna().to_numpy()[:10].T
+    solve = np.linalg.pinv(np.c_[np.ones(10), np.arange(10) + 1])
+
+    # Мелкие свертки — построчно и в том же виде, что в statsmodels: так совпадают до бита
+    seasons = np.empty((smoothed.shape[0], period))
+    level, slope = np.empty(smoothed.shape[0]), np.empty(smoothed.shape[0])
+    for row in range(smoothed.shape[0]):
+        seasons[row] = np.nanmean(detrended[row].reshape(cycles, period).T, axis=1)
+        seasons[row] -= np.mean(seasons[row])
+        level[row], slope[row] = solve.dot(np.atleast_2d(head[row]).T)[:, 0]
+    return level, slope, seasons
+
+
+def brute_grid(ns=87 // 3):
+    """(alpha, beta, gamma) starting grid of ExponentialSmoothing.fit(use_brute=True)."""
+    step = 0.005
+    combined = []
+    for a in np.linspace(step, 1 - step, ns):
+        b = np.linspace(0.0, min(1.0, a), int(np.ceil(ns * np.sqrt(a))))
+        g = np.linspace(0.0, min(1.0, 1 - a), int(np.ceil(ns * np.sqrt(1 - a))))
+        both = np.stack(np.meshgrid(b, g)).reshape(2, -1).T
+        combined.append(np.c_[np.full(len(both), a), both])
+    return np.vstack(combined)
+
+
+def _restrict(x):
+    """Unrestricted [0, 1] (a, b, g) -> alpha, beta <= alpha, gamma <= 1 - alpha."""
+    a = LOWER_BOUND + x[..., 0] * ((1 - LOWER_BOUND) - LOWER_BOUND)
+    b = 0.0 + x[..., 1] * (np.minimum(a, 1.0) - 0.0)
+    g = 0.0 + x[..., 2] * (np.minimum(1.0 - a, 1.0) - 0.0)
+    return a, b, g
+
+
+def _unrestrict(params):
+    a, b, g = params[:, 0], params[:, 1], params[:, 2]
+    return np.c_[
+        (a - LOWER_BOUND) / ((1 - LOWER_BOUND) - LOWER_BOUND),
+        (b - 0.0) / (np.minimum(a, 1.0) - 0.0),
+        (g - 0.0) / (np.minimum(1.0 - a, 1.0) - 0.0),
+    ]
+
+
+def sse(yt, alpha, beta, gamma, phi, level, trend, seasons):
+    """
+    One-step-ahead squared error of additive damped Holt-Winters for many
+    parameter sets at once: the parameters have any common shape S,
+    seasons are (period,) + S and yt is (time,) + anything broadcasting to S.
+    Returns an S-shaped array.
+
+    The recursion does the same floating point operations as statsmodels'
+    smoother and the errors are summed the same way (err @ err), so the
+    result matches it bit for bit.
+    """
+    n, m = yt.shape[0], seasons.shape[0]
+    s = seasons.copy()
+    alphac, gammac, betac_phi = 1 - alpha, 1 - gamma, (1 - beta) * phi
+    level, trend = level.copy(), trend.copy()
+    new_level, tmp, damped = np.empty_like(level), np.empty_like(level), np.empty_like(level)
+    err = np.empty((n,) + level.shape)
+
+    for i in range(n):
+        if i:
+            y = yt[i - 1]
+            # s[i - 1] заменяется на s[i + m - 1] — это одна и та же ячейка кольца
+            s_prev = s[(i - 1) % m]
+            np.multiply(phi, trend, out=damped)
+            damped += level
+            # level = alpha*y - alpha*s + alphac*damped
+            np.multiply(alpha, y, out=new_level)
+            np.multiply(alpha, s_prev, out=tmp)
+            new_level -= tmp
+            np.multiply(alphac, damped, out=tmp)
+            new_level += tmp
+            # trend = beta*(level - prev_level) + betac*phi*trend
+            np.subtract(new_level, level, out=tmp)
+            tmp *= beta
+            trend *= betac_phi
+            trend += tmp
+            # season = gamma*y - gamma*damped + gammac*s
+            np.multiply(gamma, y, out=tmp)
+            damped *= gamma
+            tmp -= damped
+            s_prev *= gammac
+            s_prev += tmp
+            level, new_level = new_level, level
+        # err = y - (level + phi*trend + s)
+        np.multiply(phi, trend, out=tmp)
+        tmp += level
+        tmp += s[i % m]
+        np.subtract(yt[i], tmp, out=err[i])
+
+    err = np.ascontiguousarray(err.reshape(n, -1).T)
+    return np.matmul(err[:, None, :], err[:, :, None])[:, 0, 0].reshape(level.shape)
+
+
+def brute_start(smoothed, level, trend, seasons):
+    """Best brute_grid point per row, with the other parameters held at their initial values."""
+    points = brute_grid()
+    g = len(points)
+    best = np.empty((smoothed.shape[0], 3))
+    for start in range(0, smoothed.shape[0], BRUTE_ROWS):
+        block = slice(start, start + BRUTE_ROWS)
+        k = len(smoothed[block])
+        grid = [np.broadcast_to(points[:, c], (k, g)) for c in range(3)]
+        errors = sse(
+            smoothed[block].T[:, :, None], *grid, np.full((k, g), PHI),
+            np.repeat(level[block, None], g, axis=1), np.repeat(trend[block, None], g, axis=1),
+            np.repeat(seasons[block].T[:, :, None], g, axis=2),
+        )
+        # Как в statsmodels: первый строгий минимум, NaN пропускаются
+        errors[np.isnan(errors)] = np.inf
+        best[block] = points[np.argmin(errors, axis=1)]
+    return best
+
+
+def _bounds(period):
+    lb = np.r_[0.0, 0.0, 0.0, -np.inf, -np.inf, PHI_BOUNDS[0], np.full(period, -np.inf)]
+    ub = np.r_[1.0, 1.0, 1.0, np.inf, np.inf, PHI_BOUNDS[1], np.full(period, np.inf)]
+    return lb, ub
+
+
+def _enforce_bounds(params, lb, ub):
+    """Moves starting values off the bounds like statsmodels does before L-BFGS-B."""
+    p = params.copy()
+    low = p <= lb
+    cols = np.nonzero(low)[1]
+    p[low] = lb[cols] + 1e-4 * (np.where(np.isfinite(ub), ub, 100.0)[cols] - lb[cols])
+    high = p >= ub
+    cols = np.nonzero(high)[1]
+    p[high] = ub[cols] - 1e-4 * (ub[cols] - np.where(np.isfinite(lb), lb, -100.0)[cols])
+    return p
+
+
+def _fd_steps(x, lb, ub):
+    """Forward-difference steps scipy's L-BFGS-B takes at x (k, d)."""
+    h = np.full(x.shape, FD_STEP)
+    sign = (x >= 0) * 2.0 - 1
+    h = np.where((x + h) - x == 0, np.finfo(float).eps ** 0.5 * sign * np.maximum(1.0, np.abs(x)), h)
+    lower, upper = x - lb, ub - x
+    outside = ((x + h) < lb) | ((x + h) > ub)
+    fitting = np.abs(h) <= np.maximum(lower, upper)
+    h[outside & fitting] *= -1
+    forward = (upper >= lower) & ~fitting
+    h[forward] = upper[forward]
+    backward = (upper < lower) & ~fitting
+    h[backward] = -lower[backward]
+    return h
+
+
+class _Lockstep:
+    """
+    Each row runs its own scipy L-BFGS-B in a thread; objective calls wait
+    here until every running row has asked, then all of them (and their
+    finite-difference points) are evaluated as one batch.
+
+    This barrier is what caps the speedup at about 3x: scipy's own
+    per-iteration work (~85us of Python per row) still runs once per row
+    under the GIL, every round waits for the slowest row, and rows that
+    converge early leave smaller batches behind.
+    """
+
+    def __init__(self, evaluate, running):
+        self.evaluate = evaluate
+        self.running = running
+        self.lock = threading.Lock()
+        self.waiting = {}
+        self.results = {}
+
+    def call(self, row, x):
+        event = threading.Event()
+        with self.lock:
+            self.waiting[row] = (x.copy(), event)
+            self._flush()
+        event.wait()
+        result = self.results.pop(row)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def done(self):
+        with self.lock:
+            self.running -= 1
+            self._flush()
+
+    def _flush(self):
+        if not self.waiting or len(self.waiting) < self.running:
+            return
+        rows = list(self.waiting)
+        try:
+            values, grads = self.evaluate(rows, np.array([self.waiting[row][0] for row in rows]))
+            results = [(float(v), g) for v, g in zip(values, grads)]
+        except Exception as e:
+            results = [e] * len(rows)
+        for row, result in zip(rows, results):
+            self.results[row] = result
+            self.waiting.pop(row)[1].set()
+
+
+def optimize(smoothed, start, period):
+    """
+    L-BFGS-B from `start` (N, 6 + period; statsmodels parameter order,
+    restricted) for every row. Returns the fitted parameters, same order.
+    """
+    lb, ub = _bounds(period)
+    start = _enforce_bounds(start, lb, ub)
+    start[:, :3] = _unrestrict(start)
+    yt = smoothed.T
+    d = start.shape[1]
+    cols = np.arange(d)
+
+    def evaluate(rows, x):
+        h = _fd_steps(x, lb, ub)
+        # Точка и d ее сдвигов по одной координате — как scipy approx_derivative
+        points = np.repeat(x[:, None, :], d + 1, axis=1)
+        points[:, cols + 1, cols] += h
+        points = points.reshape(-1, d)
+        values = sse(
+            yt[:, np.repeat(rows, d + 1)], *_restrict(points), points[:, 5], points[:, 3], points[:, 4],
+            np.ascontiguousarray(points[:, 6:].T),
+        ).reshape(len(rows), d + 1)
+        grads = (values[:, 1:] - values[:, :1]) / ((x + h) - x)
+        return values[:, 0], grads
+
+    fitted = start.copy()
+    # statsmodels считает функцию 1 + d раз на градиент; лимит тот же
+    options = {"maxfun": MAX_FUN // (d + 1)}
+    bounds = list(zip(np.where(np.isfinite(lb), lb, None), np.where(np.isfinite(ub), ub, None)))
+
+    for first in range(0, len(start), LOCKSTEP_ROWS):
+        rows = range(first, min(first + LOCKSTEP_ROWS, len(start)))
+        lockstep = _Lockstep(evaluate, len(rows))
+
+        def solve(row):
+            try:
+                res = minimize(
+                    lambda x: lockstep.call(row, x), start[row], jac=True,
+                    bounds=bounds, method="L-BFGS-B", options=options,
+                )
+                fitted[row] = res.x
+            finally:
+                lockstep.done()
+
+        with ThreadPoolExecutor(max_workers=len(rows)) as pool:
+            list(pool.map(solve, rows))
+
+    fitted[:, :3] = np.c_[_restrict(fitted)]
+    return fitted
+
+
+def fit(smoothed, period=30, start_params=None):
+    """
+    Fits ExponentialSmoothing(trend='add', seasonal='add', damped_trend=True)
+    to every row of `smoothed`, like fit() (brute-force start) or, with
+    `start_params` (N, 6 + period), like fit(start_params=..., use_brute=False).
+    """
+    smoothed = np.asarray(smoothed, dtype=float)
+    if start_params is None:
+        level, trend, seasons = initial_states(smoothed, period)
+        start = np.empty((smoothed.shape[0], 6 + period))
+        start[:, :3] = brute_start(smoothed, level, trend, seasons)
+        start[:, 3], start[:, 4], start[:, 5], start[:, 6:] = level, trend, PHI, seasons
+    else:
+        start = np.array(start_params, dtype=float)
+    return optimize(smoothed, start, period)
+
+
+def final_states(smoothed, params, period=30):
+    """Level, trend (N,) and next `period` seasons (N, period) after the last point."""
+    alpha, beta, gamma, phi = params[:, 0], params[:, 1], params[:, 2], params[:, 5]
+    level, trend = params[:, 3].copy(), params[:, 4].copy()
+    s = params[:, 6:].T.copy()
+    for i in range(smoothed.shape[1]):
+        y = smoothed[:, i]
+        j = i % period
+        last = s[j].copy()
+        damped = level + trend * phi
+        new_level = alpha * y - alpha * s[j] + (1 - alpha) * damped
+        trend = beta * (new_level - level) + (1 - beta) * (trend * phi)
+        s[j] = gamma * y - gamma * damped + (1 - gamma) * s[j]
+        level = new_level
+    # После n шагов s[n % period] — сезон следующей точки
+    seasons = np.roll(s.T, -(smoothed.shape[1] % period), axis=1)
+    # statsmodels в прогнозе берет последний слот сезона до его последнего обновления
+    seasons[:, -1] = last
+    return level, trend, seasons
+
+
+def forecast(level, trend, seasons, phi, steps):
+    """(N, steps) damped-trend forecasts."""
+    damping = np.cumsum(phi[:, None] ** np.arange(1, steps + 1), axis=1)
+    h = np.arange(steps) % seasons.shape[1]
+    return level[:, None] + trend[:, None] * damping + seasons[:, h]
+
+
+def first_crossing(forecasts, threshold):
+    """Index of the first forecast step >= threshold per row, -1 if none."""
+    above = forecasts >= threshold
+    return np.where(above.any(axis=1), above.argmax(axis=1), -1)
+
+
+def batch_prediction(matrix, period=30, forecast_steps=50, threshold=85.0, start_params=None):
+    """
+    Whole pipeline of model_prediction_report for a (series x time) array:
+    dict of smoothed (N, T), params (N, 6 + period), forecast (N, steps)
+    and crossing (N,) arrays.
+    """
+    smoothed = smooth(matrix)
+    if not np.isfinite(smoothed).all():
+        raise ValueError("Smoothed series contain NaN or inf")
+    params = fit(smoothed, period, start_params)
+    level, trend, seasons = final_states(smoothed, params, period)
+    forecasts = forecast(level, trend, seasons, params[:, 5], forecast_steps)
+    return {
+        "smoothed": smoothed,
+        "params": params,
+        "forecast": forecasts,
+        "crossing": first_crossing(forecasts, threshold),
+    }
+
+
+def batch_reports(matrix, period=30, forecast_steps=50, threshold=85.0):
+    """model_prediction_report for every row of a (series x time) array."""
+    matrix = np.asarray(matrix, dtype=float)
+    if matrix.shape[1] < 2 * period:
+        return [{
+            "status": "collecting_data",
+            "message": f"Недостаточно данных. Нужно {2*period}, есть {matrix.shape[1]}",
+            "minutes_until_failure": -1
+        } for _ in range(matrix.shape[0])]
+
+    # Ряды, которые не сгладились до конечных значений, statsmodels все равно не подгонит
+    valid = np.isfinite(smooth(matrix)).all(axis=1)
+    result = batch_prediction(matrix[valid], period, forecast_steps, threshold) if valid.any() else None
+    reports = []
+    for row in range(matrix.shape[0]):
+        if not valid[row]:
+            reports.append({"status": "error", "message": "Series contain NaN or inf values"})
+            continue
+        index = np.count_nonzero(valid[:row])
+        crossing = result["crossing"][index]
+        if crossing >= 0:
+            minutes_to_fail = int((crossing + 1) * 2)
+            status = "critical" if minutes_to_fail < 30 else "warning"
+        else:
+            minutes_to_fail = -1
+            status = "stable"
+        reports.append({
+            "status": status,
+            "minutes_until_failure": minutes_to_fail,
+            "current_value": round(float(matrix[row, -1]), 2),
+            "forecast_max": round(float(result["forecast"][index].max()), 2),
+            "threshold": threshold
+        })
+    return reports
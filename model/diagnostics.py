@@ -0,0 +1,26 @@
+from statsmodels.tsa.seasonal import STL
+from adtk.detector import InterQuartileRangeAD
+
+
+def get_device_diagnostics(df, period=30):
+      #stl = STL(df['mcu_internal_temp_celsius'], period=period, robust=True)
+      # модель анализирует датафрейм только по одной метрике, например device_cpu_usage, и метрики только числовые.
+      #
+      stl = STL(df, period=period, robust=True)
+
+      res = stl.fit()
+
+      iqr_detector = InterQuartileRangeAD(c=2)
+      anomalies = iqr_detector.fit_detect(res.resid)
+
+      anomaly_timestamps = anomalies[anomalies].index.strftime('%Y-%m-%d %H:%M:%S').tolist()
+
+      trend_diff = res.trend.iloc[-1] - res.trend.iloc[0]
+
+      return {
+            "status": "warning" if len(anomaly_timestamps) > 0 else "stable",
+            "anomaly_count": len(anomaly_timestamps),
+            "critical_points": anomaly_timestamps, 
+            "degradation_value": round(trend_diff, 2),
+            "is_degrading": bool(trend_diff > 2.0)
+      }
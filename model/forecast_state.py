@@ -0,0 +1,233 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+from model import batch_forecast
+
+
+EWM_SPAN = 5
+# Полная переоптимизация параметров не чаще, чем раз в столько секунд (и при дрейфе)
+REFIT_SECONDS = float(os.getenv("FORECAST_REFIT_SECONDS", "600"))
+# Дрейф: скользящая ошибка прогноза на шаг вперед выросла во столько раз относительно ошибки при подгонке
+DRIFT_FACTOR = float(os.getenv("FORECAST_DRIFT_FACTOR", "3.0"))
+DRIFT_MIN_POINTS = int(os.getenv("FORECAST_DRIFT_MIN_POINTS", "10"))
+ERROR_DECAY = 0.1
+
+
+def _ewm_state(values):
+    """Numerator/denominator of pandas ewm(span=EWM_SPAN, adjust=True) after `values`."""
+    decay = 1 - 2 / (EWM_SPAN + 1)
+    num = den = 0.0
+    for x in values:
+        num = x + decay * num
+        den = 1 + decay * den
+    return num, den
+
+
+def _model(values, period, **initial):
+    smoothed = pd.Series(values).ewm(span=EWM_SPAN).mean()
+    return ExponentialSmoothing(
+        smoothed,
+        trend='add',
+        seasonal='add',
+        seasonal_periods=period,
+        damped_trend=True,
+        **initial
+    )
+
+
+def fit_state(values, period=30, previous=None):
+    """
+    Fully optimizes the model_prediction_report model on `values` (raw,
+    oldest first) and returns its state. With `previous`, the optimizer
+    starts from its parameters instead of the brute-force grid.
+    """
+    model = _model(values, period)
+    fitted = None
+    if previous is not None:
+        try:
+            fitted = model.fit(start_params=np.asarray(previous["start_params"]), use_brute=False)
+        except Exception:
+            fitted = None
+    if fitted is None:
+        fitted = model.fit()
+    return _state(fitted, values, period)
+
+
+def state_from_params(values, params, period=30):
+    """
+    State of the model on `values` with already optimized `params`
+    (statsmodels order: alpha, beta, gamma, l0, b0, phi, seasons), as
+    fit_state would return it; the smoother runs once, nothing is optimized.
+    """
+    params = np.asarray(params, dtype=float)
+    model = _model(
+        values, period, initialization_method="known",
+        initial_level=params[3], initial_trend=params[4], initial_seasonal=params[6:],
+    )
+    fitted = model.fit(
+        smoothing_level=params[0], smoothing_trend=params[1], smoothing_seasonal=params[2],
+        damping_trend=params[5], optimized=False,
+    )
+    return _state(fitted, values, period)
+
+
+def _state(fitted, values, period):
+    p = fitted.params
+    num, den = _ewm_state(values)
+    return {
+        "period": period,
+        "alpha": float(p["smoothing_level"]),
+        "beta": float(p["smoothing_trend"]),
+        "gamma": float(p["smoothing_seasonal"]),
+        "phi": float(p["damping_trend"]),
+        "level": float(fitted.level.iloc[-1]),
+        "trend": float(fitted.trend.iloc[-1]),
+        # season[0] — сезонная компонента для следующего наблюдения
+        "season": [float(s) for s in np.asarray(fitted.season)[-period:]],
+        "start_params": np.r_[
+            p["smoothing_level"], p["smoothing_trend"], p["smoothing_seasonal"],
+            p["initial_level"], p["initial_trend"], p["damping_trend"], p["initial_seasons"],
+        ].tolist(),
+        "ewm_num": num,
+        "ewm_den": den,
+        "last_value": float(values[-1]),
+        "fitted_at": time.time(),
+        "points_since_fit": 0,
+        "baseline_error": float(np.mean(np.abs(fitted.resid))),
+        "recent_error": None,
+    }
+
+
+def update_state(state, values):
+    """Runs the Holt-Winters recursions over new raw `values` without re-optimizing."""
+    decay = 1 - 2 / (EWM_SPAN + 1)
+    a, b, g, phi = state["alpha"], state["beta"], state["gamma"], state["phi"]
+    level, trend, season = state["level"], state["trend"], list(state["season"])
+    num, den, error = state["ewm_num"], state["ewm_den"], state["recent_error"]
+
+    for x in values:
+        num = x + decay * num
+        den = 1 + decay * den
+        y = num / den
+
+        s_old = season.pop(0)
+        residual = abs(y - (level + phi * trend + s_old))
+        error = residual if error is None else (1 - ERROR_DECAY) * error + ERROR_DECAY * residual
+
+        prev_level, prev_trend = level, trend
+        level = a * (y - s_old) + (1 - a) * (prev_level + phi * prev_trend)
+        trend = b * (level - prev_level) + (1 - b) * phi * prev_trend
+        season.append(g * (y - prev_level - phi * prev_trend) + (1 - g) * s_old)
+
+    if len(values):
+        state.update(
+            level=level, trend=trend, season=season, ewm_num=num, ewm_den=den, recent_error=error,
+            last_value=float(values[-1]), points_since_fit=state["points_since_fit"] + len(values),
+        )
+    return state
+
+
+def needs_refit(state, now=None):
+    now = now or time.time()
+    if now - state["fitted_at"] >= REFIT_SECONDS:
+        return True
+    if state["points_since_fit"] >= DRIFT_MIN_POINTS and state["recent_error"] is not None:
+        return state["recent_error"] > DRIFT_FACTOR * max(state["baseline_error"], 1e-6)
+    return False
+
+
+def forecast(state, steps):
+    h = np.arange(1, steps + 1)
+    damped = np.cumsum(state["phi"] ** h)
+    season = np.asarray(state["season"])
+    return state["level"] + damped * state["trend"] + season[(h - 1) % state["period"]]
+
+
+def state_report(state, forecast_steps=50, threshold=85.0):
+    """Same shape and rules as model_prediction_report, computed from a state."""
+    values = forecast(state, forecast_steps)
+    overheat_points = np.where(values >= threshold)[0]
+
+    if len(overheat_points) > 0:
+        minutes_to_fail = int((overheat_points[0] + 1) * 2)
+        status = "critical" if minutes_to_fail < 30 else "warning"
+    else:
+        minutes_to_fail = -1
+        status = "stable"
+
+    return {
+        "status": status,
+        "minutes_until_failure": minutes_to_fail,
+        "current_value": round(state["last_value"], 2),
+        "forecast_max": round(float(values.max()), 2),
+        "threshold": threshold
+    }
+
+
+def forecast_with_state(values, new_values, state, period=30, forecast_steps=50, threshold=85.0):
+    """
+    (report, state, refitted). `values` is the full recent window (oldest
+    first) used for a refit; `new_values` are the points the state has not
+    seen yet. The state is refitted when missing, stale or drifting, and
+    otherwise only rolled forward over `new_values`.
+    """
+    if len(values) < 2 * period:
+        return {
+            "status": "collecting_data",
+            "message": f"Недостаточно данных. Нужно {2*period}, есть {len(values)}",
+            "minutes_until_failure": -1
+        }, state, False
+    try:
+        refitted = False
+        if state is not None:
+            state = update_state(state, new_values)
+        if state is None or needs_refit(state):
+            state = fit_state(values, period, previous=state)
+            refitted = True
+        return state_report(state, forecast_steps, threshold), state, refitted
+    except Exception as e:
+        return {"status": "error", "message": str(e)}, None, False
+
+
+def forecast_many_with_state(items, period=30, forecast_steps=50, threshold=85.0):
+    """
+    forecast_with_state for [(values, new_values, state)], same results in
+    the same order. Refits of equal-length windows are optimized together
+    by model/batch_forecast.py; a group it cannot fit is refitted one
+    series at a time.
+    """
+    results = [None] * len(items)
+    refits = {}  # (длина окна, теплый старт) -> [(индекс, values, прежнее состояние)]
+    for i, (values, new_values, state) in enumerate(items):
+        if len(values) < 2 * period:
+            results[i] = forecast_with_state(values, new_values, state, period, forecast_steps, threshold)
+            continue
+        try:
+            if state is not None:
+                state = update_state(state, new_values)
+            if state is None or needs_refit(state):
+                refits.setdefault((len(values), state is not None), []).append((i, values, state))
+            else:
+                results[i] = (state_report(state, forecast_steps, threshold), state, False)
+        except Exception as e:
+            results[i] = ({"status": "error", "message": str(e)}, None, False)
+
+    for (_, warm), group in refits.items():
+        try:
+            matrix = np.array([values for _, values, _ in group], dtype=float)
+            start = np.array([previous["start_params"] for _, _, previous in group]) if warm else None
+            params = batch_forecast.fit(batch_forecast.smooth(matrix), period, start)
+            states = [state_from_params(values, p, period) for (_, values, _), p in zip(group, params)]
+        except Exception:
+            states = None
+        for k, (i, values, previous) in enumerate(group):
+            try:
+                state = states[k] if states is not None else fit_state(values, period, previous)
+                results[i] = (state_report(state, forecast_steps, threshold), state, True)
+            except Exception as e:
+                results[i] = ({"status": "error", "message": str(e)}, None, False)
+    return results
@@ -1,18 +1,16 @@
 import pandas as pd
-from statsmodels.tsa.seasonal import STL
-from adtk.detector import InterQuartileRangeAD
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
+from typing import Optional
 import models
 from utils.dependencies import get_db
-import httpx
+from utils.metric_history import metric_history
+from utils.anomaly_scan import anomaly_scanner
+from model.diagnostics import get_device_diagnostics
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
 import numpy as np
 router = APIRouter(prefix="/model", tags=["Model"])
 
-
-PROMETHEUS_BASE = "http://prometheus:9090/api/v1"
-
 async def get_data_from_db(device_id: int, db: Session, metric_name: str, limit_minutes=150):
     serial = db.query(models.Device.serial).filter(models.Device.id == device_id).scalar()
     
@@ -20,25 +18,13 @@ async def get_data_from_db(device_id: int, db: Session, metric_name: str, limit_
         print(f"DEBUG: Device with id {device_id} not found in DB")
         return pd.DataFrame()
 
-    url = f"{PROMETHEUS_BASE}/query_range"
-    params = {
-        "query": f'{metric_name}{{serial="{serial}"}}',
-        "start": pd.Timestamp.now().timestamp() - (limit_minutes * 60),
-        "end": pd.Timestamp.now().timestamp(),
-        "step": "60s"
-    }
-
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, params=params)
-        data = resp.json()
-        
-    results = data.get("data", {}).get("result", [])
-    if not results:
+    end = int(pd.Timestamp.now().timestamp())
+    # Своя телеметрия (device_telemetry / rollups), Prometheus — только запасной вариант
+    values = await metric_history(db, device_id, serial, metric_name, end - (limit_minutes * 60), end, step=60)
+    if not values:
         return pd.DataFrame()
 
-    values = results[0].get("values", []) 
-    
-    df = pd.DataFrame(values, columns=['timestamp', 'value'])
+    df = pd.DataFrame(values).rename(columns={'time': 'timestamp'})
     df['timestamp'] = pd.to_datetime(df['timestamp'].astype(float), unit='s')
     df['value'] = pd.to_numeric(df['value'])
     
@@ -54,6 +40,27 @@ async def get_device_anomalies(device_id: int, metric: str = "device_cpu_usage",
     report = get_device_diagnostics(df['value'])
     return report
 
+@router.get('/get_group_anomalies')
+async def get_group_anomalies(group_id: int, metric: str = "device_cpu_usage", limit: Optional[int] = Query(None, ge=1), db: Session = Depends(get_db)):
+    devices = db.query(models.Device.id, models.Device.serial).filter(models.Device.group_id == group_id).all()
+
+    if not devices:
+        return {"error": "No devices found for this group"}
+
+    # Все устройства группы одной выборкой, STL — в пуле процессов, отчеты кэшируются до новых данных
+    return await anomaly_scanner.scan(db, [tuple(d) for d in devices], metric, limit=limit)
+
+@router.get('/get_project_anomalies')
+async def get_project_anomalies(project_id: int, metric: str = "device_cpu_usage", limit: Optional[int] = Query(None, ge=1), db: Session = Depends(get_db)):
+    devices = db.query(models.Device.id, models.Device.serial).join(
+        models.Group, models.Device.group_id == models.Group.id
+    ).filter(models.Group.project_id == project_id).all()
+
+    if not devices:
+        return {"error": "No devices found for this project"}
+
+    return await anomaly_scanner.scan(db, [tuple(d) for d in devices], metric, limit=limit)
+
 @router.get('/get_prediction_report')
 async def get_prediction_report(device_id: int, metric: str = "device_cpu_usage", db: Session = Depends(get_db)):
     df = await get_data_from_db(device_id, db, metric_name=metric, limit_minutes = 150)
@@ -64,30 +71,6 @@ async def get_prediction_report(device_id: int, metric: str = "device_cpu_usage"
     report = model_prediction_report(df['value'])
     return report
 
-def get_device_diagnostics(df, period=30):
-      #stl = STL(df['mcu_internal_temp_celsius'], period=period, robust=True)
-      # модель анализирует датафрейм только по одной метрике, например device_cpu_usage, и метрики только числовые.
-      #
-      stl = STL(df, period=period, robust=True)
-
-      res = stl.fit()
-
-      iqr_detector = InterQuartileRangeAD(c=2)
-      anomalies = iqr_detector.fit_detect(res.resid)
-
-      anomaly_timestamps = anomalies[anomalies].index.strftime('%Y-%m-%d %H:%M:%S').tolist()
-
-      trend_diff = res.trend.iloc[-1] - res.trend.iloc[0]
-
-      return {
-            "status": "warning" if len(anomaly_timestamps) > 0 else "stable",
-            "anomaly_count": len(anomaly_timestamps),
-            "critical_points": anomaly_timestamps, 
-            "degradation_value": round(trend_diff, 2),
-            "is_degrading": bool(trend_diff > 2.0)
-      }
-
-
 def model_prediction_report(series, period=30, forecast_steps=50, threshold=85.0):
     if len(series) < 2 * period:
         return {
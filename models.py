@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Date, Enum, ForeignKey, Table, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, Date, Enum, ForeignKey, Table, JSON, LargeBinary, Index
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.types import UserDefinedType
 from datetime import datetime, timezone
 from database import Base
@@ -15,17 +15,55 @@ class IssueTypeEnum(enum.Enum):
     assertion = 'assert'
     watchdog = 'watchdog'
 
+class TraceStatusEnum(enum.Enum):
+    pending = 'pending'
+    decoded = 'decoded'
+    failed = 'failed'
+
 class Trace(Base):
     __tablename__ = 'traces'
+    __table_args__ = (
+        # Выборки issue по проекту/группе/устройству в окне времени, см. utils/issue_stats.py
+        Index('ix_traces_device_occurrence', 'device_id', 'occurrence'),
+        Index('ix_traces_issue_occurrence', 'issue_id', 'occurrence'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     issue_id = Column(Integer, ForeignKey('issues.id'))
     device_id = Column(Integer, ForeignKey('devices.id'))
     core_dump = Column(JSON)
     occurrence = Column(DateTime, default=datetime.now)
+
+    # Сырой дамп сохраняем сразу, разбор выполняется фоновыми воркерами
+    raw_dump = deferred(Column(LargeBinary, nullable=True))
+    status = Column(Enum(TraceStatusEnum), default=TraceStatusEnum.decoded, index=True)
+    decode_error = Column(String, nullable=True)
+    decode_mode = Column(String, default="triage")  # 'triage' (без GDB) или 'full'
+    firmware_version = Column(String, nullable=True)  # по нему выбирается ELF для разбора
     
     issue = relationship("Issue", back_populates="traces")
     device = relationship("Device", back_populates="traces")
+    memory_segments = relationship("TraceMemorySegment", back_populates="trace", order_by="TraceMemorySegment.index")
+
+class TraceMemorySegment(Base):
+    __tablename__ = 'trace_memory_segments'
+    __table_args__ = (
+        # Сегменты режутся при первом запросе; параллельные первые запросы не должны задвоить их
+        Index('ux_trace_memory_segments_trace_index', 'trace_id', 'index', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    trace_id = Column(Integer, ForeignKey('traces.id'), index=True)
+    index = Column(Integer)
+    name = Column(String)
+    address = Column(BigInteger)  # адреса 32-битные беззнаковые, в Integer не влезают
+    size = Column(Integer)
+    attrs = Column(String)
+
+    # Байты читаются только диапазонами через substr, в ORM-объект не грузятся
+    data = deferred(Column(LargeBinary))
+
+    trace = relationship("Trace", back_populates="memory_segments")
 
 class MetricMetadata(Base):
     __tablename__ = 'metric_metadata'
@@ -55,7 +93,7 @@ class Group(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     
-    project_id = Column(Integer, ForeignKey('projects.id'), nullable=True)
+    project_id = Column(Integer, ForeignKey('projects.id'), nullable=True, index=True)
     project = relationship("Project", back_populates="groups")
     
     devices = relationship("Device", back_populates="group")
@@ -70,7 +108,7 @@ class Device(Base):
     description = Column(String)
     last_sync = Column(DateTime, nullable=True)
     notes = Column(String, nullable=True)
-    group_id = Column(Integer, ForeignKey('groups.id'), nullable=True)
+    group_id = Column(Integer, ForeignKey('groups.id'), nullable=True, index=True)
     
     # Relationships
     group = relationship("Group", back_populates="devices")
@@ -104,6 +142,27 @@ class Issue(Base):
     # One-to-many to Trace
     traces = relationship("Trace", back_populates="issue")
 
+class IssueStats(Base):
+    # Поддерживается при привязке трейса к issue, см. utils/issue_stats.py
+    __tablename__ = 'issue_stats'
+
+    issue_id = Column(Integer, ForeignKey('issues.id'), primary_key=True)
+    trace_count = Column(Integer, nullable=False, default=0)
+    device_count = Column(Integer, nullable=False, default=0)
+    last_occurrence = Column(DateTime, index=True)
+
+
+class DeviceIssueStats(Base):
+    __tablename__ = 'device_issue_stats'
+    __table_args__ = (
+        Index('ix_device_issue_stats_issue', 'issue_id'),
+    )
+
+    device_id = Column(Integer, ForeignKey('devices.id'), primary_key=True)
+    issue_id = Column(Integer, ForeignKey('issues.id'), primary_key=True)
+    trace_count = Column(Integer, nullable=False, default=0)
+    last_occurrence = Column(DateTime)
+
 
 class PredictiveAlert(Base):
     __tablename__ = "predictive_alerts"
@@ -117,14 +176,53 @@ class PredictiveAlert(Base):
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
 
+class AnomalyEvent(Base):
+    # Аномалии, найденные потоковым детектором на приеме MQTT, см. utils/online_anomaly.py
+    __tablename__ = "anomaly_events"
+    __table_args__ = (
+        Index('ix_anomaly_events_device_time', 'device_id', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"))
+    metric_name = Column(String)
+    kind = Column(String)  # above_max, below_min, baseline_high, baseline_low
+    value = Column(Float)
+    baseline = Column(Float, nullable=True)
+    score = Column(Float, nullable=True)
+    threshold = Column(Float, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
 class DeviceTelemetry(Base):
+    # Секционирование по дням и ретенция — utils/telemetry_store.py,
+    # в Postgres таблица пересоздается как PARTITION BY RANGE (created_at)
     __tablename__ = 'device_telemetry'
+    __table_args__ = (
+        Index('ix_device_telemetry_device_metric_time', 'device_id', 'metric_name', 'created_at'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    device_id = Column(Integer, ForeignKey('devices.id'), index=True)
+    device_id = Column(Integer, ForeignKey('devices.id'))
     
-    metric_name = Column(String, index=True) 
+    metric_name = Column(String) 
     value = Column(Float)
     
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
+
+
+class TelemetryRollup(Base):
+    # Агрегаты device_telemetry по корзинам 1m/5m/1h, см. utils/telemetry_rollups.py
+    __tablename__ = 'telemetry_rollups'
+
+    device_id = Column(Integer, ForeignKey('devices.id'), primary_key=True)
+    metric_name = Column(String, primary_key=True)
+    resolution = Column(Integer, primary_key=True)  # секунды: 60, 300, 3600
+    bucket = Column(DateTime(timezone=True), primary_key=True)  # начало корзины, UTC
+
+    min = Column(Float)
+    max = Column(Float)
+    sum = Column(Float)
+    count = Column(Integer)
+    last = Column(Float)
+    last_at = Column(DateTime(timezone=True))
@@ -1,78 +1,29 @@
 from datetime import datetime, timezone
+import asyncio
 import time
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session, aliased
 from sqlalchemy import desc, select, func
 from typing import List
-from routers.projects import get_all_active_alerts
-import models, schemas, httpx
+import models, schemas
 from utils.dependencies import get_db
+from utils.last_seen import last_seen
+from utils.presence import presence
+from utils.issue_stats import issue_stats
+from utils.alert_cache import alert_cache
+from utils.telemetry_rollups import telemetry_rollups
+from utils.telemetry_store import telemetry_store
+from utils.online_anomaly import online_anomalies
+from utils.predictive_scheduler import predictive_scheduler
+from utils.metric_history import metric_history, device_series
+from utils.http_clients import http_clients
 from schemas import DeviceStatusEnum
 
 router = APIRouter(prefix="/devices", tags=["Devices"])
 
-PROMETHEUS_ALERTS_URL = "http://prometheus:9090/api/v1/alerts"
-PROMETHEUS_URL = "http://prometheus:9090/api/v1/query"
-
-# async def get_online_serials() -> set:
-#     try:
-#         async with httpx.AsyncClient() as client:
-#             query = 'device_runtime_status'
-#             resp = await client.get(PROMETHEUS_URL, params={"query": query}, timeout=3.0)
-            
-#             if resp.status_code != 200:
-#                 return set()
-
-#             data = resp.json()
-#             results = data.get("data", {}).get("result", [])
-            
-#             online_serials = set()
-#             for r in results:
-#                 metric_labels = r.get("metric", {})
-#                 s = metric_labels.get("serial")
-#                 if not s:
-#                     continue
-                
-#                 value_list = r.get("value", [])
-#                 if len(value_list) > 1 and str(value_list[1]) == "1":
-#                     online_serials.add(s)
-            
-#             print(f"DEBUG: Found online serials: {online_serials}") # Проверим, что находит
-#             return online_serials
-            
-#     except Exception as e:
-#         print(f"DEBUG: get_online_serials error: {e}")
-#         return set()
-
-async def get_online_serials() -> set:
-    
-    query = 'changes(device_cpu_usage[30s]) > 0'
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                PROMETHEUS_URL,
-                params={"query": query},
-                timeout=3.0
-            )
-            
-            if resp.status_code != 200:
-                return set()
+# URL для запросов в Loki (Query)
+LOKI_QUERY_PATH = "/loki/api/v1/query_range"
 
-            data = resp.json()
-            results = data.get("data", {}).get("result", [])
-            
-            online_serials = {
-                r["metric"]["serial"] 
-                for r in results 
-                if "serial" in r.get("metric", {})
-            }
-            
-            return online_serials
-    except Exception as e:
-        print(f"Request failed: {e}")
-        return set()
-    
 @router.post("", response_model=schemas.DeviceOut)
 def create_device(device: schemas.DeviceCreate, db: Session = Depends(get_db)):
     if device.group_id:
@@ -91,13 +42,12 @@ def create_device(device: schemas.DeviceCreate, db: Session = Depends(get_db)):
 async def list_devices(db: Session = Depends(get_db)):
     db_devices = db.query(models.Device).all()
 
-    online_serials = await get_online_serials()
+    await presence.sync()
+    now = datetime.now(timezone.utc)
 
     for dev in db_devices:
-        if dev.serial in online_serials:
-            dev.status = schemas.DeviceStatusEnum.ONLINE
-        else:
-            dev.status = schemas.DeviceStatusEnum.OFFLINE
+        dev.status = presence.status(dev.serial, now)
+        dev.last_seen = last_seen.get(dev.serial, dev.last_sync)
         
     return db_devices
 
@@ -107,11 +57,9 @@ async def get_device(device_id: int, db: Session = Depends(get_db)):
     if not db_device:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    online_serials = await get_online_serials()
-    if db_device.serial in online_serials:
-            db_device.status = schemas.DeviceStatusEnum.ONLINE
-    else:
-        db_device.status = schemas.DeviceStatusEnum.OFFLINE
+    await presence.sync()
+    db_device.status = presence.status(db_device.serial)
+    db_device.last_seen = last_seen.get(db_device.serial, db_device.last_sync)
     return db_device
 
 @router.patch("/{device_id}", response_model=schemas.DeviceOut)
@@ -132,11 +80,9 @@ async def update_device(device_id: int, device_update: schemas.DeviceUpdate, db:
     db.commit()
     db.refresh(db_device)
     
-    online_serials = await get_online_serials()
-    if db_device.serial in online_serials:
-            db_device.status = schemas.DeviceStatusEnum.ONLINE
-    else:
-        db_device.status = schemas.DeviceStatusEnum.OFFLINE
+    await presence.sync()
+    db_device.status = presence.status(db_device.serial)
+    db_device.last_seen = last_seen.get(db_device.serial, db_device.last_sync)
     return db_device
 
 @router.delete("/{device_id}")
@@ -144,6 +90,12 @@ def delete_device(device_id: int, db: Session = Depends(get_db)):
     db_device = db.query(models.Device).filter(models.Device.id == device_id).first()
     if not db_device:
         raise HTTPException(status_code=404, detail="Device not found")
+    # Строки, ссылающиеся на devices.id, убираем в той же транзакции, иначе FK не даст удалить
+    issue_stats.remove_device(db, device_id)
+    telemetry_store.remove_device(db, device_id)
+    telemetry_rollups.remove_device(db, device_id)
+    online_anomalies.remove_device(db, device_id)
+    predictive_scheduler.remove_device(db, device_id)
     db.delete(db_device)
     db.commit()
     return {"status": "success", "message": "Device deleted"}
@@ -160,42 +112,88 @@ async def get_metric_history(
         models.MetricMetadata.metric_name == metric_name
     ).first()
 
-    # 2. Запрос в Prometheus за цифрами
+    # 2. История: своя телеметрия, начало окна без наших точек — из Prometheus
     end_time = int(time.time())
     start_time = end_time - (hours * 3600)
     full_name = f"device_{metric_name.replace('.', '_')}"
-    
-    params = {
-        "query": f'{full_name}{{serial="{serial}"}}',
-        "start": start_time,
-        "end": end_time,
-        "step": "60s"
+    device_id = db.query(models.Device.id).filter(models.Device.serial == serial).scalar()
+
+    try:
+        history = await metric_history(db, device_id, serial, full_name, start_time, end_time, step=60)
+
+        return {
+            "metric_name": metric_name,
+            "display_name": meta.display_name_ru if meta else metric_name,
+            "unit": meta.unit if meta else "",
+            "history": history
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Metric history error: {e}")
+
+
+
+@router.get("/{serial}/metrics/{metric_name}/rollup", response_model=schemas.MetricRollupOut)
+def get_metric_rollup(
+    serial: str,
+    metric_name: str,
+    hours: int = Query(3, ge=1, le=24 * 365),
+    step: int = Query(60, ge=1),
+    db: Session = Depends(get_db)
+):
+    """min/max/avg/count/last по корзинам; разрешение выбирается самое грубое, подходящее под step"""
+    device_id = db.query(models.Device.id).filter(models.Device.serial == serial).scalar()
+    if device_id is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    full_name = f"device_{metric_name.replace('.', '_')}"
+    resolution, points = telemetry_rollups.history(db, device_id, full_name, hours, step)
+    return {"metric_name": metric_name, "resolution": resolution, "points": points}
+
+
+@router.get("/{device_id}/alerts", response_model=List[schemas.AlertWithMetadata])
+async def get_device_alerts(device_id: int, db: Session = Depends(get_db)):
+    serial = db.query(models.Device.serial).filter(models.Device.id == device_id).scalar()
+    if serial is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return await alert_cache.for_serial(serial)
+
+
+async def fetch_recent_logs(serial: str, hours: int, limit: int = 50) -> list:
+    """Latest Loki lines of a device, newest first; [] if Loki is unavailable."""
+    end_time_ns = int(time.time() * 10**9)
+    start_time_ns = end_time_ns - (hours * 3600 * 10**9)
+
+    logs_params = {
+        "query": f'{{serial="{serial}"}}', # Ищем по serial
+        "limit": limit,
+        "start": start_time_ns,
+        "end": end_time_ns,
+        "direction": "backward"
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            # Тут используем URL прометея /query_range
-            resp = await client.get("http://prometheus:9090/api/v1/query_range", params=params)
-            data = resp.json()
-            
-            history = []
-            if data.get("data", {}).get("result"):
-                # Парсим хитрый формат Прометея [[ts, val], [ts, val]...]
-                for val in data["data"]["result"][0]["values"]:
-                    history.append({
-                        "time": int(val[0]),
-                        "value": float(val[1])
-                    })
-
-            return {
-                "metric_name": metric_name,
-                "display_name": meta.display_name_ru if meta else metric_name,
-                "unit": meta.unit if meta else "",
-                "history": history
-            }
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Prometheus error: {e}")
+    logs_data = []
+    try:
+        logs_resp = await http_clients.get("loki", LOKI_QUERY_PATH, params=logs_params, timeout=5.0)
+        if logs_resp.status_code != 200:
+            print(f"Loki returned error {logs_resp.status_code}: {logs_resp.text}")
+            return []
+
+        for stream in logs_resp.json().get("data", {}).get("result", []):
+            level = stream.get("stream", {}).get("level", "INFO")
+            for value in stream.get("values", []):
+                ts_ns = int(value[0])
+                ts_iso = datetime.fromtimestamp(ts_ns / 10**9, tz=timezone.utc).isoformat()
+                logs_data.append({
+                    "timestamp": ts_iso,
+                    "level": level,
+                    "message": value[1]
+                })
+    except Exception as e:
+        print(f"Loki connection error for serial {serial}: {e}")
+        return []
 
+    logs_data.sort(key=lambda x: x["timestamp"], reverse=True)
+    return logs_data
 
 
 @router.get("/{device_id}/full-report", response_model=schemas.DeviceFullDetailOut)
@@ -210,140 +208,52 @@ async def get_device_full_report(
         raise HTTPException(status_code=404, detail="Device not found")
     
     serial = db_device.serial
-    current_status = DeviceStatusEnum.OFFLINE
-    online_serials = await get_online_serials()
-
-    if serial in online_serials:
-
-        current_status = DeviceStatusEnum.ONLINE
-        
-        all_active_alerts = await get_all_active_alerts(db)
-        device_has_alerts = any(alert['serial'] == serial for alert in all_active_alerts)
-        
-        if device_has_alerts:
-             current_status = DeviceStatusEnum.PROBLEMATIC
-
     end_time = int(time.time())
     start_time = end_time - (hours * 3600)
-    
-    metrics_data = []
     all_meta = {m.metric_name: m for m in db.query(models.MetricMetadata).all()}
 
-    async with httpx.AsyncClient() as client:
-        
-        try:
-            metrics_query = f'{{serial="{serial}"}}'
-            list_resp = await client.get(
-                "http://prometheus:9090/api/v1/query", 
-                params={"query": metrics_query, "time": end_time},
-                timeout=5.0
-            )
-            
-            if list_resp.status_code == 200:
-                available_metrics = list_resp.json().get("data", {}).get("result", [])
-                
-                for metric in available_metrics:
-                    labels = metric.get("metric", {})
-                    full_name = labels.get("__name__", "")
-                    
-                    if not full_name.startswith("device_"):
-                        continue
-                        
-                    short_name = full_name.replace("device_", "")
-                    
-                    # История конкретной метрики
-                    history_params = {
-                        "query": f'{full_name}{{serial="{serial}"}}',
-                        "start": start_time,
-                        "end": end_time,
-                        "step": "60s"
-                    }
-                    
-                    history_resp = await client.get("http://prometheus:9090/api/v1/query_range", params=history_params)
-                    if history_resp.status_code == 200:
-                        history_result = history_resp.json().get("data", {}).get("result", [])
-                        
-                        if not history_result:
-                            continue
-                        
-                        history = [{"time": int(v[0]), "value": float(v[1])} for v in history_result[0].get("values", [])]
-                        
-                        meta = all_meta.get(short_name)
-                        metric_status = "normal"
-                        
-                        if history and meta:
-                            last_val = history[-1]["value"]
-                            if (meta.max_threshold and last_val > meta.max_threshold) or \
-                               (meta.min_threshold and last_val < meta.min_threshold):
-                                metric_status = "problematic"
-                        
-                        metrics_data.append({
-                            "metric_name": short_name,
-                            "display_name": meta.display_name_ru if meta else short_name,
-                            "unit": meta.unit if meta else "",
-                            "status": metric_status,
-                            "history": history
-                        })
-        except Exception as e:
-            print(f"Prometheus Bulk Error for serial {serial}: {e}")
-
-        # 3. ЛОГИ (Loki)
+    # Prometheus, алерты, история метрик и Loki независимы — запрашиваем параллельно
+    _, series, logs_data = await asyncio.gather(
+        presence.sync(alerts=True),
+        device_series(db, device_id, serial, start_time, end_time, step=60),
+        fetch_recent_logs(serial, hours),
+        return_exceptions=True,
+    )
+    if isinstance(series, Exception):
+        print(f"Metric history error for serial {serial}: {series}")
+        series = {}
+    if isinstance(logs_data, Exception):
+        print(f"Loki connection error for serial {serial}: {logs_data}")
         logs_data = []
-        try:
-            end_time_ns = int(time.time() * 10**9)
-            start_time_ns = end_time_ns - (hours * 3600 * 10**9)
-            
-            logs_params = {
-                "query": f'{{serial="{serial}"}}', # Ищем по serial
-                "limit": 50,
-                "start": start_time_ns,
-                "end": end_time_ns,
-                "direction": "backward"
-            }
-            
-            logs_resp = await client.get("http://loki:3100/loki/api/v1/query_range", params=logs_params, timeout=5.0)
-            if logs_resp.status_code == 200:
-                logs_result = logs_resp.json().get("data", {}).get("result", [])
-                
-                for stream in logs_result:
-                    level = stream.get("stream", {}).get("level", "INFO")
-                    for value in stream.get("values", []):
-                        ts_ns = int(value[0])
-                        ts_iso = datetime.fromtimestamp(ts_ns / 10**9, tz=timezone.utc).isoformat()
-                        logs_data.append({
-                            "timestamp": ts_iso,
-                            "level": level,
-                            "message": value[1]
-                        })
-                
-                logs_data.sort(key=lambda x: x["timestamp"], reverse=True)
-            else:
-                print(f"Loki returned error {logs_resp.status_code}: {logs_resp.text}")
-        except Exception as e:
-            print(f"Loki connection error for serial {serial}: {e}")
-
-    issues_data = db.query(
-            models.Issue,
-            func.max(models.Trace.occurrence).label('last_occurrence'),
-            func.count(models.Trace.id).label('total_trace_count'),
-            func.count(func.distinct(models.Trace.device_id)).label('unique_device_count')
-        ).join(
-            models.Trace,
-            models.Issue.id == models.Trace.issue_id
-        ).group_by(
-            models.Issue.id, 
-            models.Issue.name,
-            models.Issue.type
-        ).order_by(
-            desc(func.max(models.Trace.occurrence)) 
-        ).filter(
-            models.Trace.device_id == device_id
-        ).all()
+
+    current_status = presence.status(serial, alerts=True)
+
+    metrics_data = []
+    for full_name, history in series.items():
+        short_name = full_name.replace("device_", "")
+        meta = all_meta.get(short_name)
+        metric_status = "normal"
+
+        if history and meta:
+            last_val = history[-1]["value"]
+            if (meta.max_threshold and last_val > meta.max_threshold) or \
+               (meta.min_threshold and last_val < meta.min_threshold):
+                metric_status = "problematic"
+
+        metrics_data.append({
+            "metric_name": short_name,
+            "display_name": meta.display_name_ru if meta else short_name,
+            "unit": meta.unit if meta else "",
+            "status": metric_status,
+            "history": history
+        })
+
+    issues_data = issue_stats.scoped(db, device_id=device_id)
     
     issues_list = []
-    for issue, last_occurrence, total_trace_count, unique_device_count in issues_data:
+    for issue, last_occurrence, device_count in issues_data:
         issue.last_occurrence = last_occurrence
-        issue.device_count = unique_device_count
+        issue.device_count = device_count
         
         issues_list.append(issue)
     
@@ -356,8 +266,6 @@ async def get_device_full_report(
         "logs": logs_data[:50],
         "issues": issues_list,}
 
-# URL для запросов в Loki (Query)
-LOKI_QUERY_URL = "http://loki:3100/loki/api/v1/query_range"
 
 @router.get("/{device_id}/logs", response_model=schemas.DeviceLogsResponse)
 async def get_device_logs(
@@ -382,33 +290,32 @@ async def get_device_logs(
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(LOKI_QUERY_URL, params=params)
-            data = resp.json()
-            
-            output_logs = []
+        resp = await http_clients.get("loki", LOKI_QUERY_PATH, params=params)
+        data = resp.json()
+        
+        output_logs = []
+        
+        for stream in data.get("data", {}).get("result", []):
+            level = stream.get("stream", {}).get("level", "INFO")
             
-            for stream in data.get("data", {}).get("result", []):
-                level = stream.get("stream", {}).get("level", "INFO")
+            for val in stream.get("values", []):
+                ts_ns = int(val[0]) 
+                message = val[1] 
+                
+                ts_iso = datetime.fromtimestamp(ts_ns / 10**9, tz=timezone.utc).isoformat()
                 
-                for val in stream.get("values", []):
-                    ts_ns = int(val[0]) 
-                    message = val[1] 
-                    
-                    ts_iso = datetime.fromtimestamp(ts_ns / 10**9, tz=timezone.utc).isoformat()
-                    
-                    output_logs.append({
-                        "timestamp": ts_iso,
-                        "level": level,
-                        "message": message
-                    })
-
-            output_logs.sort(key=lambda x: x["timestamp"], reverse=True)
-
-            return {
-                "serial": serial, # Оставляем для инфы в схеме
-                "logs": output_logs
-            }
+                output_logs.append({
+                    "timestamp": ts_iso,
+                    "level": level,
+                    "message": message
+                })
+
+        output_logs.sort(key=lambda x: x["timestamp"], reverse=True)
+
+        return {
+            "serial": serial, # Оставляем для инфы в схеме
+            "logs": output_logs
+        }
     except Exception as e:
         print(f"Loki connection error: {e}")
         return {"serial": serial, "logs": []}
@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
-from routers.devices import get_online_serials
+from typing import List, Optional
 import models, schemas
 from utils.dependencies import get_db
+from utils.last_seen import last_seen
+from utils.presence import presence
+from utils.alert_cache import alert_cache
+from utils.listing import parse_fields, devices_loader, project_group, projected_response
 # import httpx
 
 router = APIRouter(prefix="/groups", tags=["Groups"])
@@ -17,36 +21,57 @@ def create_group(group: schemas.GroupCreate, db: Session = Depends(get_db)):
     return db_group
 
 @router.get("", response_model=List[schemas.GroupDetail])
-async def list_groups(db: Session = Depends(get_db)):
-    groups = db.query(models.Group).all()
+async def list_groups(
+    db: Session = Depends(get_db),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    fields: Optional[str] = Query(None, description="Поля устройств через запятую, например serial,status"),
+):
+    device_fields = parse_fields(fields)
+    # Группы и все их устройства — два запроса независимо от числа групп
+    query = db.query(models.Group).options(devices_loader(device_fields)).order_by(models.Group.id).offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    groups = query.all()
     
-    online_serials = await get_online_serials()
+    await presence.sync()
+    now = datetime.now(timezone.utc)
     
     for group in groups:
         for device in group.devices:
-            if device.serial in online_serials:
-                device.status = schemas.DeviceStatusEnum.ONLINE
-            else:
-                device.status = schemas.DeviceStatusEnum.OFFLINE
+            device.status = presence.status(device.serial, now)
+            device.last_seen = last_seen.get(device.serial, device.last_sync)
     
+    if device_fields is not None:
+        return projected_response([project_group(group, device_fields) for group in groups])
     return groups
 
 @router.get("/{group_id}", response_model=schemas.GroupDetail)
-async def get_group(group_id: int, db: Session = Depends(get_db)):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+async def get_group(
+    group_id: int,
+    db: Session = Depends(get_db),
+    fields: Optional[str] = Query(None, description="Поля устройств через запятую, например serial,status"),
+):
+    device_fields = parse_fields(fields)
+    group = db.query(models.Group).options(devices_loader(device_fields)).filter(models.Group.id == group_id).first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    online_serials = await get_online_serials()
+    await presence.sync()
+    now = datetime.now(timezone.utc)
 
     for device in group.devices:
-        if device.serial in online_serials:
-            device.status = schemas.DeviceStatusEnum.ONLINE
-        else:
-            device.status = schemas.DeviceStatusEnum.OFFLINE
+        device.status = presence.status(device.serial, now)
+        device.last_seen = last_seen.get(device.serial, device.last_sync)
     
+    if device_fields is not None:
+        return projected_response(project_group(group, device_fields))
     return group
 
+@router.get("/{group_id}/alerts", response_model=List[schemas.AlertWithMetadata])
+async def get_group_alerts(group_id: int):
+    return await alert_cache.for_group(group_id)
+
 @router.delete("/{group_id}")
 def delete_group(group_id: int, db: Session = Depends(get_db)):
     db_group = db.query(models.Group).filter(models.Group.id == group_id).first()
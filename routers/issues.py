@@ -1,36 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from utils.dependencies import get_db
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, select, func
-from typing import List
+from typing import List, Optional
 import models, schemas
-from datetime import datetime
+from datetime import datetime, timedelta
+from utils.issue_stats import issue_stats
 
 router = APIRouter(prefix="/issues", tags=["Issues"])
 
 @router.get("", response_model=List[schemas.IssuePreview])
-async def list(db: Session = Depends(get_db)):
-    
-    issues_data = db.query(
-        models.Issue,
-        func.max(models.Trace.occurrence).label('last_occurrence'),
-        func.count(models.Trace.id).label('total_trace_count'),
-        func.count(func.distinct(models.Trace.device_id)).label('unique_device_count')
-    ).join(
-        models.Trace,
-        models.Issue.id == models.Trace.issue_id
-    ).group_by(
-        models.Issue.id, 
-        models.Issue.name,
-        models.Issue.type
-    ).order_by(
-        desc(func.max(models.Trace.occurrence)) 
-    ).all()
+async def list(
+    db: Session = Depends(get_db),
+    project_id: Optional[int] = None,
+    group_id: Optional[int] = None,
+    hours: Optional[int] = Query(None, ge=1, description="Только трейсы за последние N часов"),
+):
+    since = datetime.now() - timedelta(hours=hours) if hours else None
+    issues_data = issue_stats.scoped(db, project_id=project_id, group_id=group_id, since=since)
     
     issues_list = []
-    for issue, last_occurrence, total_trace_count, unique_device_count in issues_data:
+    for issue, last_occurrence, device_count in issues_data:
         issue.last_occurrence = last_occurrence
-        issue.device_count = unique_device_count
+        issue.device_count = device_count
     
         issues_list.append(issue)
     
@@ -50,7 +42,8 @@ async def info(
         models.Trace.id,
         models.Trace.device_id,
         models.Trace.issue_id,
-        models.Trace.occurrence
+        models.Trace.occurrence,
+        models.Trace.status
     ).filter(
         models.Trace.issue_id == issue_id
     ).order_by(
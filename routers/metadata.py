@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List
 import models, schemas
 from utils.dependencies import get_db
+from utils.online_anomaly import online_anomalies
 
 router = APIRouter(prefix="/metadata", tags=["Metadata"])
 
@@ -22,6 +23,8 @@ def update_metadata(
     if not db_meta:
         raise HTTPException(status_code=404, detail="Metadata not found")
     
+    old_name = db_meta.metric_name
+
     # Модифицируем только присланные поля
     update_data = meta_update.model_dump(exclude_unset=True)
     for key, value in update_data.items():
@@ -29,4 +32,8 @@ def update_metadata(
     
     db.commit()
     db.refresh(db_meta)
+    # Новые пороги сразу действуют в потоковом детекторе, не дожидаясь перечитывания
+    if old_name != db_meta.metric_name:
+        online_anomalies.set_threshold(old_name, None, None)
+    online_anomalies.set_threshold(db_meta.metric_name, db_meta.min_threshold, db_meta.max_threshold)
     return db_meta
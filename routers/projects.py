@@ -1,103 +1,47 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 import models, schemas
 from utils.dependencies import get_db
 from sqlalchemy import desc, select, func
-import httpx
+from utils.alert_cache import alert_cache
+from utils.presence import presence
+from utils.issue_stats import issue_stats
 
 
 router = APIRouter(prefix="/projects", tags=["Projects"])
-PROMETHEUS_ALERTS_URL = "http://prometheus:9090/api/v1/alerts"
-PROMETHEUS_URL = "http://prometheus:9090/api/v1/query"
-
-async def get_online_serials() -> set:
-    # Use changes() function to detect if metric was updated recently
-    # changes(device_cpu_usage[5m]) > 0 means it was pushed in last 5 minutes
-    query = 'changes(device_cpu_usage[30s]) > 0'
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                PROMETHEUS_URL,
-                params={"query": query},
-                timeout=5.0
-            )
-            
-            if resp.status_code != 200:
-                return set()
-
-            data = resp.json()
-            results = data.get("data", {}).get("result", [])
-            
-            online_serials = {
-                r["metric"]["serial"] 
-                for r in results 
-                if "serial" in r.get("metric", {})
-            }
-            
-            return online_serials
-    except Exception as e:
-        print(f"Request failed: {e}")
-        return set()
-
-
 
 @router.get("/alerts", response_model=List[schemas.AlertWithMetadata])
-async def get_all_active_alerts(db: Session = Depends(get_db)):
-    # 1. Запрос в Prometheus за активными алертами
-    prometheus_alerts = []
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get("http://prometheus:9090/api/v1/alerts")
-            prometheus_alerts = resp.json().get("data", {}).get("alerts", [])
-    except Exception as e:
-        print(f"Prometheus Alerts Error: {e}")
-        return []
-
-    # 2. Берем устройства для маппинга
-    devices = db.query(models.Device).all()
-    device_map = {
-        d.serial: {
-            "group": d.group.name if d.group else "Без группы",
-            # "alias": d.alias or d.serial
-        } for d in devices
-    }
+async def get_all_active_alerts():
+    # Активные алерты из кэша (обновляется не чаще раза в ALERTS_CACHE_TTL)
+    return await alert_cache.all()
 
-    # 3. Собираем плоский список с метаданными
-    enriched_alerts = []
-    
-    for alert in prometheus_alerts:
-        if alert["state"] != "firing":
-            continue
-            
-        # Пытаемся достать серийник из лейблов
-        serial = alert["labels"].get("serial") or alert["labels"].get("instance")
-        
-        # Данные из БД (если нашли)
-        meta = device_map.get(serial)
 
-        enriched_alerts.append({
-            "alertname": alert["labels"].get("alertname"),
-            "severity": alert["labels"].get("severity", "warning"),
-            "summary": alert["annotations"].get("summary", ""),
-            "description": alert["annotations"].get("description", ""),
-            "active_at": alert.get("activeAt"),
-            "serial": serial or "unknown",
-            # "device_alias": meta["alias"],
-            # "group_name": meta["group"]
-        })
+@router.post("/alerts/webhook")
+def receive_alertmanager_webhook(payload: dict = Body(...)):
+    """Alertmanager webhook_config: firing/resolved alerts сразу попадают в кэш"""
+    changed = alert_cache.apply_webhook(payload)
+    return {"status": "success", "changed": changed}
+
 
-    return enriched_alerts
+@router.get("/{project_id}/alerts", response_model=List[schemas.AlertWithMetadata])
+async def get_project_alerts(project_id: int):
+    return await alert_cache.for_project(project_id)
 
 
 @router.get("/projects/{project_id}/groups", response_model=List[schemas.GroupOut])
-async def get_project_groups(project_id: int, db: Session = Depends(get_db)):
+async def get_project_groups(
+    project_id: int,
+    db: Session = Depends(get_db),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+):
     """Получить список всех групп проекта"""
-    groups = db.query(models.Group).filter(models.Group.project_id == project_id).all()
-    if not groups:
-        return []
-    return groups
+    query = db.query(models.Group).filter(models.Group.project_id == project_id).order_by(models.Group.id).offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
 
 
 @router.post("", response_model=schemas.ProjectOut)
@@ -138,7 +82,11 @@ def delete_project(project_id: int, db: Session = Depends(get_db)):
     return {"status": "success"}
 
 @router.get("/{project_id}/dashboard", response_model=schemas.ProjectDashboardOut)
-async def get_project_dashboard(project_id: int, db: Session = Depends(get_db)):
+async def get_project_dashboard(
+    project_id: int,
+    db: Session = Depends(get_db),
+    hours: Optional[int] = Query(None, ge=1, description="Issue только за последние N часов"),
+):
     # online_serials = set()
     # try:
     #     # Проверяем тех, кто пушил в последние 5 минут
@@ -150,51 +98,38 @@ async def get_project_dashboard(project_id: int, db: Session = Depends(get_db)):
     # except Exception as e:
     #     print(f"Prometheus error: {e}")
 
-    online_serials = await get_online_serials()
+    await presence.sync()
+    now = datetime.now(timezone.utc)
 
-    project_groups = db.query(models.Group).filter(models.Group.project_id == project_id).all()
-    
-    groups_stat = []
-    total_on = 0
-    total_off = 0
-
-    for group in project_groups:
-        on, off = 0, 0
-        # Теперь все устройства в этой группе по умолчанию относятся к этому проекту
-        for dev in group.devices:
-            if dev.serial in online_serials:
-                on += 1
-                total_on += 1
-            else:
-                off += 1
-                total_off += 1
-        
-        groups_stat.append({
-            "name": group.name,
-            "online": on,
-            "offline": off
-        })
-
-    issues_data = db.query(
-        models.Issue,
-        func.max(models.Trace.occurrence).label('last_occurrence'),
-        func.count(models.Trace.id).label('total_trace_count'),
-        func.count(func.distinct(models.Trace.device_id)).label('unique_device_count')
-    ).join(
-        models.Trace,
-        models.Issue.id == models.Trace.issue_id
-    ).group_by(
-        models.Issue.id, 
-        models.Issue.name,
-        models.Issue.type
-    ).order_by(
-        desc(func.max(models.Trace.occurrence)) 
-    ).all()
+    # Один запрос на все группы проекта с серийниками их устройств (группы без устройств — с None)
+    rows = db.query(models.Group.id, models.Group.name, models.Device.serial).outerjoin(
+        models.Device, models.Device.group_id == models.Group.id
+    ).filter(
+        models.Group.project_id == project_id
+    ).order_by(models.Group.id).all()
+
+    group_counts = {}
+    for group_id, group_name, serial in rows:
+        stat = group_counts.setdefault(group_id, {"name": group_name, "online": 0, "offline": 0})
+        if serial is None:
+            continue
+        if presence.is_online(serial, now):
+            stat["online"] += 1
+        else:
+            stat["offline"] += 1
+
+    groups_stat = list(group_counts.values())
+    total_on = sum(g["online"] for g in groups_stat)
+    total_off = sum(g["offline"] for g in groups_stat)
+
+    # Только трейсы устройств этого проекта
+    since = datetime.now() - timedelta(hours=hours) if hours else None
+    issues_data = issue_stats.scoped(db, project_id=project_id, since=since)
     
     issues_list = []
-    for issue, last_occurrence, total_trace_count, unique_device_count in issues_data:
+    for issue, last_occurrence, device_count in issues_data:
         issue.last_occurrence = last_occurrence
-        issue.device_count = unique_device_count
+        issue.device_count = device_count
     
         issues_list.append(issue)
 
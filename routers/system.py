@@ -0,0 +1,38 @@
+from fastapi import APIRouter
+from utils.metrics_exporter import metrics_exporter
+from utils.http_clients import http_clients
+from utils.log_shipper import log_shipper
+from utils.coredump_jobs import coredump_jobs
+from utils.last_seen import last_seen
+from utils.telemetry_writer import telemetry_writer
+from utils.telemetry_store import telemetry_store
+from utils.telemetry_rollups import telemetry_rollups
+from utils.alert_cache import alert_cache
+from utils.presence import presence
+from utils.issue_stats import issue_stats
+from utils.predictive_scheduler import predictive_scheduler
+from utils.anomaly_scan import anomaly_scanner
+from utils.online_anomaly import online_anomalies
+
+router = APIRouter(prefix="/system", tags=["System"])
+
+
+@router.get("/stats")
+def get_pipeline_stats():
+    """Состояние внутренних конвейеров ingest-а (очереди, сбросы, ошибки)"""
+    return {
+        "metrics_exporter": metrics_exporter.stats(),
+        "log_shipper": log_shipper.stats(),
+        "coredump_jobs": coredump_jobs.stats(),
+        "last_seen": last_seen.stats(),
+        "telemetry_writer": telemetry_writer.stats(),
+        "telemetry_store": telemetry_store.stats(),
+        "telemetry_rollups": telemetry_rollups.stats(),
+        "alert_cache": alert_cache.stats(),
+        "presence": presence.stats(),
+        "issue_stats": issue_stats.stats(),
+        "predictive_scheduler": predictive_scheduler.stats(),
+        "anomaly_scanner": anomaly_scanner.stats(),
+        "online_anomalies": online_anomalies.stats(),
+        "http_pools": http_clients.stats(),
+    }
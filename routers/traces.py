@@ -1,11 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from routers.issues import info
 from utils.dependencies import get_db
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, select, func
-from typing import List
+from typing import List, Optional
 import models, schemas
 from datetime import datetime
+from utils.coredump_jobs import coredump_jobs, request_decode
+from utils.trace_memory import get_memory_segments, iter_segment_range, MAX_MEMORY_RANGE
 
 router = APIRouter(prefix="/traces", tags=["Traces"])
 
@@ -21,4 +24,90 @@ async def info(
 
     return trace
 
-    
+
+@router.post("/{trace_id}/decode", response_model=schemas.TraceFull)
+async def request_trace_decode(
+    trace_id: int,
+    mode: str = "full",
+    db: Session = Depends(get_db)):
+    """Поставить трейс на повторный разбор; mode=full запускает полный GDB-анализ"""
+    trace = db.query(models.Trace).filter(models.Trace.id == trace_id).first()
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    if trace.raw_dump is None:
+        raise HTTPException(status_code=400, detail="Raw coredump is not stored for this trace")
+
+    try:
+        request_decode(db, trace, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    coredump_jobs.notify()
+    db.refresh(trace)
+    return trace
+
+
+@router.get("/{trace_id}/memory", response_model=List[schemas.TraceMemorySegmentOut])
+def memory_segments(
+    trace_id: int,
+    db: Session = Depends(get_db)):
+    """Список сегментов памяти из дампа; сами байты отдает /memory/{index}"""
+    trace = db.query(models.Trace).filter(models.Trace.id == trace_id).first()
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found")
+
+    try:
+        segments = get_memory_segments(db, trace)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Failed to read coredump segments: {e}")
+
+    return [
+        schemas.TraceMemorySegmentOut(
+            index=seg.index,
+            name=seg.name,
+            address=f"0x{seg.address:x}",
+            size=seg.size,
+            attrs=seg.attrs,
+        )
+        for seg in segments
+    ]
+
+
+@router.get("/{trace_id}/memory/{index}")
+def memory_range(
+    trace_id: int,
+    index: int,
+    offset: int = 0,
+    length: Optional[int] = None,
+    db: Session = Depends(get_db)):
+    """Потоковая выдача диапазона [offset, offset + length) сегмента в виде application/octet-stream"""
+    trace = db.query(models.Trace).filter(models.Trace.id == trace_id).first()
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found")
+
+    try:
+        segments = get_memory_segments(db, trace)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Failed to read coredump segments: {e}")
+
+    segment = next((seg for seg in segments if seg.index == index), None)
+    if segment is None:
+        raise HTTPException(status_code=404, detail="Memory segment not found")
+    if offset < 0 or offset > segment.size:
+        raise HTTPException(status_code=400, detail="Offset is outside the segment")
+    if length is None:
+        length = segment.size - offset
+    if length < 0:
+        raise HTTPException(status_code=400, detail="Length must be non-negative")
+    length = min(length, segment.size - offset, MAX_MEMORY_RANGE)
+
+    return StreamingResponse(
+        iter_segment_range(segment.id, offset, length),
+        media_type="application/octet-stream",
+        headers={
+            "Content-Length": str(length),
+            "X-Segment-Address": f"0x{segment.address:x}",
+            "X-Range-Address": f"0x{segment.address + offset:x}",
+            "X-Segment-Size": str(segment.size),
+        },
+    )
@@ -1,4 +1,4 @@
-from models import IssueTypeEnum
+from models import IssueTypeEnum, TraceStatusEnum
 import models
 from pydantic import BaseModel, Field, field_validator, ConfigDict, Json
 from typing import Optional, List, Any, Dict
@@ -55,13 +55,25 @@ class IssuePreview(BaseModel):
 class TracePreview(BaseModel):
     id: int
     device_id: int
-    issue_id: int
+    issue_id: Optional[int] = None
     occurrence: datetime
+    status: Optional[TraceStatusEnum] = None
     
     model_config = ConfigDict(from_attributes=True)
 
 class TraceFull(TracePreview):
-    core_dump: Json
+    core_dump: Optional[Json] = None
+    decode_error: Optional[str] = None
+    decode_mode: Optional[str] = None
+    firmware_version: Optional[str] = None
+
+
+class TraceMemorySegmentOut(BaseModel):
+    index: int
+    name: str
+    address: str
+    size: int
+    attrs: Optional[str] = None
  
 
 
@@ -99,6 +111,7 @@ class DeviceOut(BaseModel):
     group_id: Optional[int]
     
     status: DeviceStatusEnum
+    last_seen: Optional[datetime] = None
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -165,6 +178,19 @@ class MetricHistoryOut(BaseModel):
     history: List[MetricDataPoint]
     status: str = "normal"
 
+class MetricRollupPoint(BaseModel):
+    time: int  # начало корзины, unix-время
+    min: float
+    max: float
+    avg: float
+    count: int
+    last: float
+
+class MetricRollupOut(BaseModel):
+    metric_name: str
+    resolution: Optional[int] = None  # секунды; None — сырые точки
+    points: List[MetricRollupPoint]
+
 
 class DeviceLogOut(BaseModel):
     timestamp: str  # Время события
@@ -243,6 +269,19 @@ class PredictiveAlertOut(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)    
     
+class AnomalyEventOut(BaseModel):
+    device_id: Optional[int] = None
+    serial: Optional[str] = None
+    metric_name: str
+    kind: str
+    value: float
+    baseline: Optional[float] = None
+    score: Optional[float] = None
+    threshold: Optional[float] = None
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
 class PredictiveAlertHistory(BaseModel):
     device_id: int
     alerts: List[PredictiveAlertOut]
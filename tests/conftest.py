@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# База задается до импорта database: отдельный SQLite-файл на прогон
+_db_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import MetaData, event
+
+import models
+from database import Base, SessionLocal, engine
+
+
+@event.listens_for(engine, "connect")
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    # Как в Postgres: SQLite проверяет внешние ключи только с этим PRAGMA
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        # Вместе с моделями — дневные чанки telemetry_store, их нет в Base.metadata
+        tables = MetaData()
+        tables.reflect(bind=engine)
+        tables.drop_all(bind=engine)
+        from utils.telemetry_store import telemetry_store
+        telemetry_store._days.clear()
+        telemetry_store._has_legacy = None
+
+
+@pytest.fixture
+def client(db):
+    from routers import devices
+
+    app = FastAPI()
+    app.include_router(devices.router)
+    return TestClient(app)
@@ -0,0 +1,44 @@
+from utils.alert_cache import ActiveAlertCache
+
+
+def _alert(serial, status="firing", alertname="HighCpu"):
+    return {
+        "status": status,
+        "labels": {"alertname": alertname, "serial": serial},
+        "annotations": {"summary": "CPU"},
+        "startsAt": "2026-01-01T00:00:00Z",
+    }
+
+
+def test_webhook_indexes_firing_alerts_and_drops_resolved():
+    cache = ActiveAlertCache()
+    cache._device_groups = {"node-1": (10, 100), "node-2": (20, 100), "node-3": (None, None)}
+
+    # Алерт без лейблов пропускается
+    alerts = [_alert("node-1"), _alert("node-2"), _alert("node-3"), {"status": "firing"}]
+    changed = cache.apply_webhook({"alerts": alerts})
+
+    assert changed == 3
+    assert [a["serial"] for a in cache.peek("node-1")] == ["node-1"]
+    assert cache.peek("node-1")[0]["active_at"] == "2026-01-01T00:00:00Z"
+    assert [a["serial"] for a in cache._by_group[10]] == ["node-1"]
+    assert sorted(a["serial"] for a in cache._by_project[100]) == ["node-1", "node-2"]
+    assert None not in cache._by_group
+
+    # node-9 не было в активных — не считается изменением
+    changed = cache.apply_webhook({"alerts": [_alert("node-1", "resolved"), _alert("node-9", "resolved")]})
+
+    assert changed == 1
+    assert cache.peek("node-1") == []
+    assert [a["serial"] for a in cache._by_project[100]] == ["node-2"]
+    assert 10 not in cache._by_group
+    assert cache.webhook_updates == 2
+
+
+def test_repeated_firing_alert_is_not_duplicated():
+    cache = ActiveAlertCache()
+
+    cache.apply_webhook({"alerts": [_alert("node-1")]})
+    cache.apply_webhook({"alerts": [_alert("node-1"), _alert("node-1", alertname="LowMemory")]})
+
+    assert sorted(a["alertname"] for a in cache.peek("node-1")) == ["HighCpu", "LowMemory"]
@@ -0,0 +1,66 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from model import batch_forecast
+from model.forecast_state import fit_state, forecast_many_with_state, forecast_with_state
+
+pytestmark = pytest.mark.skipif(
+    not batch_forecast.verified(), reason=f"parity is only checked with {batch_forecast.VERIFIED_WITH}"
+)
+
+
+def _fleet(length=150):
+    t = np.arange(length)
+    rng = np.random.default_rng(7)
+    return [
+        50 + 0.2 * t + 5 * np.sin(2 * np.pi * t / 30) + rng.normal(0, 1, length),
+        70 + 0.1 * t + 2 * np.sin(2 * np.pi * t / 30 + 1) + np.cumsum(rng.normal(0, 0.3, length)),
+        30 + 8 * np.sin(2 * np.pi * t / 30 + 2) + rng.normal(0, 2, length),
+    ]
+
+
+@pytest.fixture(autouse=True)
+def _quiet():
+    # statsmodels предупреждает о несошедшейся оптимизации
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        yield
+
+
+def _same_state(a, b):
+    return {k: v for k, v in a.items() if k != "fitted_at"} == {k: v for k, v in b.items() if k != "fitted_at"}
+
+
+def test_cold_fit_matches_statsmodels():
+    fleet = _fleet()
+    expected = [fit_state(values) for values in fleet]
+
+    params = batch_forecast.fit(batch_forecast.smooth(np.array(fleet)))
+
+    assert params.tolist() == [state["start_params"] for state in expected]
+
+
+def test_many_with_state_matches_one_by_one():
+    fleet = _fleet()
+    previous = [fit_state(values[:-10]) for values in fleet]
+    for state in previous:
+        state["fitted_at"] = 0  # устарело — нужна переподгонка с теплого старта
+    items = [(values, [], None) for values in fleet] + [
+        (values, values[-10:], dict(state, season=list(state["season"])))
+        for values, state in zip(fleet, previous)
+    ] + [(fleet[0][:40], [], None)]
+
+    expected = [
+        forecast_with_state(values, new_values, dict(state, season=list(state["season"])) if state else None)
+        for values, new_values, state in items
+    ]
+    actual = forecast_many_with_state(items)
+
+    for (report, state, refitted), (want_report, want_state, want_refitted) in zip(actual, expected):
+        assert report == want_report
+        assert refitted == want_refitted
+        assert (state is None) == (want_state is None)
+        if state is not None:
+            assert _same_state(state, want_state)
@@ -0,0 +1,54 @@
+import time
+from types import SimpleNamespace
+
+from pygdbmi import gdbmiparser
+
+from utils.coredump import CoreDumpDecoder
+
+
+class FakeGdb:
+    """Returns prepared MI lines one call at a time and records the timeouts it was asked to wait."""
+
+    def __init__(self, batches):
+        self.batches = [[gdbmiparser.parse_response(line) for line in batch] for batch in batches]
+        self.timeouts = []
+
+    def write(self, *args, **kwargs):
+        pass
+
+    def get_gdb_response(self, timeout_sec, raise_error_on_timeout):
+        self.timeouts.append(timeout_sec)
+        if self.batches:
+            return self.batches.pop(0)
+        # Как select в pygdbmi: нет вывода — ждем весь таймаут
+        time.sleep(timeout_sec)
+        return []
+
+
+def _decoder(gdb):
+    decoder = CoreDumpDecoder.__new__(CoreDumpDecoder)
+    decoder.gdb_esp = SimpleNamespace(p=gdb)
+    return decoder
+
+
+def test_script_output_keeps_literal_backslashes():
+    gdb = FakeGdb([
+        ['~"@@NAME C:\\\\new\\ttab\\n"'],
+        ['~"say \\"hi\\"\\n"', '^done'],
+    ])
+
+    output, ok = _decoder(gdb)._run_gdb_script(['bt'], timeout=5)
+
+    assert ok
+    assert output == '@@NAME C:\\new\ttab\nsay "hi"\n'
+    assert all(t > 0 for t in gdb.timeouts)
+
+
+def test_script_stops_at_deadline():
+    gdb = FakeGdb([])
+
+    output, ok = _decoder(gdb)._run_gdb_script(['bt'], timeout=0.7)
+
+    assert (output, ok) == ('', False)
+    assert gdb.timeouts[0] == 0.5
+    assert len(gdb.timeouts) == 2
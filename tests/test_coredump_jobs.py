@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import pytest
+
+import models
+from utils import coredump_jobs as jobs
+from utils.coredump_cache import CoredumpCache, dump_key, signature_key
+
+FRAMES = {'parsed': {'frames': [{'address': '0x400d1234'}, {'address': '0x400d5678'}]}}
+
+
+@pytest.fixture
+def decodes(tmp_path, monkeypatch):
+    """Fake worker decode: records (dump, mode) calls; every result carries the dump it came from."""
+    calls = []
+
+    def decode(raw, prog, mode='full'):
+        calls.append((raw, mode))
+        result = {
+            'mode': mode,
+            'reason': 'abort() called',
+            'type': 'abort',
+            'current-thread-stack': FRAMES,
+            'current-thread-registers': {'dump': raw.decode()},
+        }
+        if mode == 'full':
+            result['threads'] = [{'dump': raw.decode()}]
+            result['all-memory-regions'] = [{'dump': raw.decode()}]
+        return result
+
+    prog = tmp_path / 'firmware.elf'
+    prog.write_bytes(b'\x7fELF')
+    monkeypatch.setattr(jobs, 'decode_coredump', decode)
+    monkeypatch.setattr(jobs, 'coredump_cache', CoredumpCache(path=str(tmp_path / 'cache')))
+    return calls, str(prog)
+
+
+def test_dump_and_signature_keys():
+    assert dump_key('fw', b'dump', 'full') != dump_key('fw', b'dump', 'triage')
+    assert signature_key('fw', {'reason': 'r', 'current-thread-stack': FRAMES}) == \
+        signature_key('fw', {'reason': 'r', 'current-thread-stack': FRAMES, 'threads': [1]})
+    assert signature_key('fw', {'reason': 'r', 'current-thread-stack': FRAMES}) != \
+        signature_key('fw2', {'reason': 'r', 'current-thread-stack': FRAMES})
+    # Без бэктрейса одной причины мало
+    assert signature_key('fw', {'reason': 'r'}) is None
+
+
+def test_identical_dump_is_decoded_once(decodes):
+    calls, prog = decodes
+    queue = jobs.CoredumpJobQueue()
+
+    first = asyncio.run(queue._decode(b'dump-1', 'full', prog))
+    again = asyncio.run(queue._decode(b'dump-1', 'full', prog))
+
+    assert first == again
+    assert calls == [(b'dump-1', 'triage'), (b'dump-1', 'full')]
+
+
+def test_signature_reuse_keeps_own_dump_data(decodes):
+    calls, prog = decodes
+    queue = jobs.CoredumpJobQueue()
+    asyncio.run(queue._decode(b'dump-1', 'full', prog))
+
+    reused = asyncio.run(queue._decode(b'dump-2', 'full', prog))
+
+    assert (b'dump-2', 'full') not in calls
+    assert reused['signature-reuse?'] is True
+    assert reused['reason'] == 'abort() called'
+    # Потоки, регистры и память чужого дампа не подставляются
+    assert reused['current-thread-registers'] == {'dump': 'dump-2'}
+    assert reused['mode'] == 'triage'
+    assert 'threads' not in reused and 'all-memory-regions' not in reused
+    assert queue.stats()['signature_reuses'] == 1
+
+    full = asyncio.run(queue._decode(b'dump-2', 'full', prog, reuse=False))
+
+    assert calls[-1] == (b'dump-2', 'full')
+    assert full['threads'] == [{'dump': 'dump-2'}]
+
+
+def test_full_decode_requested_again_after_reuse(db, decodes):
+    _, prog = decodes
+    device = models.Device(serial="node-1")
+    db.add(device)
+    db.flush()
+    fresh = models.Trace(device_id=device.id, raw_dump=b'dump', decode_mode='full')
+    reused = models.Trace(device_id=device.id, raw_dump=b'dump', decode_mode='full',
+                          core_dump=json.dumps({'reason': 'r', 'signature-reuse?': True}))
+    db.add_all([fresh, reused])
+    db.commit()
+    queue = jobs.CoredumpJobQueue()
+
+    assert queue._load_raw(fresh.id)[4] is True
+    assert queue._load_raw(reused.id)[4] is False
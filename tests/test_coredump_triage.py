@@ -0,0 +1,102 @@
+import struct
+from array import array
+from types import SimpleNamespace
+
+from esp_coredump.corefile.elf import ESPCoreDumpElfFile
+
+from utils.coredump import CoreDumpDecoder
+from utils.elf_symbols import SymbolTable
+
+
+STACK = 0x3FFB0000
+
+
+def _prstatus(tcb_addr, regs):
+    desc = bytearray(CoreDumpDecoder.PRSTATUS_REGS_OFFSET)
+    struct.pack_into('<I', desc, CoreDumpDecoder.PRSTATUS_PID_OFFSET, tcb_addr)
+    return SimpleNamespace(type=CoreDumpDecoder.NT_PRSTATUS, desc=bytes(desc) + struct.pack(f'<{len(regs)}I', *regs))
+
+
+def _decoder(machine=ESPCoreDumpElfFile.EM_XTENSA, notes=(), stack=b''):
+    decoder = CoreDumpDecoder.__new__(CoreDumpDecoder)
+    decoder.core_elf = SimpleNamespace(
+        note_segments=[SimpleNamespace(note_secs=list(notes))],
+        load_segments=[SimpleNamespace(addr=STACK, data=stack)],
+    )
+    decoder.exe_elf = SimpleNamespace(e_machine=machine)
+    return decoder
+
+
+def _xtensa_regs(pc, a0, a1):
+    regs = [0] * 66
+    regs[CoreDumpDecoder.XTENSA_PC] = pc
+    regs[CoreDumpDecoder.XTENSA_A0] = a0
+    regs[CoreDumpDecoder.XTENSA_A1] = a1
+    return regs
+
+
+def _stack(frames):
+    """frames: {sp: (return a0, caller sp)} — то, что лежит в save area по sp-16 и sp-12."""
+    data = bytearray(0x400)
+    for sp, (ret, next_sp) in frames.items():
+        struct.pack_into('<II', data, sp - 16 - STACK, ret, next_sp)
+    return bytes(data)
+
+
+def test_task_registers_read_pid_and_gregset_from_prstatus():
+    regs = _xtensa_regs(0x400D1000, 0, 0)
+    other = SimpleNamespace(type=3, desc=b'\0' * 200)
+    short = _prstatus(0x3FFC0000, [1, 2])
+
+    decoder = _decoder(notes=[other, _prstatus(0x3FFB5000, regs), short])
+
+    assert decoder._task_registers() == {0x3FFB5000: tuple(regs)}
+
+
+def test_xtensa_return_pc_drops_window_bits():
+    assert CoreDumpDecoder._xtensa_return_pc(0x800D2005) == 0x400D2002
+    assert CoreDumpDecoder._xtensa_return_pc(0x400D2005) == 0x400D2002
+
+
+def test_xtensa_backtrace_walks_window_save_area():
+    sp = STACK + 0x100
+    stack = _stack({sp: (0x800D3008, STACK + 0x200), STACK + 0x200: (0, STACK + 0x300)})
+    decoder = _decoder(stack=stack)
+
+    addrs = decoder._backtrace_addresses(_xtensa_regs(0x400D1000, 0x800D2005, sp))
+
+    assert addrs == [0x400D1000, 0x400D2002, 0x400D3005]
+
+
+def test_xtensa_backtrace_stops_when_stack_goes_backwards():
+    sp = STACK + 0x200
+    decoder = _decoder(stack=_stack({sp: (0x800D3008, STACK + 0x100)}))
+
+    assert decoder._backtrace_addresses(_xtensa_regs(0x400D1000, 0x800D2005, sp)) == [0x400D1000, 0x400D2002]
+
+
+def test_riscv_backtrace_is_pc_and_call_site():
+    decoder = _decoder(machine=ESPCoreDumpElfFile.EM_RISCV)
+
+    assert decoder._backtrace_addresses([0x42001000, 0x42002008, STACK]) == [0x42001000, 0x42002004]
+    assert decoder._backtrace_addresses([0x42001000, 0, STACK]) == [0x42001000]
+
+
+def test_symbolize_backtrace_classifies_frames_and_stops_at_unknown():
+    decoder = _decoder()
+    decoder.symbols = SymbolTable(
+        array('I', [0x400D1000, 0x400D2000]), array('I', [0x100, 0x100]), ['panic_abort', 'app_main'],
+    )
+
+    parsed = decoder.symbolize_backtrace([0x400D1010, 0x400D2002, 0x400D3005, 0x400D1000])
+
+    assert [(f['function'], f.get('offset')) for f in parsed['frames']] == [
+        ('panic_abort', 0x10), ('app_main', 2), ('unknown', None),
+    ]
+    assert parsed['summary'] == {
+        'total-frames': 3,
+        'user-frames': 1,
+        'system-frames': 1,
+        'unknown-frames': 1,
+        'root-cause': parsed['frames'][1],
+    }
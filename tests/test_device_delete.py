@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+
+import models
+from utils.issue_stats import issue_stats
+from utils.telemetry_rollups import telemetry_rollups
+from utils.telemetry_store import telemetry_store
+
+
+def _device(db, serial):
+    device = models.Device(serial=serial)
+    db.add(device)
+    db.flush()
+    return device
+
+
+def _linked_trace(db, device, issue, occurrence):
+    trace = models.Trace(device_id=device.id, occurrence=occurrence, status=models.TraceStatusEnum.decoded)
+    db.add(trace)
+    db.flush()
+    issue_stats.add(db, trace, issue.id)
+    trace.issue_id = issue.id
+    return trace
+
+
+def test_delete_device_with_linked_traces(client, db):
+    issue = models.Issue(name="abort() called", type=models.IssueTypeEnum.abort)
+    db.add(issue)
+    db.flush()
+    gone = _device(db, "node-1")
+    kept = _device(db, "node-2")
+    _linked_trace(db, gone, issue, datetime(2026, 1, 1, 10))
+    _linked_trace(db, kept, issue, datetime(2026, 1, 1, 12))
+    db.commit()
+    gone_id = gone.id
+
+    resp = client.delete(f"/devices/{gone_id}")
+
+    assert resp.status_code == 200
+    db.expire_all()
+    assert db.get(models.Device, gone_id) is None
+    assert db.query(models.DeviceIssueStats).filter_by(device_id=gone_id).count() == 0
+    stats = db.get(models.IssueStats, issue.id)
+    # Трейсы удаленного устройства остаются, но без устройства
+    assert stats.trace_count == 2
+    assert stats.device_count == 1
+    assert stats.last_occurrence == datetime(2026, 1, 1, 12)
+
+
+def test_delete_device_without_traces(client, db):
+    device = _device(db, "node-3")
+    db.commit()
+
+    assert client.delete(f"/devices/{device.id}").status_code == 200
+    assert client.delete(f"/devices/{device.id}").status_code == 404
+
+
+def test_delete_device_with_rollups(client, db):
+    device = _device(db, "node-4")
+    telemetry_rollups.merge(db, [(device.id, "device_cpu_usage", 42.0, datetime.now(timezone.utc))])
+    db.commit()
+
+    assert client.delete(f"/devices/{device.id}").status_code == 200
+    assert db.query(models.TelemetryRollup).filter_by(device_id=device.id).count() == 0
+
+
+def test_delete_device_with_anomaly_events(client, db):
+    device = _device(db, "node-5")
+    db.add(models.AnomalyEvent(device_id=device.id, metric_name="device_cpu_usage", kind="above_max", value=99.0))
+    db.commit()
+
+    assert client.delete(f"/devices/{device.id}").status_code == 200
+    assert db.query(models.AnomalyEvent).filter_by(device_id=device.id).count() == 0
+
+
+def test_delete_device_with_predictive_alerts(client, db):
+    device = _device(db, "node-6")
+    db.add(models.PredictiveAlert(device_id=device.id, metric_name="device_cpu_usage", status="warning",
+                                  minutes_to_failure=12, forecast_max=97.0))
+    db.commit()
+
+    assert client.delete(f"/devices/{device.id}").status_code == 200
+    assert db.query(models.PredictiveAlert).filter_by(device_id=device.id).count() == 0
+
+
+def test_delete_device_with_telemetry(client, db):
+    device = _device(db, "node-7")
+    # Точка до секционирования — в старой таблице с внешним ключом
+    db.add(models.DeviceTelemetry(device_id=device.id, metric_name="device_cpu_usage", value=10.0))
+    db.commit()
+    now = datetime.now(timezone.utc)
+    telemetry_store.write(db, [(device.id, "device_cpu_usage", 42.0, now)])
+    db.commit()
+
+    assert client.delete(f"/devices/{device.id}").status_code == 200
+    assert telemetry_store.recent(db, device.id, "device_cpu_usage", 10) == []
@@ -0,0 +1,63 @@
+import random
+from datetime import datetime, timedelta
+
+import models
+from utils.issue_stats import issue_stats
+
+
+def _snapshot(db):
+    # Строки с нулевым счетчиком после переноса rebuild не создает — сравниваем только живые
+    stats = models.IssueStats
+    dis = models.DeviceIssueStats
+    return (
+        sorted(db.query(stats.issue_id, stats.trace_count, stats.device_count, stats.last_occurrence)
+               .filter(stats.trace_count > 0).all()),
+        sorted(db.query(dis.device_id, dis.issue_id, dis.trace_count, dis.last_occurrence).all()),
+    )
+
+
+def _link(db, trace, issue_id):
+    # Как attach_decoded_coredump: сначала снимаем со старого issue, потом добавляем к новому
+    if trace.issue_id is not None:
+        issue_stats.remove(db, trace, trace.issue_id)
+    issue_stats.add(db, trace, issue_id)
+    trace.issue_id = issue_id
+    db.flush()
+
+
+def test_incremental_counts_match_rebuild(db):
+    rnd = random.Random(7)
+    issues = [models.Issue(name=f"panic {i}", type=models.IssueTypeEnum.abort) for i in range(3)]
+    devices = [models.Device(serial=f"node-{i}") for i in range(4)]
+    db.add_all(issues + devices)
+    db.flush()
+
+    traces = []
+    start = datetime(2026, 1, 1)
+    for _ in range(60):
+        if traces and rnd.random() < 0.4:
+            # повторный разбор сменил причину
+            _link(db, rnd.choice(traces), rnd.choice(issues).id)
+            continue
+        device = rnd.choice(devices + [None])
+        trace = models.Trace(
+            device_id=device.id if device else None,
+            occurrence=start + timedelta(minutes=rnd.randrange(1000)),
+            status=models.TraceStatusEnum.decoded,
+        )
+        db.add(trace)
+        db.flush()
+        traces.append(trace)
+        _link(db, trace, rnd.choice(issues).id)
+
+    gone = devices[0].id
+    issue_stats.remove_device(db, gone)
+    db.query(models.Trace).filter(models.Trace.device_id == gone).update({"device_id": None})
+    db.commit()
+
+    incremental = _snapshot(db)
+    issue_stats.rebuild(db)
+    db.commit()
+
+    assert incremental == _snapshot(db)
+    assert all(device_id != gone for device_id, *_ in incremental[1])
@@ -0,0 +1,37 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import models
+from utils.last_seen import LastSeenTracker
+
+
+def test_flush_writes_each_device_time_in_chunks(db):
+    db.add_all([models.Device(serial=s) for s in ("node-1", "node-2", "node-3")])
+    db.commit()
+    tracker = LastSeenTracker(chunk=1)
+    first = datetime(2026, 1, 1, 10, 0)
+    second = datetime(2026, 1, 1, 11, 0)
+    tracker.touch("node-1", first)
+    tracker.touch("node-2", second)
+    tracker.touch("unknown", second)
+
+    asyncio.run(tracker.flush())
+
+    db.expire_all()
+    last_sync = dict(db.query(models.Device.serial, models.Device.last_sync).all())
+    assert last_sync == {"node-1": first, "node-2": second, "node-3": None}
+    assert tracker.stats()["dirty"] == 0
+
+
+def test_evict_keeps_unflushed_serials():
+    tracker = LastSeenTracker(retention=30)
+    old = datetime.now(timezone.utc) - timedelta(minutes=5)
+    tracker.touch("flushed", old)
+    tracker.touch("dirty", old)
+    tracker._dirty.pop("flushed")
+
+    tracker.evict()
+
+    assert tracker.get("flushed") is None
+    assert tracker.get("dirty") == old
+    assert tracker.evicted == 1
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import inspect
+
+import models
+from utils.listing import devices_loader, parse_fields, project_device
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields("") is None
+    assert parse_fields(" serial, status ,") == {"serial", "status"}
+
+    with pytest.raises(HTTPException) as exc:
+        parse_fields("serial,password,zzz")
+    assert exc.value.status_code == 400
+    assert "password, zzz" in exc.value.detail
+
+
+def test_project_device_returns_only_requested_fields():
+    device = SimpleNamespace(serial="node-1", location="(55.7,37.6)", description="roof")
+
+    assert project_device(device, {"serial", "location", "status"}) == {
+        "location": [55.7, 37.6],
+        "serial": "node-1",
+        "status": None,
+    }
+
+
+def test_devices_loader_reads_only_projected_columns(db):
+    group = models.Group(name="roof")
+    db.add(group)
+    db.flush()
+    db.add(models.Device(serial="node-1", group_id=group.id, description="north", notes="n"))
+    db.commit()
+    db.expunge_all()
+
+    loaded = db.query(models.Group).options(devices_loader({"serial", "description"})).one()
+    device = loaded.devices[0]
+
+    unloaded = inspect(device).unloaded
+    assert {"id", "serial", "group_id", "last_sync", "description"}.isdisjoint(unloaded)
+    assert {"notes", "location", "total_work_time"} <= unloaded
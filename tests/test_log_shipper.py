@@ -0,0 +1,81 @@
+import asyncio
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+
+# telemetry_pb2 генерируется из telemetry.proto при сборке образа
+pytest.importorskip("telemetry_pb2")
+
+from utils import log_shipper as shipper_module
+from utils.log_shipper import LOKI_JOB, LokiLogShipper, entry_timestamp_ns
+
+
+def _log(message, seconds=0, level=0):
+    return SimpleNamespace(message=message, level=level, timestamp=SimpleNamespace(seconds=seconds, nanos=0))
+
+
+class FakeLoki:
+    def __init__(self, status_code=204):
+        self.status_code = status_code
+        self.bodies = []
+
+    async def post(self, name, path, content, headers):
+        assert headers["Content-Encoding"] == "gzip"
+        self.bodies.append(json.loads(gzip.decompress(content)))
+        return SimpleNamespace(status_code=self.status_code, text="")
+
+
+def test_entry_timestamp_falls_back_to_receive_time():
+    assert entry_timestamp_ns(_log("x", seconds=2), 5) == 2 * 10**9
+    assert entry_timestamp_ns(_log("x"), 5) == 5
+    assert entry_timestamp_ns(SimpleNamespace(), 5) == 5
+
+
+def test_payload_has_one_sorted_stream_per_serial_and_level():
+    payload = LokiLogShipper.build_payload({
+        ("node-1", "INFO"): [(3, "c"), (1, "a")],
+        ("node-1", "ERROR"): [(2, "b")],
+    })
+
+    assert payload["streams"] == [
+        {"stream": {"serial": "node-1", "job": LOKI_JOB, "level": "INFO"}, "values": [["1", "a"], ["3", "c"]]},
+        {"stream": {"serial": "node-1", "job": LOKI_JOB, "level": "ERROR"}, "values": [["2", "b"]]},
+    ]
+
+
+def test_lines_are_batched_by_size_and_age(monkeypatch):
+    loki = FakeLoki()
+    monkeypatch.setattr(shipper_module, "http_clients", loki)
+
+    async def scenario():
+        shipper = LokiLogShipper(max_lines=2, max_age=0.05)
+        shipper.submit("node-1", [_log("a", 1), _log("b", 2), _log("c", 3)])
+        shipper.start()
+        await asyncio.sleep(0.2)
+        await shipper.stop()
+        return shipper
+
+    shipper = asyncio.run(scenario())
+
+    # Первая пачка — по размеру, остаток — по возрасту
+    assert [sum(len(s["values"]) for s in body["streams"]) for body in loki.bodies] == [2, 1]
+    assert shipper.shipped == 3 and shipper.failed == 0
+
+
+def test_rejected_batch_counts_as_failed(monkeypatch):
+    monkeypatch.setattr(shipper_module, "http_clients", FakeLoki(status_code=500))
+    shipper = LokiLogShipper()
+    shipper._add(("node-1", "INFO", 1, "a"))
+
+    asyncio.run(shipper.flush())
+
+    assert (shipper.shipped, shipper.failed) == (0, 1)
+
+
+def test_full_queue_drops_lines():
+    shipper = LokiLogShipper(queue_size=1)
+    shipper.submit("node-1", [_log("a"), _log("b")])
+
+    assert (shipper.accepted, shipper.dropped) == (1, 1)
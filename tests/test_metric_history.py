@@ -0,0 +1,61 @@
+import asyncio
+
+from utils import metric_history
+from utils.metric_history import covers, merge_history, resample
+
+
+def _points(*times):
+    return [{"time": t, "value": float(t)} for t in times]
+
+
+def test_resample_takes_latest_sample_within_lookback():
+    history = resample([0, 50, 130], [1.0, 2.0, 3.0], 0, 600, 60, lookback=100)
+
+    assert history == [
+        {"time": 0, "value": 1.0},
+        {"time": 60, "value": 2.0},
+        {"time": 120, "value": 2.0},
+        {"time": 180, "value": 3.0},
+    ]
+
+
+def test_resample_sorts_and_handles_empty():
+    assert resample([], [], 0, 60, 60) == []
+    assert resample([60, 0], [2.0, 1.0], 0, 60, 60) == [{"time": 0, "value": 1.0}, {"time": 60, "value": 2.0}]
+
+
+def test_covers_and_merge():
+    local = _points(600, 660)
+    assert not covers(local, 0, 60)
+    assert covers(_points(60, 120), 0, 60)
+    assert not covers([], 0, 60)
+
+    assert merge_history(local, _points(0, 60, 600, 660)) == _points(0, 60, 600, 660)
+    assert merge_history([], _points(0)) == _points(0)
+
+
+def test_truncated_local_history_is_completed_from_prometheus(monkeypatch):
+    async def remote(serial, full_name, start, end, step):
+        return [{"time": t, "value": -1.0} for t in range(start, end + 1, step)]
+
+    monkeypatch.setattr(metric_history, "HISTORY_SOURCE", "local")
+    monkeypatch.setattr(metric_history, "local_series", lambda *args: {"device_cpu_usage": _points(240, 300)})
+    monkeypatch.setattr(metric_history, "prometheus_history", remote)
+
+    history = asyncio.run(metric_history.metric_history(None, 1, "node-1", "device_cpu_usage", 0, 300))
+
+    assert [p["time"] for p in history] == [0, 60, 120, 180, 240, 300]
+    assert [p["value"] for p in history] == [-1.0] * 4 + [240.0, 300.0]
+
+
+def test_local_history_survives_prometheus_failure(monkeypatch):
+    async def remote(*args):
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(metric_history, "HISTORY_SOURCE", "local")
+    monkeypatch.setattr(metric_history, "local_series", lambda *args: {"device_cpu_usage": _points(240, 300)})
+    monkeypatch.setattr(metric_history, "prometheus_history", remote)
+
+    history = asyncio.run(metric_history.metric_history(None, 1, "node-1", "device_cpu_usage", 0, 300))
+
+    assert history == _points(240, 300)
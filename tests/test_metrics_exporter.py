@@ -0,0 +1,24 @@
+import pytest
+from prometheus_client.exposition import _escape_grouping_key
+
+from utils.metrics_exporter import PUSH_JOB, MetricsExporter
+
+
+@pytest.mark.parametrize("serial", ["node-1", "dryer 7", "a/b", "", "ключ", "x+y&z=1"])
+def test_group_path_matches_prometheus_client(serial):
+    # push_to_gateway строит путь так же: экранированный job, затем пары ключ/значение группировки
+    job = _escape_grouping_key("job", PUSH_JOB)[1]
+    expected = f"/metrics/job/{job}/" + "/".join(_escape_grouping_key("serial", serial))
+
+    assert MetricsExporter._group_path(serial) == expected
+
+
+def test_update_merges_values_and_bounds_new_serials():
+    exporter = MetricsExporter(max_pending=1)
+
+    assert exporter.update("node-1", {"device_cpu_usage": 10})
+    assert exporter.update("node-1", {"device_cpu_usage": 12, "device_battery_level": 80})
+    assert not exporter.update("node-2", {"device_cpu_usage": 1})
+
+    assert exporter._pending == {"node-1": {"device_cpu_usage": 12, "device_battery_level": 80}}
+    assert exporter.dropped_updates == 1
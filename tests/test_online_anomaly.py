@@ -0,0 +1,77 @@
+import time
+from datetime import datetime, timezone
+
+import models
+from utils.online_anomaly import OnlineAnomalyDetector, full_metric_name
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _detector(**kwargs):
+    detector = OnlineAnomalyDetector(warmup=5, **kwargs)
+    detector.set_threshold("cpu_usage", None, 90.0)
+    return detector
+
+
+def _kinds(detector):
+    return [(e["serial"], e["kind"]) for e in detector.recent()][::-1]
+
+
+def test_full_metric_name():
+    assert full_metric_name("dryer.temp_now") == "device_dryer_temp_now"
+
+
+def test_threshold_events_are_edge_triggered():
+    detector = _detector()
+    for value in (50.0, 95.0, 96.0, 50.0, 97.0):
+        detector.observe("node-1", [("device_cpu_usage", value, NOW)])
+
+    assert _kinds(detector) == [("node-1", "above_max"), ("node-1", "above_max")]
+    assert detector.recent()[0]["threshold"] == 90.0
+
+
+def test_thresholds_apply_beyond_max_series():
+    detector = _detector(max_series=1)
+    detector.observe("node-1", [("device_cpu_usage", 50.0, NOW)])
+    for value in (95.0, 96.0, 50.0, 97.0):
+        detector.observe("node-2", [("device_cpu_usage", value, NOW)])
+
+    assert detector.stats()["series"] == 1
+    assert detector.untracked_series == 4
+    assert _kinds(detector) == [("node-2", "above_max"), ("node-2", "above_max")]
+
+
+def test_baseline_anomaly_after_warmup():
+    detector = _detector()
+    for i in range(20):
+        detector.observe("node-1", [("device_cpu_usage", 40.0 + (i % 3), NOW)])
+    assert detector.recent() == []
+
+    detector.observe("node-1", [("device_cpu_usage", 80.0, NOW)])
+
+    assert _kinds(detector) == [("node-1", "baseline_high")]
+
+
+def test_idle_series_are_evicted():
+    detector = _detector(idle_seconds=60)
+    detector.observe("node-1", [("device_cpu_usage", 50.0, NOW)])
+    detector.observe("node-2", [("device_cpu_usage", 50.0, NOW)])
+    detector._series[("node-1", "device_cpu_usage")][4] = time.monotonic() - 120
+
+    detector.evict_idle()
+
+    assert list(detector._series) == [("node-2", "device_cpu_usage")]
+    assert detector.stats()["evicted_series"] == 1
+
+
+def test_remove_device_forgets_series(db):
+    device = models.Device(serial="node-1")
+    db.add(device)
+    db.flush()
+    detector = _detector()
+    detector.observe("node-1", [("device_cpu_usage", 50.0, NOW)])
+    detector.observe("node-2", [("device_cpu_usage", 50.0, NOW)])
+
+    detector.remove_device(db, device.id)
+
+    assert list(detector._series) == [("node-2", "device_cpu_usage")]
@@ -0,0 +1,57 @@
+from sqlalchemy import inspect, text
+
+import models
+from database import engine
+from utils.coredump_jobs import ensure_trace_columns
+from utils.issue_stats import issue_stats
+from utils.trace_memory import ensure_segment_index
+
+
+def test_trace_columns_added_to_old_table(db):
+    db.close()
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE traces"))
+        # traces до фонового разбора
+        conn.execute(text(
+            "CREATE TABLE traces (id INTEGER PRIMARY KEY, issue_id INTEGER, device_id INTEGER, "
+            "core_dump JSON, occurrence DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO traces (id, core_dump) VALUES (1, '{}')"))
+    # Как при старте процесса — свежие соединения: SQLite не всегда перечитывает схему, измененную другим соединением
+    engine.dispose()
+
+    ensure_trace_columns()
+    engine.dispose()
+    ensure_trace_columns()
+    issue_stats.ensure_indexes()
+
+    columns = {c["name"] for c in inspect(engine).get_columns("traces")}
+    assert {"raw_dump", "status", "decode_error", "decode_mode", "firmware_version"} <= columns
+    trace = db.get(models.Trace, 1)
+    assert trace.status == models.TraceStatusEnum.decoded
+    assert trace.decode_mode == "full"
+    assert trace.firmware_version is None
+
+
+def _segments(db, *indexes):
+    trace = models.Trace(status=models.TraceStatusEnum.decoded)
+    db.add(trace)
+    db.flush()
+    for i in indexes:
+        db.add(models.TraceMemorySegment(trace_id=trace.id, index=i, name="dram", address=0, size=0, attrs=""))
+    db.commit()
+    return trace
+
+
+def test_segment_index_dedupes_only_when_needed(db):
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ux_trace_memory_segments_trace_index"))
+    _segments(db, 0, 1, 1, 2)
+
+    ensure_segment_index()
+    ensure_segment_index()
+
+    indexes = {i["name"] for i in inspect(engine).get_indexes("trace_memory_segments")}
+    assert "ux_trace_memory_segments_trace_index" in indexes
+    rows = db.query(models.TraceMemorySegment.index).order_by(models.TraceMemorySegment.index).all()
+    assert [r.index for r in rows] == [0, 1, 2]
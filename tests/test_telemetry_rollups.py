@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import models
+from utils.telemetry_rollups import RESOLUTIONS, TelemetryRollups, bucket_start, pick_resolution
+
+
+def _device(db):
+    device = models.Device(serial="node-1")
+    db.add(device)
+    db.flush()
+    return device.id
+
+
+def _bucket(db, device_id, resolution, bucket):
+    r = models.TelemetryRollup
+    return db.query(r).filter(
+        r.device_id == device_id, r.metric_name == "device_cpu", r.resolution == resolution, r.bucket == bucket
+    ).one()
+
+
+def test_merge_upserts_bucket_across_batches(db):
+    device_id = _device(db)
+    rollups = TelemetryRollups()
+    # Текущая минута, чтобы корзины не отсекались retention-ом
+    minute = bucket_start(datetime.now(timezone.utc), 60)
+
+    def at(seconds):
+        return minute + timedelta(seconds=seconds)
+
+    rollups.merge(db, [(device_id, "device_cpu", 5.0, at(10)), (device_id, "device_cpu", 1.0, at(30))])
+    # Вторая пачка: точка из прошлого не должна перезаписать last
+    rollups.merge(db, [(device_id, "device_cpu", 9.0, at(5)), (device_id, "device_cpu", None, at(50))])
+    db.commit()
+
+    b = _bucket(db, device_id, 60, minute)
+    assert (b.min, b.max, b.sum, b.count, b.last) == (1.0, 9.0, 15.0, 3, 1.0)
+
+    rollups.merge(db, [(device_id, "device_cpu", 4.0, at(40))])
+    db.commit()
+    db.expire_all()
+    b = _bucket(db, device_id, 60, minute)
+    assert (b.min, b.max, b.sum, b.count, b.last) == (1.0, 9.0, 19.0, 4, 4.0)
+
+
+def test_aggregate_skips_points_older_than_retention():
+    old = datetime.now(timezone.utc) - timedelta(days=RESOLUTIONS[60] + 1)
+
+    buckets = TelemetryRollups().aggregate([(1, "device_cpu", 1.0, old)])
+
+    assert {key[2] for key in buckets} == {r for r, days in RESOLUTIONS.items() if days > RESOLUTIONS[60]}
+
+
+@pytest.mark.parametrize("hours, step, raw_days, expected", [
+    (3, 60, 7, 60),          # шаг = минута
+    (24, 600, 7, 300),       # самая грубая корзина не крупнее шага
+    (48, 7200, 7, 3600),
+    (3, 10, 7, None),        # шаг мельче всех корзин — сырые точки
+    (24 * 20, 10, 7, 300),   # сырых точек за этот период уже нет
+    (24 * 20, 60, 30, 300),  # 1m хранится меньше периода
+    (24 * 400, 3600, 7, None),
+])
+def test_pick_resolution(hours, step, raw_days, expected):
+    assert pick_resolution(hours, step, raw_days) == expected
@@ -0,0 +1,30 @@
+import asyncio
+from datetime import datetime, timezone
+
+import models
+from utils.telemetry_store import telemetry_store
+from utils.telemetry_writer import TelemetryWriter
+
+
+def test_failing_hook_does_not_rewrite_batch(db):
+    db.add(models.Device(serial="node-1"))
+    db.commit()
+    writer = TelemetryWriter()
+    seen = []
+
+    def broken(rows):
+        raise RuntimeError("boom")
+
+    writer.write_hooks += [broken, seen.append]
+    writer.submit("node-1", [("device_cpu_usage", 42.0, datetime.now(timezone.utc))])
+
+    asyncio.run(writer.flush())
+    asyncio.run(writer.flush())
+
+    assert writer.written == 1
+    assert writer.hook_errors == 1
+    assert writer.stats()["buffered"] == 0
+    # Следующий подписчик все равно получил пачку
+    assert len(seen) == 1
+    device_id = db.query(models.Device.id).scalar()
+    assert len(telemetry_store.recent(db, device_id, "device_cpu_usage", 10)) == 1
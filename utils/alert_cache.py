@@ -0,0 +1,186 @@
+import asyncio
+import os
+import time
+
+import models
+from database import SessionLocal
+from utils.http_clients import http_clients
+
+
+PROMETHEUS_ALERTS_PATH = "/api/v1/alerts"
+ALERTS_CACHE_TTL = float(os.getenv("ALERTS_CACHE_TTL", "10"))
+# Фоновое обновление; с вебхуком Alertmanager это только сверка, можно реже
+ALERTS_REFRESH_INTERVAL = float(os.getenv("ALERTS_REFRESH_INTERVAL", "10"))
+
+
+def enrich_alert(alert):
+    # Пытаемся достать серийник из лейблов
+    serial = alert["labels"].get("serial") or alert["labels"].get("instance")
+    return {
+        "alertname": alert["labels"].get("alertname"),
+        "severity": alert["labels"].get("severity", "warning"),
+        "summary": alert.get("annotations", {}).get("summary", ""),
+        "description": alert.get("annotations", {}).get("description", ""),
+        # Prometheus отдает activeAt, Alertmanager — startsAt
+        "active_at": alert.get("activeAt") or alert.get("startsAt"),
+        "serial": serial or "unknown",
+    }
+
+
+def _alert_key(alert):
+    return tuple(sorted(alert["labels"].items()))
+
+
+class ActiveAlertCache:
+    """
+    Firing Prometheus alerts indexed by serial, group and project, so a
+    per-device lookup is a dict hit. A background task re-reads
+    /api/v1/alerts (and the serial -> group/project map) every
+    ALERTS_REFRESH_INTERVAL seconds; Alertmanager can also push changes to
+    the webhook in between. Without the task, reads fall back to a
+    TTL-based single-flight refresh. A failed refresh keeps the previous
+    snapshot.
+    """
+
+    def __init__(self, ttl=ALERTS_CACHE_TTL, interval=ALERTS_REFRESH_INTERVAL):
+        self.ttl = ttl
+        self.interval = interval
+        self._active = {}         # labels -> alert
+        self._device_groups = {}  # serial -> (group_id, project_id)
+        self._alerts = []
+        self._by_serial = {}
+        self._by_group = {}
+        self._by_project = {}
+        self._fetched_at = 0.0
+        self._loaded = False
+        self._refreshing = None
+        self._task = None
+
+        self.refreshes = 0
+        self.errors = 0
+        self.hits = 0
+        self.webhook_updates = 0
+
+    def _load_device_groups(self):
+        with SessionLocal() as db:
+            rows = db.query(models.Device.serial, models.Device.group_id, models.Group.project_id).outerjoin(
+                models.Group, models.Device.group_id == models.Group.id
+            ).all()
+        return {serial: (group_id, project_id) for serial, group_id, project_id in rows}
+
+    def _reindex(self):
+        alerts = list(self._active.values())
+        by_serial, by_group, by_project = {}, {}, {}
+        for alert in alerts:
+            by_serial.setdefault(alert["serial"], []).append(alert)
+            group_id, project_id = self._device_groups.get(alert["serial"], (None, None))
+            if group_id is not None:
+                by_group.setdefault(group_id, []).append(alert)
+            if project_id is not None:
+                by_project.setdefault(project_id, []).append(alert)
+        self._alerts, self._by_serial, self._by_group, self._by_project = alerts, by_serial, by_group, by_project
+
+    async def _fetch(self):
+        try:
+            resp, device_groups = await asyncio.gather(
+                http_clients.get("prometheus", PROMETHEUS_ALERTS_PATH),
+                asyncio.to_thread(self._load_device_groups),
+            )
+            prometheus_alerts = resp.json().get("data", {}).get("alerts", [])
+            self._active = {_alert_key(a): enrich_alert(a) for a in prometheus_alerts if a.get("state") == "firing"}
+            self._device_groups = device_groups
+            self._reindex()
+            self._loaded = True
+            self.refreshes += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Prometheus Alerts Error: {e}")
+        finally:
+            # И после ошибки не долбим Prometheus чаще раза в TTL
+            self._fetched_at = time.monotonic()
+
+    async def refresh(self):
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._fetch())
+            self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+        await asyncio.shield(self._refreshing)
+
+    async def _ensure_fresh(self):
+        # Пока работает фоновое обновление, запросы читают индекс без ожидания
+        if self._task is not None and self._loaded:
+            self.hits += 1
+        elif time.monotonic() - self._fetched_at >= self.ttl:
+            await self.refresh()
+        else:
+            self.hits += 1
+
+    def apply_webhook(self, payload):
+        """Applies an Alertmanager webhook payload: firing alerts are added, resolved ones removed."""
+        changed = 0
+        for alert in payload.get("alerts", []):
+            if "labels" not in alert:
+                continue
+            key = _alert_key(alert)
+            if alert.get("status") == "firing":
+                self._active[key] = enrich_alert(alert)
+                changed += 1
+            elif self._active.pop(key, None) is not None:
+                changed += 1
+        if changed:
+            self._reindex()
+        self.webhook_updates += 1
+        return changed
+
+    async def all(self):
+        await self._ensure_fresh()
+        return self._alerts
+
+    async def for_serial(self, serial):
+        await self._ensure_fresh()
+        return self._by_serial.get(serial, [])
+
+    async def for_group(self, group_id):
+        await self._ensure_fresh()
+        return self._by_group.get(group_id, [])
+
+    async def for_project(self, project_id):
+        await self._ensure_fresh()
+        return self._by_project.get(project_id, [])
+
+    def peek(self, serial):
+        """Alerts of a serial from the current snapshot, without refreshing it."""
+        return self._by_serial.get(serial, [])
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "alerts": len(self._alerts),
+            "serials": len(self._by_serial),
+            "groups": len(self._by_group),
+            "projects": len(self._by_project),
+            "age_seconds": round(time.monotonic() - self._fetched_at, 1) if self._loaded else None,
+            "refreshes": self.refreshes,
+            "webhook_updates": self.webhook_updates,
+            "hits": self.hits,
+            "errors": self.errors,
+        }
+
+
+alert_cache = ActiveAlertCache()
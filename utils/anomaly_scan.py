@@ -0,0 +1,177 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from model.diagnostics import get_device_diagnostics
+from utils.metric_history import fleet_history
+
+
+WORKERS = int(os.getenv("ANOMALY_SCAN_WORKERS", "2"))
+SHARD_SIZE = int(os.getenv("ANOMALY_SCAN_SHARD_SIZE", "16"))
+CACHE_SIZE = int(os.getenv("ANOMALY_SCAN_CACHE_SIZE", "20000"))
+WINDOW_MINUTES = int(os.getenv("ANOMALY_SCAN_WINDOW_MINUTES", "150"))
+STEP = 60
+PERIOD = 30
+
+
+def diagnose_shard(shard):
+    """
+    Pool worker: [(device_id, times, values)] -> [(device_id, report)];
+    the same STL + IQR diagnostics as /model/get_device_anomalies.
+    """
+    results = []
+    for device_id, times, values in shard:
+        if len(values) < 2 * PERIOD:
+            results.append((device_id, {
+                "status": "collecting_data",
+                "message": f"Недостаточно данных. Нужно {2*PERIOD}, есть {len(values)}",
+            }))
+            continue
+        series = pd.Series(values, index=pd.to_datetime(times, unit='s'), dtype=float)
+        try:
+            results.append((device_id, get_device_diagnostics(series, period=PERIOD)))
+        except Exception as e:
+            results.append((device_id, {"status": "error", "message": str(e)}))
+    return results
+
+
+def _rank(report):
+    return (-report.get("anomaly_count", 0), -report.get("degradation_value", 0.0))
+
+
+class AnomalyScanner:
+    """
+    Group/project-wide STL anomaly scan. One metric's history for all
+    member devices is fetched in one go (utils.metric_history.fleet_history),
+    series are decomposed in a process pool in shards of SHARD_SIZE and the
+    anomalous devices are returned ranked by anomaly count, then trend
+    degradation.
+
+    Reports are cached per (device_id, metric, window) together with the
+    data watermark they were computed on (first/last sample time and point
+    count), so a series is only decomposed again once new data arrives.
+    """
+
+    def __init__(self, workers=WORKERS, shard_size=SHARD_SIZE, max_entries=CACHE_SIZE):
+        self.workers = workers
+        self.shard_size = shard_size
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # (device_id, metric, minutes) -> (watermark, report)
+        self._pool = None
+
+        self.scans = 0
+        self.series_scanned = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self.last_scan = {}
+
+    def _cached(self, key, watermark):
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != watermark:
+            self.cache_misses += 1
+            return None
+        self._cache.move_to_end(key)
+        self.cache_hits += 1
+        return entry[1]
+
+    def _remember(self, key, watermark, report):
+        self._cache[key] = (watermark, report)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    async def scan(self, db, devices, metric, minutes=WINDOW_MINUTES, limit=None):
+        """
+        devices: [(device_id, serial)]. Returns counters and the ranked
+        anomalous devices (status warning or degrading trend).
+        """
+        started = time.perf_counter()
+        end = int(time.time())
+        end -= end % STEP  # сетка по минутам, чтобы окна соседних запросов совпадали
+        histories = await fleet_history(db, devices, metric, end - minutes * 60, end, step=STEP)
+
+        reports, due, marks = {}, [], {}
+        for device_id, history in histories.items():
+            key = (device_id, metric, minutes)
+            watermark = (history[0]["time"], history[-1]["time"], len(history))
+            report = self._cached(key, watermark)
+            if report is not None:
+                reports[device_id] = report
+                continue
+            marks[device_id] = watermark
+            due.append((device_id, [p["time"] for p in history], [p["value"] for p in history]))
+
+        shards = [due[i:i + self.shard_size] for i in range(0, len(due), self.shard_size)]
+        loop = asyncio.get_running_loop()
+        # Без пула (вне lifespan) считаем в потоках по умолчанию
+        results = await asyncio.gather(*(loop.run_in_executor(self._pool, diagnose_shard, shard) for shard in shards))
+        for device_id, report in (r for shard in results for r in shard):
+            reports[device_id] = report
+            if report["status"] == "error":
+                self.errors += 1
+                continue
+            self._remember((device_id, metric, minutes), marks[device_id], report)
+
+        serials = dict(devices)
+        anomalous = sorted(
+            (
+                {"device_id": device_id, "serial": serials.get(device_id), **report}
+                for device_id, report in reports.items()
+                if report["status"] == "warning" or report.get("is_degrading")
+            ),
+            key=_rank,
+        )
+
+        elapsed = time.perf_counter() - started
+        self.scans += 1
+        self.series_scanned += len(reports)
+        self.last_scan = {
+            "seconds": round(elapsed, 3),
+            "devices": len(devices),
+            "with_data": len(histories),
+            "computed": len(due),
+            "anomalous": len(anomalous),
+        }
+        return {
+            "metric": metric,
+            "window_minutes": minutes,
+            "devices": len(devices),
+            "scanned": len(reports),
+            "no_data": len(devices) - len(histories),
+            "collecting_data": sum(1 for r in reports.values() if r["status"] == "collecting_data"),
+            "errors": sum(1 for r in reports.values() if r["status"] == "error"),
+            "anomalous_count": len(anomalous),
+            "anomalous": anomalous[:limit] if limit else anomalous,
+        }
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    async def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "evictions": self.evictions,
+            "scans": self.scans,
+            "series_scanned": self.series_scanned,
+            "errors": self.errors,
+            "last_scan": self.last_scan,
+        }
+
+
+anomaly_scanner = AnomalyScanner()
@@ -1,16 +1,25 @@
 import json
+import os
+import struct
 import argparse
+import tempfile
+import time
 from esp_coredump import CoreDump
 from esp_coredump.corefile.elf import ESPCoreDumpElfFile, EspTaskStatus, TASK_STATUS_CORRECT
 from esp_coredump.corefile.gdb import EspGDB
 from construct import Struct, GreedyRange, Int32ul
 from esp_coredump.corefile import xtensa
 from esp_coredump.corefile.elf import ElfSegment
+from utils.firmware_registry import firmware_registry
+
+# Сколько ждать вывода GDB за один вызов, прежде чем снова проверить общий таймаут
+GDB_POLL_SEC = 0.5
 
 
 class CoreDumpDecoder(CoreDump):
-    def __init__(self, **kwargs):
+    def __init__(self, batch_threads=True, **kwargs):
         super().__init__(**kwargs)
+        self.batch_threads = batch_threads
         self.output = {}
 
     def get_crashed_task_info(self, marker):
@@ -63,6 +72,127 @@ class CoreDumpDecoder(CoreDump):
         return stack
     
 
+    TCB_FIELDS = ('pxEndOfStack', 'pxTopOfStack', 'pxStack', 'uxPriority', 'uxBasePriority')
+
+    def _build_thread_dict(self, thr_id, tcb_addr, task_name, tcb_values, backtrace_text, task_info):
+        pxEndOfStack, pxTopOfStack, pxStack, uxPriority, uxBasePriority = tcb_values or (0, 0, 0, 0, 0)
+
+        thread_dict = {
+            'id': thr_id,
+            'tcb_addr': f'0x{tcb_addr:x}',
+            'task_name': task_name,
+        }
+
+        if pxStack == 0:
+            thread_dict['error'] = 'Corrupted TCB data'
+        else:
+            thread_dict['priority'] = f'{uxPriority}/{uxBasePriority}'
+            thread_dict['stack-usage'] = f'{abs(pxEndOfStack - pxTopOfStack)}/{abs(pxStack - pxTopOfStack)}'
+
+        if isinstance(backtrace_text, Exception):
+            thread_dict['backtrace'] = {'error': f"Error getting backtrace: {backtrace_text}"}
+        else:
+            thread_dict['backtrace'] = self.parse_backtrace(backtrace_text)
+
+        if task_info and task_info[thr_id - 1].task_flags != TASK_STATUS_CORRECT:
+            thread_dict['corrupted'] = True
+            thread_dict['task-info'] = {
+                'index': task_info[thr_id - 1].task_index,
+                'flags': task_info[thr_id - 1].task_flags,
+                'tcb-addr': task_info[thr_id - 1].task_tcb_addr,
+                'stack-start': task_info[thr_id - 1].task_stack_start,
+            }
+        return thread_dict
+
+    def _inspect_thread(self, thr_id, tcb_addr):
+        """One thread, one GDB round-trip per field (fallback path)."""
+        task_name = self.gdb_esp.get_freertos_task_name(tcb_addr)
+        try:
+            tcb_values = tuple(int(self.gdb_esp.parse_tcb_variable(tcb_addr, f), 16) for f in self.TCB_FIELDS)
+        except ValueError:
+            tcb_values = None
+
+        self.gdb_esp.switch_thread(thr_id)
+        try:
+            backtrace_text = self.gdb_esp.run_cmd('bt')
+        except Exception as e:
+            backtrace_text = e
+        return task_name, tcb_values, backtrace_text
+
+    def _run_gdb_script(self, commands, timeout):
+        """
+        Runs a list of GDB CLI commands as one sourced script, i.e. a single
+        MI round-trip. Returns (console output, completed without error).
+        """
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.gdb', delete=False) as tmp:
+            tmp.write('\n'.join(commands) + '\n')
+            script_path = tmp.name
+        try:
+            gdb = self.gdb_esp.p
+            gdb.write(f'-interpreter-exec console "source {script_path}"', read_response=False)
+            chunks, ok = [], False
+            t_end = time.time() + timeout
+            while True:
+                remaining = t_end - time.time()
+                if remaining <= 0:
+                    break
+                # Блокирующее ожидание вывода, а не опрос вхолостую
+                responses = gdb.get_gdb_response(timeout_sec=min(GDB_POLL_SEC, remaining), raise_error_on_timeout=False)
+                # pygdbmi уже раскрыл экранирование в payload консольных записей
+                chunks += [r['payload'] for r in responses if r['type'] == 'console' and r['payload']]
+                results = [r for r in responses if r['type'] == 'result']
+                if results:
+                    ok = results[-1]['message'] == 'done'
+                    break
+        finally:
+            os.unlink(script_path)
+        return ''.join(chunks), ok
+
+    def _inspect_threads_batch(self, entries):
+        """
+        Inspects all threads with one generated GDB script: TCB fields, task
+        name and backtrace per thread, separated by markers in the output.
+        Returns {thr_id: (task_name, tcb_values, backtrace_text)} for every
+        thread whose section ran to completion.
+        """
+        commands = []
+        for thr_id, tcb_addr in entries:
+            tcb = f'((TCB_t *)0x{tcb_addr:x})'
+            fields = ', '.join(f'(unsigned int){tcb}->{f}' for f in self.TCB_FIELDS)
+            commands += [
+                f'printf "@@THREAD {thr_id}\\n"',
+                f'printf "@@NAME %s\\n", (char *){tcb}->pcTaskName',
+                f'printf "@@TCB %#x %#x %#x %#x %#x\\n", {fields}',
+                f'thread {thr_id}',
+                'printf "@@BT\\n"',
+                'bt',
+            ]
+        commands.append('printf "@@END\\n"')
+
+        output, _ = self._run_gdb_script(commands, timeout=self.gdb_timeout_sec * max(1, len(entries)))
+
+        results = {}
+        current = None
+        for line in output.split('\n'):
+            if line.startswith('@@THREAD ') or line.startswith('@@END'):
+                if current is not None and current['bt'] is not None:
+                    results[current['id']] = (current['name'], current['tcb'], '\n'.join(current['bt']))
+                current = {'id': int(line.split()[1]), 'name': '', 'tcb': None, 'bt': None} if line.startswith('@@THREAD ') else None
+            elif current is None:
+                continue
+            elif line.startswith('@@NAME '):
+                current['name'] = line[len('@@NAME '):].strip()
+            elif line.startswith('@@TCB '):
+                try:
+                    current['tcb'] = tuple(int(v, 16) for v in line.split()[1:])
+                except ValueError:
+                    current['tcb'] = None
+            elif line.startswith('@@BT'):
+                current['bt'] = []
+            elif current['bt'] is not None:
+                current['bt'].append(line)
+        return results
+
     def get_threads_info(self, task_info):
         threads_info = {}
         
@@ -70,50 +200,27 @@ class CoreDumpDecoder(CoreDump):
         if not threads:
             threads_info['error'] = 'Could not retrieve threads information.'
             return threads_info
-            
-        thread_list = []
-        for thr in threads:
-            thr_id = int(thr['id'])
-            tcb_addr = self.gdb_esp.gdb2freertos_thread_id(thr['target-id'])
-            task_name = self.gdb_esp.get_freertos_task_name(tcb_addr)
-            
-            try:
-                pxEndOfStack = int(self.gdb_esp.parse_tcb_variable(tcb_addr, 'pxEndOfStack'), 16)
-                pxTopOfStack = int(self.gdb_esp.parse_tcb_variable(tcb_addr, 'pxTopOfStack'), 16)
-                pxStack = int(self.gdb_esp.parse_tcb_variable(tcb_addr, 'pxStack'), 16)
-                uxPriority = int(self.gdb_esp.parse_tcb_variable(tcb_addr, 'uxPriority'), 16)
-                uxBasePriority = int(self.gdb_esp.parse_tcb_variable(tcb_addr, 'uxBasePriority'), 16)
-            except ValueError:
-                pxEndOfStack = pxTopOfStack = pxStack = uxPriority = uxBasePriority = 0
 
-            thread_dict = {
-                'id': thr_id,
-                'tcb_addr': f'0x{tcb_addr:x}',
-                'task_name': task_name,
-            }
-
-            if pxStack == 0:
-                thread_dict['error'] = 'Corrupted TCB data'
-            else:
-                thread_dict['priority'] = f'{uxPriority}/{uxBasePriority}'
-                thread_dict['stack-usage'] = f'{abs(pxEndOfStack - pxTopOfStack)}/{abs(pxStack - pxTopOfStack)}'
-
-            self.gdb_esp.switch_thread(thr_id)
-            try:
-                backtrace_text = self.gdb_esp.run_cmd('bt')
-                thread_dict['backtrace'] = self.parse_backtrace(backtrace_text)
-            except Exception as e:
-                thread_dict['backtrace'] = {'error': f"Error getting backtrace: {e}"}
+        entries = [(int(thr['id']), self.gdb_esp.gdb2freertos_thread_id(thr['target-id'])) for thr in threads]
+
+        inspected = {}
+        remaining = entries
+        while remaining:
+            if self.batch_threads:
+                inspected.update(self._inspect_threads_batch(remaining))
+            # GDB прерывает скрипт на первой ошибке (битый TCB): этот поток
+            # разбираем по-старому, остальные — следующим батчем
+            pending = [e for e in remaining if e[0] not in inspected]
+            if not pending:
+                break
+            thr_id, tcb_addr = pending[0]
+            inspected[thr_id] = self._inspect_thread(thr_id, tcb_addr)
+            remaining = pending[1:]
 
-            if task_info and task_info[thr_id - 1].task_flags != TASK_STATUS_CORRECT:
-                thread_dict['corrupted'] = True
-                thread_dict['task-info'] = {
-                    'index': task_info[thr_id - 1].task_index,
-                    'flags': task_info[thr_id - 1].task_flags,
-                    'tcb-addr': task_info[thr_id - 1].task_tcb_addr,
-                    'stack-start': task_info[thr_id - 1].task_stack_start,
-                }
-            thread_list.append(thread_dict)
+        thread_list = []
+        for thr_id, tcb_addr in entries:
+            task_name, tcb_values, backtrace_text = inspected[thr_id]
+            thread_list.append(self._build_thread_dict(thr_id, tcb_addr, task_name, tcb_values, backtrace_text, task_info))
 
         return thread_list
 
@@ -209,7 +316,7 @@ class CoreDumpDecoder(CoreDump):
 
     def get_all_memory_regions(self):
         regions = []
-        core_segs = self.core_elf.load_segments
+        core_segs = list(self.core_elf.load_segments)
         merged_segs = []
         for sec in self.exe_elf.sections:
             merged = False
@@ -248,55 +355,60 @@ class CoreDumpDecoder(CoreDump):
             
         return regions
 
+    @staticmethod
+    def core_segment_name(cs):
+        if cs.flags & ElfSegment.PF_X:
+            return '.coredump.rom.text'
+        return '.coredump.tasks.data'
+
     def get_core_dump_memory_contents(self):
+        """
+        Segment list only: the bytes are served lazily by
+        GET /traces/{id}/memory/{segment}, so they never end up in core_dump JSON.
+        """
         mem_contents = []
-        for cs in self.core_elf.load_segments:
-            if cs.flags & ElfSegment.PF_X:
-                seg_name = 'rom.text'
-            else:
-                seg_name = 'tasks.data'
-            
-            content = {
-                'name': f'.coredump.{seg_name}',
+        for i, cs in enumerate(self.core_elf.load_segments):
+            mem_contents.append({
+                'segment': i,
+                'name': self.core_segment_name(cs),
                 'address': f'0x{cs.addr:x}',
                 'size': f'0x{len(cs.data):x}',
                 'attrs': cs.attr_str(),
-                'dump': self.gdb_esp.run_cmd(f'x/{len(cs.data) // 4}dx 0x{cs.addr:x}')
-            }
-            mem_contents.append(content)
+            })
         return mem_contents
 
-    def info_corefile(self):
-        
+    def _load_core(self):
         with self._handle_coredump_loader_error():
-            self.exe_elf = ESPCoreDumpElfFile(self.prog)
+            # ELF прошивки разбираем один раз на процесс воркера
+            self.exe_elf = firmware_registry.exe_elf(self.prog)
             core_header_info_dict = self.get_core_header_info_dict(e_machine=self.exe_elf.e_machine)
             self.core_elf = ESPCoreDumpElfFile(core_header_info_dict['core_elf_path'])
 
-        temp_files = core_header_info_dict.pop('temp_files')
+        self.temp_files = core_header_info_dict.pop('temp_files') or []
         self.chip = self.verify_target(core_header_info_dict)
 
         if self.exe_elf.e_machine != self.core_elf.e_machine:
             raise ValueError('The arch should be the same between core elf and exe elf')
 
-        task_info, extra_note = self.get_task_info_extra_note_tuple()
-
-        self.output['start?'] = True
-
-        gdb_args = self.get_gdb_args(is_dbg_mode=False, **core_header_info_dict)
-
-        self.gdb_esp = EspGDB(gdb_args, timeout_sec=self.gdb_timeout_sec)
-
-        extra_info = None
-        if extra_note:
-            extra_info_struct = Struct('regs' / GreedyRange(Int32ul)).parse(extra_note.desc)
-            if extra_info_struct and hasattr(extra_info_struct, 'regs'):
-                extra_info = extra_info_struct.regs
-                if extra_info:
-                    marker = extra_info[0]
-                    self.output['crashed-task'] = self.get_crashed_task_info(marker)
-                    self.output['isr-context'] = self.get_isr_context(extra_info)
+        return core_header_info_dict
 
+    def cleanup_temp_files(self):
+        for path in getattr(self, 'temp_files', []):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def parse_extra_info(extra_note):
+        if not extra_note:
+            return None
+        extra_info_struct = Struct('regs' / GreedyRange(Int32ul)).parse(extra_note.desc)
+        if extra_info_struct and hasattr(extra_info_struct, 'regs'):
+            return extra_info_struct.regs or None
+        return None
+
+    def set_panic_details(self):
         panic_details = self.get_panic_details()
         if panic_details:
 
@@ -313,6 +425,26 @@ class CoreDumpDecoder(CoreDump):
             elif 'watchdog' in reason.lower():
                 self.output['type'] = 'watchdog'
 
+    def info_corefile(self):
+        
+        core_header_info_dict = self._load_core()
+
+        task_info, extra_note = self.get_task_info_extra_note_tuple()
+
+        self.output['start?'] = True
+        self.output['mode'] = 'full'
+
+        gdb_args = self.get_gdb_args(is_dbg_mode=False, **core_header_info_dict)
+
+        self.gdb_esp = EspGDB(gdb_args, timeout_sec=self.gdb_timeout_sec)
+
+        extra_info = self.parse_extra_info(extra_note)
+        if extra_info:
+            marker = extra_info[0]
+            self.output['crashed-task'] = self.get_crashed_task_info(marker)
+            self.output['isr-context'] = self.get_isr_context(extra_info)
+
+        self.set_panic_details()
 
         self.output['current-thread-registers'] = self.get_current_thread_registers(extra_note, extra_info)
         self.output['current-thread-stack'] = self.get_current_thread_stack(task_info)
@@ -328,6 +460,206 @@ class CoreDumpDecoder(CoreDump):
 
         return self.output
 
+    # --- Triage: panic details, tasks and symbolized backtrace without GDB ---
+
+    NT_PRSTATUS = 1
+    PRSTATUS_PID_OFFSET = 24
+    PRSTATUS_REGS_OFFSET = 72
+    # Индексы в gregset: xtensa_elf_gregset_t и riscv (pc в слоте x0)
+    XTENSA_PC, XTENSA_A0, XTENSA_A1 = 0, 64, 65
+    RISCV_PC, RISCV_RA, RISCV_SP = 0, 1, 2
+    MAX_TRIAGE_FRAMES = 32
+    SYSTEM_PREFIXES = (
+        'panic', 'esp_', 'abort', '__assert', 'xt_', '_xt', 'vPort', 'xPort',
+        'vTask', 'xTask', 'prv', 'task_wdt', 'call_start', 'main_task', 'start_cpu',
+    )
+
+    def _task_registers(self):
+        """tcb_addr -> gregset list, taken from the PRSTATUS notes in note order."""
+        regs = {}
+        for note_seg in self.core_elf.note_segments:
+            for note_sec in note_seg.note_secs:
+                if note_sec.type != self.NT_PRSTATUS:
+                    continue
+                desc = note_sec.desc
+                if len(desc) < self.PRSTATUS_REGS_OFFSET + 4 * 3:
+                    continue
+                tcb_addr = struct.unpack_from('<I', desc, self.PRSTATUS_PID_OFFSET)[0]
+                count = (len(desc) - self.PRSTATUS_REGS_OFFSET) // 4
+                regs[tcb_addr] = struct.unpack_from(f'<{count}I', desc, self.PRSTATUS_REGS_OFFSET)
+        return regs
+
+    def _read_u32(self, addr):
+        for seg in self.core_elf.load_segments:
+            off = addr - seg.addr
+            if 0 <= off <= len(seg.data) - 4:
+                return struct.unpack_from('<I', seg.data, off)[0]
+        return None
+
+    @staticmethod
+    def _xtensa_return_pc(ra):
+        # Старшие два бита a0 — инкремент окна, адрес вызова на 3 байта раньше
+        if ra & 0x80000000:
+            ra = (ra & 0x3FFFFFFF) | 0x40000000
+        return ra - 3
+
+    def _backtrace_addresses(self, regs):
+        if self.exe_elf.e_machine != ESPCoreDumpElfFile.EM_XTENSA:
+            # Без DWARF CFI на RISC-V раскручиваем только pc и ra
+            pc, ra = regs[self.RISCV_PC], regs[self.RISCV_RA]
+            return [pc] + ([ra - 4] if ra else [])
+
+        addrs = [regs[self.XTENSA_PC]]
+        ret, sp = regs[self.XTENSA_A0], regs[self.XTENSA_A1]
+        # Та же раскрутка оконных регистров, что и esp_backtrace_get_next_frame()
+        while ret and len(addrs) < self.MAX_TRIAGE_FRAMES:
+            addrs.append(self._xtensa_return_pc(ret))
+            ret = self._read_u32(sp - 16)
+            next_sp = self._read_u32(sp - 12)
+            if ret is None or next_sp is None or next_sp < sp:
+                break
+            sp = next_sp
+        return addrs
+
+    def symbolize_backtrace(self, addrs):
+        frames = []
+        for i, addr in enumerate(addrs):
+            frame = {
+                'frame': i,
+                'address': f'0x{addr:x}',
+                'user-code?': False,
+                'system-code?': False,
+                'unknown?': False,
+            }
+            sym = self.symbols.lookup(addr)
+            if sym is None:
+                frame['function'] = 'unknown'
+                frame['unknown?'] = True
+            else:
+                frame['function'], frame['offset'] = sym
+                if frame['function'].startswith(self.SYSTEM_PREFIXES):
+                    frame['system-code?'] = True
+                else:
+                    frame['user-code?'] = True
+            frames.append(frame)
+            if frame['unknown?'] and i > 0:
+                break
+
+        user_frames = sum(1 for f in frames if f['user-code?'])
+        system_frames = sum(1 for f in frames if f['system-code?'])
+        return {
+            'frames': frames,
+            'summary': {
+                'total-frames': len(frames),
+                'user-frames': user_frames,
+                'system-frames': system_frames,
+                'unknown-frames': len(frames) - user_frames - system_frames,
+                'root-cause': next((f for f in frames if f['user-code?']), None),
+            }
+        }
+
+    @staticmethod
+    def _task_name(task):
+        name = getattr(task, 'task_name', b'') or b''
+        return name.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+    def triage_corefile(self):
+        """
+        Fast decode mode: reads panic details, the task list and symbolized
+        backtraces straight from the core ELF and the firmware symbol table.
+        Never starts GDB; use info_corefile() for the full report.
+        """
+        self._load_core()
+        self.symbols = firmware_registry.symbols(self.prog)
+
+        task_info, extra_note = self.get_task_info_extra_note_tuple()
+        task_regs = self._task_registers()
+        names = {t.task_tcb_addr: self._task_name(t) for t in task_info or []}
+
+        self.output['start?'] = True
+        self.output['mode'] = 'triage'
+
+        extra_info = self.parse_extra_info(extra_note)
+        current_tcb = next(iter(task_regs), None)
+        if extra_info:
+            marker = extra_info[0]
+            if marker == ESPCoreDumpElfFile.CURR_TASK_MARKER:
+                self.output['crashed-task'] = {'error': 'Crashed task has been skipped.'}
+            else:
+                current_tcb = marker
+                self.output['crashed-task'] = {'handle': f'0x{marker:x}', 'name': names.get(marker, '')}
+            self.output['isr-context'] = self.get_isr_context(extra_info)
+
+        self.set_panic_details()
+
+        self.output['current-thread-registers'] = self.get_current_thread_registers(extra_note, extra_info)
+        if current_tcb in task_regs:
+            self.output['current-thread-stack'] = {
+                'parsed': self.symbolize_backtrace(self._backtrace_addresses(task_regs[current_tcb]))
+            }
+        else:
+            self.output['current-thread-stack'] = {'error': 'Current thread registers not found'}
+
+        threads = []
+        for thr_id, task in enumerate(task_info or [], start=1):
+            thread_dict = {
+                'id': thr_id,
+                'tcb_addr': f'0x{task.task_tcb_addr:x}',
+                'task_name': names.get(task.task_tcb_addr, ''),
+            }
+            regs = task_regs.get(task.task_tcb_addr)
+            if regs:
+                pc = regs[self.XTENSA_PC if self.exe_elf.e_machine == ESPCoreDumpElfFile.EM_XTENSA else self.RISCV_PC]
+                thread_dict['pc'] = self.symbolize_backtrace([pc])['frames'][0]
+            if task.task_flags != TASK_STATUS_CORRECT:
+                thread_dict['corrupted'] = True
+            threads.append(thread_dict)
+        self.output['threads'] = threads
+
+        self.output['end?'] = True
+        return self.output
+
+
+DECODE_MODES = ('triage', 'full')
+
+
+def decode_coredump(raw, prog, mode='full'):
+    """Entry point for decode worker processes: raw b64 dump bytes -> decoded dict."""
+    with tempfile.NamedTemporaryFile(mode='wb', suffix='.b64', delete=False) as tmp:
+        tmp.write(raw)
+        core_path = tmp.name
+    decoder = CoreDumpDecoder(prog=prog, core=core_path)
+    try:
+        if mode == 'triage':
+            return decoder.triage_corefile()
+        return decoder.info_corefile()
+    finally:
+        decoder.cleanup_temp_files()
+        os.unlink(core_path)
+
+
+def read_memory_segments(raw, prog):
+    """Raw b64 dump bytes -> [{'name', 'address', 'attrs', 'data'}] for every core load segment."""
+    with tempfile.NamedTemporaryFile(mode='wb', suffix='.b64', delete=False) as tmp:
+        tmp.write(raw)
+        core_path = tmp.name
+    decoder = CoreDumpDecoder(prog=prog, core=core_path)
+    try:
+        decoder._load_core()
+        return [
+            {
+                'name': decoder.core_segment_name(cs),
+                'address': cs.addr,
+                'attrs': cs.attr_str(),
+                'data': bytes(cs.data),
+            }
+            for cs in decoder.core_elf.load_segments
+        ]
+    finally:
+        decoder.cleanup_temp_files()
+        os.unlink(core_path)
+
+
 def main():
     parser = argparse.ArgumentParser(description='ESP32 Core Dump Utility')
     parser.add_argument('--prog', help='Path to program ELF file', required=True)
@@ -336,6 +668,8 @@ def main():
     parser.add_argument('--off', type=int, help='Offset of core dump partition on flash')
     parser.add_argument('--gdb-timeout-sec', type=int, default=10, help='GDB timeout')
     parser.add_argument('--chip', default='auto', help='Target chip type')
+    parser.add_argument('--no-batch-threads', action='store_true', help='Inspect threads one GDB command at a time')
+    parser.add_argument('--mode', choices=DECODE_MODES, default='full', help='triage skips GDB entirely')
     
     args = parser.parse_args()
 
@@ -346,8 +680,12 @@ def main():
         off=args.off,
         gdb_timeout_sec=args.gdb_timeout_sec,
         chip=args.chip,
+        batch_threads=not args.no_batch_threads,
     )
-    json_output = coredump.info_corefile()
+    if args.mode == 'triage':
+        json_output = coredump.triage_corefile()
+    else:
+        json_output = coredump.info_corefile()
     print(json.dumps(json_output))
 
 if __name__ == '__main__':
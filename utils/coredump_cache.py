@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+CACHE_DIR = os.getenv("COREDUMP_CACHE_DIR", ".cache/coredumps")
+MAX_ENTRIES = int(os.getenv("COREDUMP_CACHE_MAX_ENTRIES", "2000"))
+MAX_BYTES = int(os.getenv("COREDUMP_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_firmware_digests = {}
+
+
+def firmware_digest(prog):
+    """sha256 of the firmware ELF, cached by (path, mtime, size)."""
+    st = os.stat(prog)
+    cache_key = (prog, st.st_mtime_ns, st.st_size)
+    digest = _firmware_digests.get(cache_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(prog, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = _firmware_digests[cache_key] = h.hexdigest()
+    return digest
+
+
+def dump_key(firmware, raw, mode='full'):
+    h = hashlib.sha256(f'{firmware}:{mode}'.encode())
+    h.update(raw)
+    return h.hexdigest()
+
+
+def signature_key(firmware, triage):
+    """
+    Crash signature from a triage decode: panic reason + current thread
+    backtrace addresses. Dumps with different bytes (heap, timestamps) but
+    the same signature are the same bug on the same firmware. None when the
+    backtrace is missing, a bare reason is too weak to reuse a decode by.
+    """
+    frames = triage.get('current-thread-stack', {}).get('parsed', {}).get('frames', [])
+    addresses = [f.get('address') or '' for f in frames]
+    if not any(addresses):
+        return None
+    payload = json.dumps([firmware, triage.get('reason', ''), addresses])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CoredumpCache:
+    """
+    Content-addressed on-disk store of decoded coredumps with LRU eviction.
+    File mtime is the recency marker, so LRU order survives restarts.
+    Full decodes are also indexed by the signature of their triage decode
+    (signature_key), so a new dump of an already decoded crash can skip GDB;
+    the job queue takes only its reason and type from the indexed decode.
+    """
+
+    def __init__(self, path=CACHE_DIR, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = None  # key -> size, oldest first
+        self._signatures = {}  # signature -> key
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.signature_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.json')
+
+    def _sig_file(self, signature):
+        return os.path.join(self.path, f'{signature}.sig')
+
+    def _load_index(self):
+        if self._entries is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        files, sig_files = [], []
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                st = os.stat(os.path.join(self.path, name))
+                files.append((st.st_mtime, name[:-5], st.st_size))
+            elif name.endswith('.sig'):
+                sig_files.append(name[:-4])
+        files.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in files)
+        self._total_bytes = sum(self._entries.values())
+
+        for signature in sig_files:
+            try:
+                with open(self._sig_file(signature)) as f:
+                    key = f.read().strip()
+            except OSError:
+                continue
+            if key in self._entries:
+                self._signatures[signature] = key
+            else:
+                self._remove(self._sig_file(signature))
+
+    def _read(self, key):
+        try:
+            with open(self._file(key)) as f:
+                entry = json.load(f)
+            os.utime(self._file(key))
+        except (OSError, ValueError):
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry['coredump']
+
+    def get(self, key):
+        with self._lock:
+            self._load_index()
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            coredump = self._read(key)
+            if coredump is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return coredump
+
+    def get_by_signature(self, signature):
+        with self._lock:
+            self._load_index()
+            key = self._signatures.get(signature)
+            if key is None or key not in self._entries:
+                return None
+            coredump = self._read(key)
+            if coredump is not None:
+                self.signature_hits += 1
+            return coredump
+
+    def put(self, key, coredump, signature=None):
+        body = json.dumps({'signature': signature, 'coredump': coredump})
+        with self._lock:
+            self._load_index()
+            tmp = f'{self._file(key)}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(body)
+            os.replace(tmp, self._file(key))
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(body)
+            self._total_bytes += len(body)
+            if signature:
+                with open(self._sig_file(signature), 'w') as f:
+                    f.write(key)
+                self._signatures[signature] = key
+            self._evict()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _drop(self, key):
+        self._total_bytes -= self._entries.pop(key, 0)
+        self._remove(self._file(key))
+
+    def _evict(self):
+        evicted = 0
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            evicted += 1
+        if evicted:
+            self.evictions += evicted
+            for sig, key in list(self._signatures.items()):
+                if key not in self._entries:
+                    del self._signatures[sig]
+                    self._remove(self._sig_file(sig))
+
+    def stats(self):
+        return {
+            "entries": len(self._entries or ()),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "signature_hits": self.signature_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+coredump_cache = CoredumpCache()
@@ -0,0 +1,315 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import Enum, inspect, text
+
+import models
+from database import SessionLocal, engine
+from utils.coredump import decode_coredump, DECODE_MODES
+from utils.coredump_cache import coredump_cache, firmware_digest, dump_key, signature_key
+from utils.firmware_registry import firmware_registry
+from utils.issue_stats import issue_stats
+
+
+DECODE_WORKERS = int(os.getenv("COREDUMP_DECODE_WORKERS", "2"))
+POLL_INTERVAL = float(os.getenv("COREDUMP_POLL_INTERVAL", "5"))
+# На ingest-е по умолчанию только triage, полный GDB-разбор — по запросу
+DEFAULT_DECODE_MODE = os.getenv("COREDUMP_DECODE_MODE", "triage")
+
+# Колонки traces для разбора в фоне -> чем заполнить старые строки (они разобраны GDB при приеме)
+TRACE_COLUMNS = {
+    "raw_dump": None,
+    "status": models.TraceStatusEnum.decoded,
+    "decode_error": None,
+    "decode_mode": "full",
+    "firmware_version": None,
+}
+
+TYPE_MAPPING = {
+    'abort': models.IssueTypeEnum.abort,
+    'assert': models.IssueTypeEnum.assertion,
+    'watchdog': models.IssueTypeEnum.watchdog
+}
+
+
+def ensure_trace_columns():
+    """
+    create_all does not add columns to existing tables: adds TRACE_COLUMNS
+    to a traces table created before them and fills them for old traces.
+    Must run before the traces indexes are created.
+    """
+    table = models.Trace.__table__
+    postgres = engine.dialect.name == "postgresql"
+    with engine.begin() as conn:
+        existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        missing = [name for name in TRACE_COLUMNS if name not in existing]
+        for name in missing:
+            column = table.c[name]
+            if postgres and isinstance(column.type, Enum):
+                column.type.create(conn, checkfirst=True)
+            ddl_type = column.type.compile(dialect=engine.dialect)
+            # IF NOT EXISTS — на случай, если две реплики стартуют одновременно
+            conn.execute(text(
+                f"ALTER TABLE {table.name} ADD COLUMN {'IF NOT EXISTS ' if postgres else ''}{name} {ddl_type}"
+            ))
+            if TRACE_COLUMNS[name] is not None:
+                conn.execute(table.update().where(column.is_(None)).values({name: TRACE_COLUMNS[name]}))
+    if missing:
+        print(f"traces: added columns {', '.join(missing)}")
+
+
+def store_raw_coredump(db, device, raw, occurrence=None, mode=DEFAULT_DECODE_MODE, firmware_version=None):
+    """Сохраняет сырой дамп как pending-трейс; разбор выполнит CoredumpJobQueue."""
+    trace = models.Trace(
+        device_id=device.id,
+        raw_dump=raw,
+        status=models.TraceStatusEnum.pending,
+        decode_mode=mode,
+        firmware_version=firmware_version or None,
+    )
+    if occurrence is not None:
+        trace.occurrence = occurrence
+    db.add(trace)
+    db.commit()
+    return trace
+
+
+def attach_decoded_coredump(db, trace, coredump, note=None):
+    reason = coredump.get("reason") or "Unknown panic"
+
+    issue = db.query(models.Issue).filter(models.Issue.name == reason).first()
+    if not issue:
+        issue = models.Issue(
+            name=reason,
+            type=TYPE_MAPPING.get(coredump.get("type", "").lower()),
+        )
+        db.add(issue)
+        db.flush()
+
+    # Счетчики issue_stats меняются в той же транзакции, что и привязка трейса
+    if trace.issue_id != issue.id:
+        if trace.issue_id is not None:
+            issue_stats.remove(db, trace, trace.issue_id)
+        issue_stats.add(db, trace, issue.id)
+    trace.issue_id = issue.id
+    trace.core_dump = json.dumps(coredump)
+    trace.status = models.TraceStatusEnum.decoded
+    # Разобран, но с оговоркой (например, символы не от той прошивки)
+    trace.decode_error = note
+    return issue
+
+
+def request_decode(db, trace, mode):
+    """Ставит уже сохраненный трейс в очередь на повторный разбор (например, full)."""
+    if mode not in DECODE_MODES:
+        raise ValueError(f"Unknown decode mode: {mode}")
+    trace.decode_mode = mode
+    trace.status = models.TraceStatusEnum.pending
+    trace.decode_error = None
+    db.commit()
+
+
+class CoredumpJobQueue:
+    """
+    Decodes pending traces in a bounded process pool so GDB never runs on
+    the event loop. The traces table itself is the persistent queue: rows
+    stay 'pending' until decoded, and are picked up again after a restart.
+    """
+
+    def __init__(self, workers=DECODE_WORKERS, poll_interval=POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+
+        self._pool = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._in_flight = set()
+        self._tasks = set()  # держим ссылки, иначе задачу может собрать GC
+        self._decoding = {}  # dump key -> future, одинаковые дампы разбираем один раз
+
+        self.decoded = 0
+        self.failed = 0
+        self.signature_reuses = 0
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _claim_pending(self, limit, exclude):
+        with SessionLocal() as db:
+            rows = db.query(models.Trace.id).filter(
+                models.Trace.status == models.TraceStatusEnum.pending
+            ).order_by(models.Trace.id).limit(limit + len(exclude)).all()
+        return [r.id for r in rows if r.id not in exclude][:limit]
+
+    def _load_raw(self, trace_id):
+        with SessionLocal() as db:
+            row = db.query(
+                models.Trace.raw_dump, models.Trace.decode_mode, models.Trace.firmware_version, models.Trace.core_dump
+            ).filter(models.Trace.id == trace_id).first()
+        if row is None:
+            return None, None, None, None, False
+        prog = firmware_registry.resolve(row.firmware_version)
+        missing = None
+        if row.firmware_version and firmware_registry.find(row.firmware_version) is None:
+            missing = f"Firmware ELF for version {row.firmware_version} not found"
+        # Полный разбор уже подменялся по сигнатуре — раз его снова просят, запускаем GDB для этого дампа
+        previous = json.loads(row.core_dump) if isinstance(row.core_dump, str) else row.core_dump
+        reuse = not (isinstance(previous, dict) and previous.get('signature-reuse?'))
+        # старые строки разбирались полностью
+        return row.raw_dump, row.decode_mode or 'full', prog, missing, reuse
+
+    def _save_result(self, trace_id, coredump, error, note=None):
+        with SessionLocal() as db:
+            trace = db.query(models.Trace).filter(models.Trace.id == trace_id).first()
+            if not trace:
+                return
+            if error is None:
+                attach_decoded_coredump(db, trace, coredump, note)
+            else:
+                trace.status = models.TraceStatusEnum.failed
+                trace.decode_error = error
+            db.commit()
+
+    def _cache_lookup(self, raw, mode, prog):
+        key = dump_key(firmware_digest(prog), raw, mode)
+        return key, coredump_cache.get(key)
+
+    def _signature_lookup(self, triage, prog):
+        signature = signature_key(firmware_digest(prog), triage)
+        if signature is None:
+            return None, None
+        return signature, coredump_cache.get_by_signature(signature)
+
+    async def _decode(self, raw, mode, prog, reuse=True):
+        key, coredump = await asyncio.to_thread(self._cache_lookup, raw, mode, prog)
+        if coredump is not None:
+            return coredump
+
+        signature = None
+        if mode == 'full':
+            # Triage без GDB дает сигнатуру: то же падение на той же прошивке могло уже быть разобрано полностью
+            known = None
+            try:
+                triage = await self._decode(raw, 'triage', prog)
+                signature, known = await asyncio.to_thread(self._signature_lookup, triage, prog)
+            except Exception as e:
+                print(f"Coredump triage error, running full decode: {e}")
+            if known is not None and reuse:
+                # От разобранного дампа берем только причину и тип (по ним issue); потоки,
+                # регистры и стек — этого дампа, из его triage. В кэш под полным ключом не кладем
+                self.signature_reuses += 1
+                return {
+                    **triage,
+                    'reason': known.get('reason', triage.get('reason')),
+                    'type': known.get('type', triage.get('type')),
+                    'signature-reuse?': True,
+                }
+
+        pending = self._decoding.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, decode_coredump, raw, prog, mode)
+        self._decoding[key] = future
+        try:
+            coredump = await future
+        finally:
+            self._decoding.pop(key, None)
+        await asyncio.to_thread(coredump_cache.put, key, coredump, signature)
+        return coredump
+
+    async def _process(self, trace_id):
+        coredump, error, missing = None, None, None
+        try:
+            raw, mode, prog, missing, reuse = await asyncio.to_thread(self._load_raw, trace_id)
+            if not raw:
+                raise ValueError("Raw coredump is missing")
+            if missing and mode == 'full':
+                # GDB по чужим символам дает неверный разбор — ждем, пока загрузят нужный ELF
+                raise FileNotFoundError(f"{missing}; upload it and request a full decode again")
+            coredump = await self._decode(raw, mode, prog, reuse)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        try:
+            # triage по дефолтному ELF сохраняем (причина и тип не зависят от символов), но с пометкой
+            note = f"{missing}, symbols are from the default ELF" if missing else None
+            await asyncio.to_thread(self._save_result, trace_id, coredump, error, note)
+            if error is None:
+                self.decoded += 1
+            else:
+                self.failed += 1
+                print(f"Coredump decode failed for trace {trace_id}: {error}")
+            self.notify()
+        except Exception as e:
+            # Трейс остается pending, повторим на следующем опросе
+            print(f"Coredump result save error for trace {trace_id}: {e}")
+        finally:
+            self._in_flight.discard(trace_id)
+
+    async def _run(self):
+        try:
+            # Индексы символов строим заранее, воркеры их только отображают в память
+            await asyncio.to_thread(firmware_registry.prepare)
+        except Exception as e:
+            print(f"Firmware registry error: {e}")
+
+        while True:
+            self._wakeup.clear()
+            free = self.workers - len(self._in_flight)
+            if free > 0:
+                try:
+                    claimed = await asyncio.to_thread(self._claim_pending, free, set(self._in_flight))
+                    for trace_id in claimed:
+                        self._in_flight.add(trace_id)
+                        task = asyncio.create_task(self._process(trace_id))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                except Exception as e:
+                    print(f"Coredump queue error: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Прерванные разборы не сохраняются: трейсы остаются pending
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._in_flight.clear()
+        if self._pool is not None:
+            # Незавершенные трейсы остаются pending и будут разобраны после рестарта
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "in_flight": len(self._in_flight),
+            "unique_decodes_in_flight": len(self._decoding),
+            "cache": coredump_cache.stats(),
+            "firmware": firmware_registry.stats(),
+            "decoded": self.decoded,
+            "failed": self.failed,
+            "signature_reuses": self.signature_reuses,
+        }
+
+
+coredump_jobs = CoredumpJobQueue()
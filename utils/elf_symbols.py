@@ -0,0 +1,121 @@
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_right
+
+from esp_coredump.corefile.elf import ElfHeaderTables
+
+
+SHT_SYMTAB = 0x02
+STT_FUNC = 0x02
+ELF32_SYM = struct.Struct('<IIIBBH')
+
+# Формат индекса: заголовок, затем addrs[n], sizes[n], name_offsets[n + 1] (uint32 LE) и блок имен
+INDEX_MAGIC = b'SYMIDX1\0'
+INDEX_HEADER = struct.Struct('<8sI')
+
+
+class _IndexedNames:
+    """Read-only list of names backed by an offsets array and a bytes blob."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8', 'replace')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class SymbolTable:
+    """
+    Sorted address -> function index built from the ELF .symtab, so
+    addresses can be symbolized without starting GDB.
+    """
+
+    def __init__(self, addrs, sizes, names, mapping=None):
+        self.addrs = addrs      # array('I') или memoryview над mmap, отсортирован
+        self.sizes = sizes
+        self.names = names      # list[str] или _IndexedNames
+        self._mapping = mapping
+
+    @classmethod
+    def from_elf(cls, elf_path):
+        with open(elf_path, 'rb') as f:
+            elf_bytes = f.read()
+        headers = ElfHeaderTables.parse(elf_bytes)
+        sections = headers.section_headers
+
+        functions = []
+        for sh in sections:
+            if sh.sh_type != SHT_SYMTAB:
+                continue
+            strtab = sections[sh.sh_link]
+            strings = elf_bytes[strtab.sh_offset:strtab.sh_offset + strtab.sh_size]
+            data = elf_bytes[sh.sh_offset:sh.sh_offset + sh.sh_size]
+            for st_name, st_value, st_size, st_info, _, _ in ELF32_SYM.iter_unpack(data[:len(data) - len(data) % ELF32_SYM.size]):
+                if st_info & 0x0F != STT_FUNC or st_value == 0:
+                    continue
+                end = strings.find(b'\0', st_name)
+                functions.append((st_value, st_size, strings[st_name:end].decode('utf-8', 'replace')))
+
+        functions.sort()
+        return cls(
+            array('I', (f[0] for f in functions)),
+            array('I', (f[1] for f in functions)),
+            [f[2] for f in functions],
+        )
+
+    def save(self, path):
+        """Writes the compact on-disk index atomically (tmp file + rename)."""
+        encoded = [self.names[i].encode('utf-8') for i in range(len(self))]
+        offsets = array('I', [0])
+        for name in encoded:
+            offsets.append(offsets[-1] + len(name))
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(self)))
+            # Индекс читается через memoryview.cast('I'), т.е. в нативном порядке (little-endian)
+            for arr in (array('I', self.addrs), array('I', self.sizes), offsets):
+                f.write(arr.tobytes())
+            f.write(b''.join(encoded))
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Maps an index written by save(). Arrays are views over the mapping,
+        so every decode worker shares the same page-cache pages.
+        """
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = INDEX_HEADER.unpack_from(mapping, 0)
+        if magic != INDEX_MAGIC:
+            mapping.close()
+            raise ValueError(f'Not a symbol index: {path}')
+
+        view = memoryview(mapping)
+        pos = INDEX_HEADER.size
+        addrs = view[pos:pos + 4 * count].cast('I')
+        pos += 4 * count
+        sizes = view[pos:pos + 4 * count].cast('I')
+        pos += 4 * count
+        offsets = view[pos:pos + 4 * (count + 1)].cast('I')
+        pos += 4 * (count + 1)
+        return cls(addrs, sizes, _IndexedNames(offsets, view[pos:]), mapping=mapping)
+
+    def lookup(self, addr):
+        """Returns (function, offset) or None if addr is outside any known function."""
+        i = bisect_right(self.addrs, addr) - 1
+        if i < 0:
+            return None
+        start, size = self.addrs[i], self.sizes[i]
+        if size and addr >= start + size:
+            return None
+        return self.names[i], addr - start
+
+    def __len__(self):
+        return len(self.addrs)
@@ -0,0 +1,131 @@
+import os
+import re
+import threading
+
+from esp_coredump.corefile.elf import ESPCoreDumpElfFile
+
+from utils.coredump_cache import firmware_digest
+from utils.elf_symbols import SymbolTable
+
+
+FIRMWARE_DIR = os.getenv("FIRMWARE_DIR", "firmware")
+DEFAULT_FIRMWARE_ELF = os.getenv("DEFAULT_FIRMWARE_ELF", "utils/esp32.elf")
+SYMBOL_INDEX_DIR = os.getenv("SYMBOL_INDEX_DIR", ".cache/symbols")
+
+_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9._-]')
+
+
+def firmware_file_name(version):
+    """DeviceInfo.firmware_version -> имя ELF-файла в FIRMWARE_DIR."""
+    return f'{_UNSAFE_CHARS.sub("_", version)}.elf'
+
+
+class FirmwareRegistry:
+    """
+    Maps DeviceInfo.firmware_version to its ELF in FIRMWARE_DIR
+    (<version>.elf) and keeps one parsed copy per ELF per process.
+    Symbol indexes are written once to SYMBOL_INDEX_DIR, keyed by the ELF
+    digest, and memory-mapped by every decode worker.
+    """
+
+    def __init__(self, firmware_dir=FIRMWARE_DIR, default_elf=DEFAULT_FIRMWARE_ELF, index_dir=SYMBOL_INDEX_DIR):
+        self.firmware_dir = firmware_dir
+        self.default_elf = default_elf
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._symbols = {}   # digest -> SymbolTable
+        self._elfs = {}      # (path, digest) -> ESPCoreDumpElfFile
+
+        self.resolved = 0
+        self.fallbacks = 0
+        self.indexes_built = 0
+        self.unknown_versions = set()
+
+    def find(self, version):
+        """ELF of exactly this firmware version, None if it is not in FIRMWARE_DIR."""
+        if not version:
+            return None
+        path = os.path.join(self.firmware_dir, firmware_file_name(version))
+        return path if os.path.isfile(path) else None
+
+    def resolve(self, version):
+        """ELF for a firmware version; unknown or empty versions fall back to the default ELF."""
+        path = self.find(version)
+        if path is not None:
+            self.resolved += 1
+            return path
+        if version:
+            self.unknown_versions.add(version)
+        self.fallbacks += 1
+        return self.default_elf
+
+    def _index_path(self, digest):
+        return os.path.join(self.index_dir, f'{digest}.symidx')
+
+    def build_index(self, elf_path):
+        """Builds the on-disk index if it is missing. Returns its path."""
+        path = self._index_path(firmware_digest(elf_path))
+        if not os.path.exists(path):
+            os.makedirs(self.index_dir, exist_ok=True)
+            SymbolTable.from_elf(elf_path).save(path)
+            self.indexes_built += 1
+        return path
+
+    def symbols(self, elf_path):
+        digest = firmware_digest(elf_path)
+        table = self._symbols.get(digest)
+        if table is None:
+            with self._lock:
+                table = self._symbols.get(digest)
+                if table is None:
+                    try:
+                        table = SymbolTable.open(self.build_index(elf_path))
+                    except (OSError, ValueError) as e:
+                        # Без записи на диск работаем с индексом в памяти процесса
+                        print(f"Symbol index error for {elf_path}: {e}")
+                        table = SymbolTable.from_elf(elf_path)
+                    self._symbols[digest] = table
+        return table
+
+    def exe_elf(self, elf_path):
+        """Parsed firmware ELF, reused across decodes in this process."""
+        key = (elf_path, firmware_digest(elf_path))
+        elf = self._elfs.get(key)
+        if elf is None:
+            with self._lock:
+                elf = self._elfs.get(key)
+                if elf is None:
+                    for old in [k for k in self._elfs if k[0] == elf_path]:
+                        del self._elfs[old]
+                    elf = self._elfs[key] = ESPCoreDumpElfFile(elf_path)
+        return elf
+
+    def firmware_paths(self):
+        paths = [self.default_elf] if os.path.isfile(self.default_elf) else []
+        if os.path.isdir(self.firmware_dir):
+            paths += sorted(
+                os.path.join(self.firmware_dir, name)
+                for name in os.listdir(self.firmware_dir) if name.endswith('.elf')
+            )
+        return paths
+
+    def prepare(self):
+        """Pre-builds indexes for every known firmware, so workers only mmap them."""
+        for path in self.firmware_paths():
+            try:
+                self.build_index(path)
+            except Exception as e:
+                print(f"Symbol index build error for {path}: {e}")
+
+    def stats(self):
+        return {
+            "firmwares": len(self.firmware_paths()),
+            "loaded_indexes": len(self._symbols),
+            "indexes_built": self.indexes_built,
+            "resolved": self.resolved,
+            "fallbacks": self.fallbacks,
+            "unknown_versions": sorted(self.unknown_versions)[:50],
+        }
+
+
+firmware_registry = FirmwareRegistry()
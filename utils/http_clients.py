@@ -0,0 +1,150 @@
+import asyncio
+import os
+from dataclasses import dataclass
+
+import httpx
+
+
+@dataclass
+class BackendConfig:
+    base_url: str
+    max_connections: int = 20
+    max_keepalive: int = 10
+    keepalive_expiry: float = 30.0
+    timeout: float = 5.0
+    retries: int = 2
+
+
+BACKENDS = {
+    "prometheus": BackendConfig(
+        base_url=os.getenv("PROMETHEUS_BASE_URL", "http://prometheus:9090"),
+        max_connections=int(os.getenv("PROMETHEUS_MAX_CONNECTIONS", "20")),
+    ),
+    "loki": BackendConfig(
+        base_url=os.getenv("LOKI_BASE_URL", "http://loki:3100"),
+        max_connections=int(os.getenv("LOKI_MAX_CONNECTIONS", "10")),
+    ),
+    "pushgateway": BackendConfig(
+        base_url=os.getenv("PUSHGATEWAY_BASE_URL", "http://pushgateway:9091"),
+        max_connections=int(os.getenv("PUSHGATEWAY_MAX_CONNECTIONS", "32")),
+        max_keepalive=32,
+    ),
+}
+
+# Повторяем только идемпотентные запросы и только при сетевых ошибках
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+RETRY_BACKOFF = 0.2
+
+
+class _BackendStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.new_connections = 0
+        self.in_use = 0
+        self.waiting = 0
+
+    def as_dict(self):
+        reused = max(self.requests - self.new_connections, 0)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "new_connections": self.new_connections,
+            "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+class HttpClients:
+    """
+    Application-lifetime registry of pooled httpx clients, one per backend.
+    Clients are created lazily and closed from the FastAPI lifespan.
+    """
+
+    def __init__(self, backends=BACKENDS):
+        self.backends = backends
+        self._clients = {}
+        self._slots = {}
+        self._stats = {name: _BackendStats() for name in backends}
+
+    def client(self, backend) -> httpx.AsyncClient:
+        client = self._clients.get(backend)
+        if client is None:
+            cfg = self.backends[backend]
+            limits = httpx.Limits(
+                max_connections=cfg.max_connections,
+                max_keepalive_connections=cfg.max_keepalive,
+                keepalive_expiry=cfg.keepalive_expiry,
+            )
+            client = httpx.AsyncClient(
+                base_url=cfg.base_url,
+                timeout=cfg.timeout,
+                # Повторы — только в request(): ретраи транспорта перемножались бы с ними
+                transport=httpx.AsyncHTTPTransport(limits=limits),
+            )
+            self._clients[backend] = client
+            self._slots[backend] = asyncio.Semaphore(cfg.max_connections)
+        return client
+
+    async def request(self, backend, method, url, **kwargs) -> httpx.Response:
+        client = self.client(backend)
+        cfg = self.backends[backend]
+        stats = self._stats[backend]
+        slots = self._slots[backend]
+
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                stats.new_connections += 1
+
+        extensions = kwargs.pop("extensions", {})
+        extensions["trace"] = trace
+        attempts = cfg.retries + 1 if method.upper() in IDEMPOTENT_METHODS else 1
+
+        stats.waiting += 1
+        async with slots:
+            stats.waiting -= 1
+            stats.in_use += 1
+            try:
+                for attempt in range(attempts):
+                    stats.requests += 1
+                    try:
+                        return await client.request(method, url, extensions=extensions, **kwargs)
+                    except httpx.TransportError:
+                        stats.errors += 1
+                        if attempt + 1 >= attempts:
+                            raise
+                        stats.retries += 1
+                        await asyncio.sleep(RETRY_BACKOFF * (attempt + 1))
+            finally:
+                stats.in_use -= 1
+
+    async def get(self, backend, url, **kwargs) -> httpx.Response:
+        return await self.request(backend, "GET", url, **kwargs)
+
+    async def post(self, backend, url, **kwargs) -> httpx.Response:
+        return await self.request(backend, "POST", url, **kwargs)
+
+    async def put(self, backend, url, **kwargs) -> httpx.Response:
+        return await self.request(backend, "PUT", url, **kwargs)
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self._slots.clear()
+
+    def stats(self):
+        return {
+            name: {
+                **stats.as_dict(),
+                "max_connections": self.backends[name].max_connections,
+                "open": name in self._clients,
+            }
+            for name, stats in self._stats.items()
+        }
+
+
+http_clients = HttpClients()
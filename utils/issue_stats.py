@@ -0,0 +1,206 @@
+from sqlalchemy import delete, desc, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+from database import SessionLocal, engine
+
+
+class IssueStatistics:
+    """
+    Materialized per-issue (issue_stats) and per-device-issue
+    (device_issue_stats) trace counts and last occurrence. Updated in the
+    same transaction that links a trace to an issue, so reading issue
+    lists never aggregates the traces table.
+    """
+
+    def __init__(self):
+        self.added = 0
+        self.moved = 0
+        self.devices_removed = 0
+        self.rebuilds = 0
+
+    def _dialect(self):
+        if engine.dialect.name == "postgresql":
+            return postgresql, func.greatest
+        return sqlite, func.max
+
+    def _device_count(self, issue_id):
+        dis = models.DeviceIssueStats
+        return select(func.count()).where(dis.issue_id == issue_id).scalar_subquery()
+
+    def add(self, db, trace, issue_id):
+        """Counts `trace` towards `issue_id`; the caller commits."""
+        dialect, greatest = self._dialect()
+        occurrence = trace.occurrence
+
+        if trace.device_id is not None:
+            table = models.DeviceIssueStats.__table__
+            stmt = dialect.insert(table).values(
+                device_id=trace.device_id, issue_id=issue_id, trace_count=1, last_occurrence=occurrence,
+            )
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.device_id, table.c.issue_id],
+                set_={
+                    "trace_count": table.c.trace_count + 1,
+                    "last_occurrence": greatest(table.c.last_occurrence, stmt.excluded.last_occurrence),
+                },
+            ))
+
+        # device_count — по индексу device_issue_stats(issue_id), а не count(distinct) по traces
+        table = models.IssueStats.__table__
+        stmt = dialect.insert(table).values(
+            issue_id=issue_id, trace_count=1, device_count=self._device_count(issue_id), last_occurrence=occurrence,
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.issue_id],
+            set_={
+                "trace_count": table.c.trace_count + 1,
+                "device_count": self._device_count(issue_id),
+                "last_occurrence": greatest(table.c.last_occurrence, stmt.excluded.last_occurrence),
+            },
+        ))
+        self.added += 1
+
+    def remove(self, db, trace, issue_id):
+        """
+        Takes `trace` out of `issue_id` (a re-decode changed its reason).
+        Counts are decremented; last occurrence is re-read from that issue's
+        remaining traces, which is rare enough to query.
+        """
+        t = models.Trace
+        dis = models.DeviceIssueStats
+        stats = models.IssueStats
+
+        if trace.device_id is not None:
+            pair = (dis.device_id == trace.device_id, dis.issue_id == issue_id)
+            db.execute(update(dis).where(*pair).values(
+                trace_count=dis.trace_count - 1,
+                last_occurrence=select(func.max(t.occurrence)).where(
+                    t.issue_id == issue_id, t.device_id == trace.device_id, t.id != trace.id,
+                ).scalar_subquery(),
+            ))
+            db.execute(delete(dis).where(*pair, dis.trace_count <= 0))
+
+        db.execute(update(stats).where(stats.issue_id == issue_id).values(
+            trace_count=stats.trace_count - 1,
+            device_count=self._device_count(issue_id),
+            last_occurrence=select(func.max(t.occurrence)).where(
+                t.issue_id == issue_id, t.id != trace.id,
+            ).scalar_subquery(),
+        ))
+        self.moved += 1
+
+    def remove_device(self, db, device_id):
+        """
+        Drops a device's device_issue_stats rows before the device itself is
+        deleted and recounts the issues it had; the caller commits.
+        """
+        t = models.Trace
+        dis = models.DeviceIssueStats
+        stats = models.IssueStats
+
+        issue_ids = [r.issue_id for r in db.query(dis.issue_id).filter(dis.device_id == device_id).all()]
+        db.execute(delete(dis).where(dis.device_id == device_id))
+        if not issue_ids:
+            return
+        # Трейсы устройства остаются (device_id обнуляется), поэтому пересчитываем по traces
+        db.execute(update(stats).where(stats.issue_id.in_(issue_ids)).values(
+            trace_count=select(func.count(t.id)).where(t.issue_id == stats.issue_id).scalar_subquery(),
+            device_count=select(func.count()).select_from(dis).where(dis.issue_id == stats.issue_id).scalar_subquery(),
+            last_occurrence=select(func.max(t.occurrence)).where(t.issue_id == stats.issue_id).scalar_subquery(),
+        ).execution_options(synchronize_session=False))
+        self.devices_removed += 1
+
+    def rebuild(self, db):
+        """Recomputes both tables from traces (initial backfill or repair)."""
+        t = models.Trace
+        db.execute(delete(models.IssueStats))
+        db.execute(delete(models.DeviceIssueStats))
+        db.execute(insert(models.DeviceIssueStats).from_select(
+            ["device_id", "issue_id", "trace_count", "last_occurrence"],
+            select(t.device_id, t.issue_id, func.count(t.id), func.max(t.occurrence))
+            .where(t.issue_id.isnot(None), t.device_id.isnot(None))
+            .group_by(t.device_id, t.issue_id),
+        ))
+        db.execute(insert(models.IssueStats).from_select(
+            ["issue_id", "trace_count", "device_count", "last_occurrence"],
+            select(t.issue_id, func.count(t.id), func.count(func.distinct(t.device_id)), func.max(t.occurrence))
+            .where(t.issue_id.isnot(None))
+            .group_by(t.issue_id),
+        ))
+        self.rebuilds += 1
+
+    def ensure_indexes(self):
+        """create_all skips indexes of existing tables; adds the ones scoped() relies on."""
+        for name in ("traces", "devices", "groups"):
+            for index in models.Base.metadata.tables[name].indexes:
+                index.create(bind=engine, checkfirst=True)
+
+    def scoped(self, db, project_id=None, group_id=None, device_id=None, since=None, until=None):
+        """
+        [(issue, last_occurrence, device_count)], newest first, over the
+        traces of one project, group or device (or all of them). Without a
+        time window this reads the materialized tables; with one it
+        aggregates only the scope's traces via ix_traces_device_occurrence.
+        """
+        windowed = since is not None or until is not None
+        if not windowed and project_id is None and group_id is None and device_id is None:
+            stats = models.IssueStats
+            return db.query(models.Issue, stats.last_occurrence, stats.device_count).join(
+                stats, models.Issue.id == stats.issue_id
+            ).filter(
+                stats.trace_count > 0
+            ).order_by(desc(stats.last_occurrence)).all()
+
+        if windowed:
+            src = models.Trace
+            last_occurrence = func.max(src.occurrence)
+            device_count = func.count(func.distinct(src.device_id))
+        else:
+            src = models.DeviceIssueStats
+            last_occurrence = func.max(src.last_occurrence)
+            device_count = func.count(src.device_id)
+
+        query = db.query(models.Issue, last_occurrence, device_count).join(src, models.Issue.id == src.issue_id)
+        if since is not None:
+            query = query.filter(src.occurrence >= since)
+        if until is not None:
+            query = query.filter(src.occurrence < until)
+        if device_id is not None:
+            query = query.filter(src.device_id == device_id)
+        if project_id is not None or group_id is not None:
+            # traces -> devices -> groups -> projects
+            query = query.join(models.Device, models.Device.id == src.device_id)
+            if group_id is not None:
+                query = query.filter(models.Device.group_id == group_id)
+            if project_id is not None:
+                query = query.join(models.Group, models.Group.id == models.Device.group_id).filter(
+                    models.Group.project_id == project_id
+                )
+
+        return query.group_by(
+            models.Issue.id,
+            models.Issue.name,
+            models.Issue.type
+        ).order_by(desc(last_occurrence)).all()
+
+    def ensure_backfilled(self):
+        """Fills issue_stats once for databases that have traces from before it existed."""
+        with SessionLocal() as db:
+            if db.query(models.IssueStats.issue_id).first() is not None:
+                return
+            if db.query(models.Trace.id).filter(models.Trace.issue_id.isnot(None)).first() is None:
+                return
+            self.rebuild(db)
+            db.commit()
+
+    def stats(self):
+        return {
+            "added": self.added,
+            "moved": self.moved,
+            "devices_removed": self.devices_removed,
+            "rebuilds": self.rebuilds,
+        }
+
+
+issue_stats = IssueStatistics()
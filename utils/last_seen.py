@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, update
+
+import models
+from database import SessionLocal
+
+
+FLUSH_INTERVAL = float(os.getenv("LAST_SEEN_FLUSH_INTERVAL", "10"))
+# Ограничение на число параметров в одном UPDATE (SQLite: 32766)
+FLUSH_CHUNK = int(os.getenv("LAST_SEEN_FLUSH_CHUNK", "1000"))
+# Записанные в БД отметки старше этого выкидываются из памяти (по умолчанию — таймаут онлайна presence)
+RETENTION = float(os.getenv("LAST_SEEN_RETENTION", os.getenv("PRESENCE_ONLINE_TIMEOUT", "30")))
+
+
+class LastSeenTracker:
+    """
+    Write-behind store for Device.last_sync. Ingest only touches an
+    in-memory map; dirty serials are written to the devices table with one
+    UPDATE ... CASE statement per chunk every FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL, chunk=FLUSH_CHUNK, retention=RETENTION):
+        self.interval = interval
+        self.chunk = chunk
+        self.retention = retention
+        self._seen = {}    # serial -> datetime
+        self._dirty = {}   # serial -> datetime, еще не записано в БД
+        self._task = None
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.evicted = 0
+        self.errors = 0
+        self.last_flush_seconds = 0.0
+
+    def touch(self, serial, ts=None):
+        ts = ts or datetime.now(timezone.utc)
+        self._seen[serial] = ts
+        self._dirty[serial] = ts
+
+    def get(self, serial, default=None):
+        """Last-seen time from memory, falls back to default (usually Device.last_sync)."""
+        return self._seen.get(serial, default)
+
+    def count_since(self, cutoff):
+        return sum(1 for ts in self._seen.values() if ts >= cutoff)
+
+    def _write(self, dirty):
+        items = list(dirty.items())
+        with SessionLocal() as db:
+            for i in range(0, len(items), self.chunk):
+                part = dict(items[i:i + self.chunk])
+                db.execute(
+                    update(models.Device)
+                    .where(models.Device.serial.in_(part.keys()))
+                    .values(last_sync=case(part, value=models.Device.serial))
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, dirty)
+            self.rows_written += len(dirty)
+        except Exception as e:
+            self.errors += 1
+            print(f"Last seen flush error: {e}")
+            # Возвращаем в очередь, если за это время не пришло более свежее значение
+            for serial, ts in dirty.items():
+                self._dirty.setdefault(serial, ts)
+        finally:
+            self.flushes += 1
+            self.last_flush_seconds = round(time.perf_counter() - started, 4)
+
+    def evict(self):
+        """
+        Forgets serials silent for longer than `retention` whose time is
+        already in the database; get() then falls back to Device.last_sync.
+        Unknown serials, which never reach the table, are dropped the same way.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.retention)
+        stale = [serial for serial, ts in self._seen.items() if ts < cutoff and serial not in self._dirty]
+        for serial in stale:
+            del self._seen[serial]
+        self.evicted += len(stale)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+            self.evict()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "tracked": len(self._seen),
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "evicted": self.evicted,
+            "errors": self.errors,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+
+last_seen = LastSeenTracker()
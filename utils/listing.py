@@ -0,0 +1,56 @@
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import load_only, selectinload
+
+import models
+import schemas
+
+
+# Без этих колонок не посчитать status/last_seen и не связать устройство с группой
+REQUIRED_DEVICE_COLUMNS = ("id", "serial", "group_id", "last_sync")
+DEVICE_COLUMNS = {c.key for c in models.Device.__table__.columns}
+
+
+def parse_fields(fields):
+    """`fields=serial,status` -> {"serial", "status"}; None means every DeviceOut field."""
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(schemas.DeviceOut.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown device fields: {', '.join(sorted(unknown))}")
+    return requested
+
+
+def devices_loader(fields=None):
+    """selectinload(Group.devices) that only reads the columns the projection needs."""
+    loader = selectinload(models.Group.devices)
+    if fields is None:
+        return loader
+    columns = set(REQUIRED_DEVICE_COLUMNS) | (fields & DEVICE_COLUMNS)
+    return loader.load_only(*(getattr(models.Device, c) for c in sorted(columns)))
+
+
+def project_device(device, fields):
+    out = {f: getattr(device, f, None) for f in sorted(fields)}
+    if "location" in out:
+        out["location"] = schemas.DeviceOut.parse_location(out["location"])
+    return out
+
+
+def project_group(group, fields):
+    return {
+        "id": group.id,
+        "name": group.name,
+        "project_id": group.project_id,
+        "devices": [project_device(device, fields) for device in group.devices],
+    }
+
+
+def projected_response(content):
+    """
+    Projected payloads go out as a ready response: response_model
+    validation would touch (and lazy-load) the skipped columns.
+    """
+    return JSONResponse(jsonable_encoder(content))
@@ -0,0 +1,167 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+
+import telemetry_pb2
+from utils.http_clients import http_clients
+
+
+LOKI_PUSH_PATH = "/loki/api/v1/push"
+LOKI_JOB = "device_logs"
+
+QUEUE_SIZE = int(os.getenv("LOKI_QUEUE_SIZE", "100000"))
+MAX_BATCH_LINES = int(os.getenv("LOKI_MAX_BATCH_LINES", "5000"))
+MAX_BATCH_AGE = float(os.getenv("LOKI_MAX_BATCH_AGE", "2"))
+
+try:
+    LEVEL_NAMES = {v: k for k, v in telemetry_pb2.LogLevel.items()}
+except Exception:
+    LEVEL_NAMES = {}
+
+
+def entry_timestamp_ns(log, fallback_ns):
+    # Берем время с устройства, время приема — только если оно не заполнено
+    ts = getattr(log, "timestamp", None)
+    if ts is None or (ts.seconds == 0 and ts.nanos == 0):
+        return fallback_ns
+    return ts.seconds * 10**9 + ts.nanos
+
+
+class LokiLogShipper:
+    """
+    Collects LogEntry records from all devices in a bounded queue and ships
+    them to Loki in gzip-compressed batches, one stream per (serial, level).
+    A batch is flushed when it reaches MAX_BATCH_LINES or MAX_BATCH_AGE seconds.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE, max_lines=MAX_BATCH_LINES, max_age=MAX_BATCH_AGE):
+        self.max_lines = max_lines
+        self.max_age = max_age
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._task = None
+        self._streams = {}  # (serial, level) -> [(ts_ns, message)]
+        self._lines = 0
+
+        self.accepted = 0
+        self.dropped = 0
+        self.shipped = 0
+        self.failed = 0
+        self.pushes = 0
+        self.last_batch_lines = 0
+        self.last_payload_bytes = 0
+
+    def submit(self, serial, logs):
+        received_ns = time.time_ns()
+        for log in logs:
+            level_name = LEVEL_NAMES.get(getattr(log, "level", 0), "UNKNOWN")
+            record = (
+                str(serial),
+                level_name,
+                entry_timestamp_ns(log, received_ns),
+                getattr(log, "message", ""),
+            )
+            try:
+                self._queue.put_nowait(record)
+                self.accepted += 1
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    @staticmethod
+    def build_payload(streams):
+        return {
+            "streams": [
+                {
+                    "stream": {"serial": serial, "job": LOKI_JOB, "level": level},
+                    # Loki ожидает записи внутри стрима в порядке времени
+                    "values": [[str(ts), msg] for ts, msg in sorted(values, key=lambda v: v[0])],
+                }
+                for (serial, level), values in streams.items()
+            ]
+        }
+
+    async def _push(self, streams, lines):
+        body = gzip.compress(json.dumps(self.build_payload(streams)).encode())
+        self.last_payload_bytes = len(body)
+        try:
+            resp = await http_clients.post(
+                "loki",
+                LOKI_PUSH_PATH,
+                content=body,
+                headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+            )
+            if resp.status_code not in [200, 204]:
+                self.failed += lines
+                print(f"Loki Push Error: {resp.status_code} - {resp.text}")
+                return
+            self.shipped += lines
+        except Exception as e:
+            self.failed += lines
+            print(f"Loki Batch Error (Network/HTTP): {type(e).__name__} - {e}")
+        finally:
+            self.pushes += 1
+            self.last_batch_lines = lines
+
+    def _add(self, record):
+        serial, level, ts, msg = record
+        self._streams.setdefault((serial, level), []).append((ts, msg))
+        self._lines += 1
+
+    async def flush(self):
+        if not self._lines:
+            return
+        streams, lines = self._streams, self._lines
+        self._streams, self._lines = {}, 0
+        await self._push(streams, lines)
+
+    async def _run(self):
+        while True:
+            self._add(await self._queue.get())
+            deadline = time.monotonic() + self.max_age
+
+            while self._lines < self.max_lines:
+                try:
+                    record = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        record = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                self._add(record)
+
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            self._add(self._queue.get_nowait())
+        await self.flush()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "shipped": self.shipped,
+            "failed": self.failed,
+            "pushes": self.pushes,
+            "last_batch_lines": self.last_batch_lines,
+            "last_payload_bytes": self.last_payload_bytes,
+        }
+
+
+log_shipper = LokiLogShipper()
@@ -0,0 +1,269 @@
+import asyncio
+import os
+import re
+from datetime import datetime, timezone
+
+import numpy as np
+
+import models
+from utils.http_clients import http_clients
+from utils.telemetry_rollups import pick_resolution, bucket_start
+from utils.telemetry_store import telemetry_store
+
+
+PROMETHEUS_QUERY_RANGE_PATH = "/api/v1/query_range"
+
+# local — читаем свою телеметрию, Prometheus дополняет начало окна, которого у нас нет; prometheus — как раньше
+HISTORY_SOURCE = os.getenv("METRIC_HISTORY_SOURCE", "local")
+# Как в Prometheus: точка сетки берет последнее значение не старше lookback
+LOOKBACK_SECONDS = int(os.getenv("METRIC_HISTORY_LOOKBACK", "300"))
+# Сколько серийников в одном query_range при выборке по группе/проекту
+FLEET_QUERY_CHUNK = int(os.getenv("METRIC_HISTORY_FLEET_CHUNK", "100"))
+
+
+def _epoch(ts):
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def resample(times, values, start, end, step, lookback=LOOKBACK_SECONDS):
+    """
+    Instant values on the start, start+step, ... <= end grid, the same way
+    query_range evaluates a plain selector: the latest sample at or before
+    each grid point, dropped if it is older than `lookback`.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if times.size == 0:
+        return []
+    order = np.argsort(times, kind="stable")
+    times, values = times[order], values[order]
+
+    grid = np.arange(start, end + 1, step, dtype=np.int64)
+    idx = np.searchsorted(times, grid, side="right") - 1
+    valid = idx >= 0
+    idx = np.where(valid, idx, 0)
+    valid &= (grid - times[idx]) <= lookback
+    return [{"time": int(t), "value": float(v)} for t, v in zip(grid[valid], values[idx][valid])]
+
+
+def covers(history, start, step):
+    """True when local `history` reaches back to the start of the window (one grid step of slack)."""
+    return bool(history) and history[0]["time"] <= start + step
+
+
+def merge_history(local, remote):
+    """Remote points before the first local one, then the local points; both on the same grid."""
+    if not local:
+        return remote
+    first = local[0]["time"]
+    return [p for p in remote if p["time"] < first] + local
+
+
+def local_series(db, device_id, start, end, step, metric_names=None):
+    """
+    {metric_name: history} from our own telemetry for [start, end] (unix
+    seconds). Uses the coarsest rollup allowed by `step` (bucket last values
+    as samples) and raw points otherwise. Empty dict if nothing is stored.
+    """
+    hours = max((end - start) / 3600, 1)
+    resolution = pick_resolution(hours, step)
+    start_dt = datetime.fromtimestamp(start - LOOKBACK_SECONDS, tz=timezone.utc)
+    end_dt = datetime.fromtimestamp(end + 1, tz=timezone.utc)
+
+    samples = {}
+    if resolution is not None:
+        r = models.TelemetryRollup
+        query = db.query(r.metric_name, r.last_at, r.last).filter(
+            r.device_id == device_id,
+            r.resolution == resolution,
+            r.bucket >= bucket_start(start_dt, resolution),
+            r.bucket < end_dt,
+        )
+        if metric_names is not None:
+            query = query.filter(r.metric_name.in_(metric_names))
+        for name, last_at, last in query.all():
+            samples.setdefault(name, ([], []))
+            samples[name][0].append(_epoch(last_at))
+            samples[name][1].append(last)
+    elif metric_names:
+        for name in metric_names:
+            points = telemetry_store.between(db, device_id, name, start_dt, end_dt)
+            if points:
+                samples[name] = ([_epoch(ts) for ts, _ in points], [v for _, v in points])
+
+    series = {}
+    for name, (times, values) in samples.items():
+        history = resample(times, values, start, end, step)
+        if history:
+            series[name] = history
+    return series
+
+
+def _parse_range_result(result):
+    return [{"time": int(v[0]), "value": float(v[1])} for v in result.get("values", [])]
+
+
+async def prometheus_history(serial, full_name, start, end, step):
+    params = {
+        "query": f'{full_name}{{serial="{serial}"}}',
+        "start": start,
+        "end": end,
+        "step": f"{step}s",
+    }
+    resp = await http_clients.get("prometheus", PROMETHEUS_QUERY_RANGE_PATH, params=params)
+    result = resp.json().get("data", {}).get("result", [])
+    return _parse_range_result(result[0]) if result else []
+
+
+async def prometheus_device_series(serial, start, end, step):
+    """{metric_name: history} for every device_* series of a serial, in one query_range call."""
+    params = {
+        "query": f'{{serial="{serial}"}}',
+        "start": start,
+        "end": end,
+        "step": f"{step}s",
+    }
+    resp = await http_clients.get("prometheus", PROMETHEUS_QUERY_RANGE_PATH, params=params, timeout=5.0)
+    if resp.status_code != 200:
+        return {}
+
+    series = {}
+    for result in resp.json().get("data", {}).get("result", []):
+        full_name = result.get("metric", {}).get("__name__", "")
+        if not full_name.startswith("device_"):
+            continue
+        history = _parse_range_result(result)
+        if history:
+            series[full_name] = history
+    return series
+
+
+async def metric_history(db, device_id, serial, full_name, start, end, step=60):
+    """
+    History of one metric: local telemetry, with the part of the window
+    before its first point (after deploy or retention) taken from Prometheus.
+    """
+    history = []
+    if HISTORY_SOURCE == "local" and device_id is not None:
+        series = await asyncio.to_thread(local_series, db, device_id, start, end, step, [full_name])
+        history = series.get(full_name, [])
+        if covers(history, start, step):
+            return history
+    try:
+        remote = await prometheus_history(serial, full_name, start, end, step)
+    except Exception as e:
+        if not history:
+            raise
+        print(f"Prometheus history error for serial {serial}: {e}")
+        return history
+    return merge_history(history, remote)
+
+
+async def device_series(db, device_id, serial, start, end, step=60):
+    """All metrics of a device: local telemetry, completed from Prometheus like metric_history."""
+    series = {}
+    if HISTORY_SOURCE == "local":
+        # Чтение из БД — в потоке, чтобы не держать event loop, пока идут запросы к Prometheus/Loki
+        series = await asyncio.to_thread(local_series, db, device_id, start, end, step)
+        if series and all(covers(history, start, step) for history in series.values()):
+            return series
+    try:
+        remote = await prometheus_device_series(serial, start, end, step)
+    except Exception as e:
+        if not series:
+            raise
+        print(f"Prometheus history error for serial {serial}: {e}")
+        return series
+    for name, history in remote.items():
+        series[name] = merge_history(series.get(name), history)
+    return series
+
+
+def local_fleet_series(db, device_ids, full_name, start, end, step):
+    """
+    {device_id: history} of one metric for many devices from our own
+    telemetry: a single rollup query for all of them, or raw points per
+    device when `step` needs them.
+    """
+    hours = max((end - start) / 3600, 1)
+    resolution = pick_resolution(hours, step)
+    start_dt = datetime.fromtimestamp(start - LOOKBACK_SECONDS, tz=timezone.utc)
+    end_dt = datetime.fromtimestamp(end + 1, tz=timezone.utc)
+
+    samples = {}
+    if resolution is not None:
+        r = models.TelemetryRollup
+        rows = db.query(r.device_id, r.last_at, r.last).filter(
+            r.device_id.in_(device_ids),
+            r.metric_name == full_name,
+            r.resolution == resolution,
+            r.bucket >= bucket_start(start_dt, resolution),
+            r.bucket < end_dt,
+        ).all()
+        for device_id, last_at, last in rows:
+            samples.setdefault(device_id, ([], []))
+            samples[device_id][0].append(_epoch(last_at))
+            samples[device_id][1].append(last)
+    else:
+        for device_id in device_ids:
+            points = telemetry_store.between(db, device_id, full_name, start_dt, end_dt)
+            if points:
+                samples[device_id] = ([_epoch(ts) for ts, _ in points], [v for _, v in points])
+
+    series = {}
+    for device_id, (times, values) in samples.items():
+        history = resample(times, values, start, end, step)
+        if history:
+            series[device_id] = history
+    return series
+
+
+async def prometheus_fleet_series(serials, full_name, start, end, step):
+    """{serial: history} of one metric for many serials, FLEET_QUERY_CHUNK serials per query_range call."""
+    async def fetch(chunk):
+        # Серийник — литерал в регулярке RE2 внутри PromQL-строки
+        pattern = "|".join(re.escape(s).replace("\\", "\\\\") for s in chunk)
+        params = {
+            "query": f'{full_name}{{serial=~"{pattern}"}}',
+            "start": start,
+            "end": end,
+            "step": f"{step}s",
+        }
+        resp = await http_clients.get("prometheus", PROMETHEUS_QUERY_RANGE_PATH, params=params, timeout=10.0)
+        if resp.status_code != 200:
+            return {}
+        return {
+            result.get("metric", {}).get("serial"): _parse_range_result(result)
+            for result in resp.json().get("data", {}).get("result", [])
+        }
+
+    chunks = [serials[i:i + FLEET_QUERY_CHUNK] for i in range(0, len(serials), FLEET_QUERY_CHUNK)]
+    series = {}
+    for part in await asyncio.gather(*(fetch(chunk) for chunk in chunks)):
+        series.update((serial, history) for serial, history in part.items() if serial and history)
+    return series
+
+
+async def fleet_history(db, devices, full_name, start, end, step=60):
+    """
+    {device_id: history} of one metric for [(device_id, serial)]: local
+    telemetry for all of them in one thread, Prometheus only for devices
+    whose local history does not reach back to `start`.
+    """
+    series = {}
+    if HISTORY_SOURCE == "local":
+        series = await asyncio.to_thread(local_fleet_series, db, [d for d, _ in devices], full_name, start, end, step)
+    missing = {serial: device_id for device_id, serial in devices if not covers(series.get(device_id), start, step)}
+    if missing:
+        try:
+            remote = await prometheus_fleet_series(list(missing), full_name, start, end, step)
+        except Exception as e:
+            if not series:
+                raise
+            print(f"Prometheus fleet history error: {e}")
+            return series
+        for serial, history in remote.items():
+            series[missing[serial]] = merge_history(series.get(missing[serial]), history)
+    return series
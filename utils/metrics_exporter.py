@@ -0,0 +1,144 @@
+import asyncio
+import base64
+import os
+import time
+from urllib.parse import quote_plus
+
+from prometheus_client import CollectorRegistry, Gauge, generate_latest, CONTENT_TYPE_LATEST
+
+from utils.http_clients import http_clients
+
+
+PUSH_JOB = "telemetry_processor"
+
+# Метрика онлайн-статуса размечается serial, остальные — source (см. prometheus.yml)
+STATUS_METRIC = "device_runtime_status"
+
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+MAX_PENDING_DEVICES = int(os.getenv("METRICS_MAX_PENDING_DEVICES", "20000"))
+PUSH_CONCURRENCY = int(os.getenv("METRICS_PUSH_CONCURRENCY", "16"))
+
+
+class MetricsExporter:
+    """
+    Aggregates device gauges in memory and pushes them to the Pushgateway
+    from a background task, so the MQTT handler never waits on HTTP.
+
+    Updates for the same serial between two flushes are coalesced (last value
+    wins), so each device is pushed at most once per interval.
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL,
+                 max_pending=MAX_PENDING_DEVICES, concurrency=PUSH_CONCURRENCY):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+
+        self._pending = {}  # serial -> {gauge_name: value}
+        self._task = None
+
+        self.updates = 0
+        self.dropped_updates = 0
+        self.pushed = 0
+        self.push_errors = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.last_batch_size = 0
+
+    def update(self, serial, values):
+        pending = self._pending.get(serial)
+        if pending is None:
+            # Backpressure: don't let unseen serials grow the buffer without bound
+            if len(self._pending) >= self.max_pending:
+                self.dropped_updates += 1
+                return False
+            pending = self._pending[serial] = {}
+        pending.update(values)
+        self.updates += 1
+        return True
+
+    def _build_registry(self, serial, values):
+        registry = CollectorRegistry()
+        for name, value in values.items():
+            label = "serial" if name == STATUS_METRIC else "source"
+            g = Gauge(name, f"Metric: {name}", [label], registry=registry)
+            g.labels(serial).set(value)
+        return registry
+
+    @staticmethod
+    def _group_path(serial):
+        # Тот же формат URL, что строит prometheus_client.push_to_gateway
+        if "/" in serial or " " in serial:
+            encoded = base64.urlsafe_b64encode(serial.encode()).decode()
+            return f"/metrics/job/{quote_plus(PUSH_JOB)}/serial@base64/{encoded}"
+        if not serial:
+            return f"/metrics/job/{quote_plus(PUSH_JOB)}/serial@base64/="
+        return f"/metrics/job/{quote_plus(PUSH_JOB)}/serial/{quote_plus(serial)}"
+
+    async def _push(self, serial, values):
+        resp = await http_clients.put(
+            "pushgateway",
+            self._group_path(serial),
+            content=generate_latest(self._build_registry(serial, values)),
+            headers={"Content-Type": CONTENT_TYPE_LATEST},
+        )
+        resp.raise_for_status()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def push_one(serial, values):
+            async with semaphore:
+                try:
+                    await self._push(serial, values)
+                    self.pushed += 1
+                except Exception as e:
+                    self.push_errors += 1
+                    print(f"Pushgateway Error ({serial}): {e}")
+
+        await asyncio.gather(*(push_one(s, v) for s, v in batch.items()))
+
+        self.flushes += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_seconds = time.perf_counter() - started
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Metrics flush error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "pending_devices": len(self._pending),
+            "updates": self.updates,
+            "dropped_updates": self.dropped_updates,
+            "pushed": self.pushed,
+            "push_errors": self.push_errors,
+            "flushes": self.flushes,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+        }
+
+
+metrics_exporter = MetricsExporter()
@@ -0,0 +1,63 @@
+import os
+import time
+from collections import OrderedDict
+
+
+MAX_ENTRIES = int(os.getenv("FORECAST_STATE_CACHE_SIZE", "50000"))
+# Серии без новых точек дольше этого выкидываются, даже если место есть
+IDLE_SECONDS = float(os.getenv("FORECAST_STATE_IDLE_SECONDS", "3600"))
+
+
+class ModelStateCache:
+    """
+    LRU map (device_id, metric) -> forecast state (model/forecast_state.py).
+    The predictive scheduler reads a state before a fit and writes back the
+    rolled-forward or refitted one; evicted series are simply refitted.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, idle_seconds=IDLE_SECONDS):
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        self._states = OrderedDict()  # key -> (state, monotonic время последнего обновления)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._states.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._states.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, state):
+        if state is None:
+            self._states.pop(key, None)
+            return
+        self._states[key] = (state, time.monotonic())
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_entries:
+            self._states.popitem(last=False)
+            self.evictions += 1
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [key for key, (_, updated) in self._states.items() if updated < cutoff]
+        for key in idle:
+            del self._states[key]
+        self.evictions += len(idle)
+
+    def __len__(self):
+        return len(self._states)
+
+    def stats(self):
+        return {
+            "entries": len(self._states),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,313 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import models
+from database import SessionLocal
+
+
+# Вес новой точки в EWMA уровня и среднего абсолютного отклонения
+ALPHA = float(os.getenv("ONLINE_ANOMALY_ALPHA", "0.05"))
+# Столько точек серия только учится, без базовых аномалий
+WARMUP = int(os.getenv("ONLINE_ANOMALY_WARMUP", "30"))
+# Порог |x - уровень| / масштаб и ограничение вклада выброса в статистику (в масштабах)
+Z_THRESHOLD = float(os.getenv("ONLINE_ANOMALY_Z", "6.0"))
+CLIP = float(os.getenv("ONLINE_ANOMALY_CLIP", "3.0"))
+# Нижняя граница масштаба: абсолютная и доля от уровня (для почти постоянных метрик)
+MIN_SCALE = float(os.getenv("ONLINE_ANOMALY_MIN_SCALE", "0.01"))
+MIN_REL_SCALE = float(os.getenv("ONLINE_ANOMALY_MIN_REL_SCALE", "0.01"))
+MAX_SERIES = int(os.getenv("ONLINE_ANOMALY_MAX_SERIES", "200000"))
+FLUSH_INTERVAL = float(os.getenv("ONLINE_ANOMALY_FLUSH_INTERVAL", "2"))
+MAX_PENDING = int(os.getenv("ONLINE_ANOMALY_MAX_PENDING", "50000"))
+THRESHOLDS_REFRESH_INTERVAL = float(os.getenv("ONLINE_ANOMALY_THRESHOLDS_REFRESH", "60"))
+RECENT_EVENTS = int(os.getenv("ONLINE_ANOMALY_RECENT_EVENTS", "1000"))
+# Серия без точек дольше этого забывается (устройство замолчало или удалено)
+IDLE_SECONDS = float(os.getenv("ONLINE_ANOMALY_IDLE_SECONDS", "3600"))
+
+# Среднее абсолютное отклонение нормального распределения = 0.8 sigma
+MAD_TO_SIGMA = 1.25
+
+
+def full_metric_name(metric_name):
+    """MetricMetadata.metric_name ('cpu_usage') -> ingest name ('device_cpu_usage')."""
+    return f"device_{metric_name.replace('.', '_')}"
+
+
+class OnlineAnomalyDetector:
+    """
+    Streaming anomaly detector that runs inline in the MQTT handler, O(1)
+    per sample. Every (serial, metric) series keeps an EWMA level and EWMA
+    mean absolute deviation; a sample is anomalous when it breaks the
+    MetricMetadata min/max thresholds or lies more than Z_THRESHOLD robust
+    scales from the learned level. Outliers update the baseline only up to
+    CLIP scales, so a burst does not drag the level along.
+
+    Events are edge-triggered: one event when a series enters an anomalous
+    state, none while it stays there. They are kept in memory immediately
+    and written to anomaly_events in the background every FLUSH_INTERVAL
+    seconds.
+
+    At most max_series series keep baseline state; the min/max thresholds
+    are stateless and checked for every sample. Series idle for longer than
+    IDLE_SECONDS are forgotten.
+    """
+
+    def __init__(self, alpha=ALPHA, warmup=WARMUP, z_threshold=Z_THRESHOLD, clip=CLIP,
+                 max_series=MAX_SERIES, interval=FLUSH_INTERVAL, max_pending=MAX_PENDING,
+                 idle_seconds=IDLE_SECONDS):
+        self.alpha = alpha
+        self.warmup = warmup
+        self.z_threshold = z_threshold
+        self.clip = clip
+        self.max_series = max_series
+        self.interval = interval
+        self.max_pending = max_pending
+        self.idle_seconds = idle_seconds
+
+        # (serial, metric_name) -> [уровень, mad, число точек, активные виды аномалий, monotonic время последней точки]
+        self._series = {}
+        # Серии сверх max_series: (serial, metric_name) -> (активные пороговые аномалии, время последней точки)
+        self._untracked_active = {}
+        self._thresholds = {}  # metric_name -> (min, max)
+        self._thresholds_at = 0.0
+        self._pending = []     # события, еще не записанные в БД
+        self._recent = deque(maxlen=RECENT_EVENTS)
+        self._task = None
+
+        self.samples = 0
+        self.anomalous_samples = 0
+        self.events = 0
+        self.untracked_series = 0
+        self.evicted_series = 0
+        self.dropped_events = 0
+        self.unknown_device_events = 0
+        self.written = 0
+        self.errors = 0
+
+    # --- Пороги ---
+
+    def set_threshold(self, metric_name, min_threshold, max_threshold):
+        name = full_metric_name(metric_name)
+        if min_threshold is None and max_threshold is None:
+            self._thresholds.pop(name, None)
+        else:
+            self._thresholds[name] = (min_threshold, max_threshold)
+
+    def _load_thresholds(self):
+        with SessionLocal() as db:
+            rows = db.query(
+                models.MetricMetadata.metric_name,
+                models.MetricMetadata.min_threshold,
+                models.MetricMetadata.max_threshold,
+            ).all()
+        return {
+            full_metric_name(name): (low, high)
+            for name, low, high in rows
+            if low is not None or high is not None
+        }
+
+    async def refresh_thresholds(self):
+        self._thresholds = await asyncio.to_thread(self._load_thresholds)
+        self._thresholds_at = time.monotonic()
+
+    # --- Детектор ---
+
+    def _check(self, state, value):
+        """Updates the series state with `value`; returns {kind: (baseline, score, threshold)}."""
+        level, mad, n = state[0], state[1], state[2]
+        found = {}
+        if n >= self.warmup:
+            scale = max(MAD_TO_SIGMA * mad, MIN_REL_SCALE * abs(level), MIN_SCALE)
+            residual = value - level
+            score = residual / scale
+            if score > self.z_threshold:
+                found["baseline_high"] = (level, score, None)
+            elif score < -self.z_threshold:
+                found["baseline_low"] = (level, score, None)
+            # Выброс двигает статистику не дальше, чем на CLIP масштабов
+            limit = self.clip * scale
+            residual = min(max(residual, -limit), limit)
+            state[0] = level + self.alpha * residual
+            state[1] = mad + self.alpha * (abs(residual) - mad)
+        else:
+            # Прогрев: обычное среднее, пока 1/n больше alpha
+            weight = max(1.0 / (n + 1), self.alpha)
+            residual = value - level
+            state[0] = level + weight * residual
+            state[1] = mad + weight * (abs(residual) - mad)
+        state[2] = n + 1
+        return found
+
+    def observe(self, serial, samples):
+        """samples: iterable of (metric_name, value, created_at), as passed to telemetry_writer.submit."""
+        now = time.monotonic()
+        for name, value, created_at in samples:
+            if value is None:
+                continue
+            self.samples += 1
+            key = (serial, name)
+            state = self._series.get(key)
+            if state is None and len(self._series) < self.max_series:
+                state = self._series[key] = [value, 0.0, 0, set(), now]
+
+            # Пороги не требуют состояния — проверяются и для серий сверх max_series
+            if state is not None:
+                found = self._check(state, value)
+                state[4] = now
+                baseline = state[0]
+            else:
+                self.untracked_series += 1
+                found = {}
+                baseline = value
+            limits = self._thresholds.get(name)
+            if limits is not None:
+                low, high = limits
+                if high is not None and value > high:
+                    found["above_max"] = (baseline, None, high)
+                if low is not None and value < low:
+                    found["below_min"] = (baseline, None, low)
+
+            if found:
+                self.anomalous_samples += 1
+            if state is not None:
+                active = state[3]
+            else:
+                active = self._untracked_active.get(key, (set(), now))[0]
+            for kind, (baseline, score, threshold) in found.items():
+                if kind not in active:
+                    self._emit({
+                        "serial": serial,
+                        "metric_name": name,
+                        "kind": kind,
+                        "value": value,
+                        "baseline": round(baseline, 4),
+                        "score": round(score, 2) if score is not None else None,
+                        "threshold": threshold,
+                        "created_at": created_at,
+                    })
+            # Вид аномалии снова сработает только после возврата в норму
+            if state is not None:
+                state[3] = set(found)
+            elif found:
+                self._untracked_active[key] = (set(found), now)
+            else:
+                self._untracked_active.pop(key, None)
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        # list() — снимок: remove_device может менять словарь из потока запроса
+        idle = [key for key, state in list(self._series.items()) if state[4] < cutoff]
+        for key in idle:
+            self._series.pop(key, None)
+        self.evicted_series += len(idle)
+        for key in [key for key, (_, seen) in list(self._untracked_active.items()) if seen < cutoff]:
+            self._untracked_active.pop(key, None)
+
+    def _emit(self, event):
+        self.events += 1
+        self._recent.append(event)
+        if len(self._pending) < self.max_pending:
+            self._pending.append(event)
+        else:
+            self.dropped_events += 1
+
+    def recent(self, serial=None, limit=100):
+        """Latest events, newest first, before they reach the database."""
+        events = [e for e in reversed(self._recent) if serial is None or e["serial"] == serial]
+        return events[:limit]
+
+    # --- Запись в БД ---
+
+    def remove_device(self, db, device_id):
+        """Drops a device's anomaly_events and series before the device is deleted; the caller commits."""
+        e = models.AnomalyEvent
+        db.query(e).filter(e.device_id == device_id).delete(synchronize_session=False)
+        serial = db.query(models.Device.serial).filter(models.Device.id == device_id).scalar()
+        for series in (self._series, self._untracked_active):
+            for key in [key for key in list(series) if key[0] == serial]:
+                series.pop(key, None)
+
+    def _write(self, events):
+        with SessionLocal() as db:
+            serials = {e["serial"] for e in events}
+            device_ids = dict(
+                db.query(models.Device.serial, models.Device.id).filter(models.Device.serial.in_(serials)).all()
+            )
+            written = 0
+            for e in events:
+                device_id = device_ids.get(e["serial"])
+                if device_id is None:
+                    self.unknown_device_events += 1
+                    continue
+                db.add(models.AnomalyEvent(
+                    device_id=device_id,
+                    metric_name=e["metric_name"],
+                    kind=e["kind"],
+                    value=e["value"],
+                    baseline=e["baseline"],
+                    score=e["score"],
+                    threshold=e["threshold"],
+                    created_at=e["created_at"],
+                ))
+                written += 1
+            db.commit()
+            return written
+
+    async def flush(self):
+        if not self._pending:
+            return
+        events, self._pending = self._pending, []
+        try:
+            self.written += await asyncio.to_thread(self._write, events)
+        except Exception as e:
+            self.errors += 1
+            print(f"Anomaly event write error: {e}")
+            room = max(self.max_pending - len(self._pending), 0)
+            self.dropped_events += max(len(events) - room, 0)
+            self._pending[:0] = events[:room]
+
+    async def _run(self):
+        while True:
+            try:
+                if time.monotonic() - self._thresholds_at >= THRESHOLDS_REFRESH_INTERVAL:
+                    await self.refresh_thresholds()
+                    self.evict_idle()
+                await self.flush()
+            except Exception as e:
+                self.errors += 1
+                print(f"Online anomaly detector error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "series": len(self._series),
+            "thresholds": len(self._thresholds),
+            "samples": self.samples,
+            "anomalous_samples": self.anomalous_samples,
+            "events": self.events,
+            "pending_events": len(self._pending),
+            "written": self.written,
+            "dropped_events": self.dropped_events,
+            "unknown_device_events": self.unknown_device_events,
+            "untracked_series": self.untracked_series,
+            "evicted_series": self.evicted_series,
+            "errors": self.errors,
+        }
+
+
+online_anomalies = OnlineAnomalyDetector()
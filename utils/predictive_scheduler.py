@@ -0,0 +1,285 @@
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone
+
+import models
+from database import SessionLocal
+from model import batch_forecast
+from model.forecast_state import forecast_many_with_state, forecast_with_state
+from utils.model_state_cache import ModelStateCache
+from utils.telemetry_store import telemetry_store
+from utils.telemetry_writer import telemetry_writer
+
+
+INTERVAL = float(os.getenv("PREDICTIVE_INTERVAL", "30"))
+WORKERS = int(os.getenv("PREDICTIVE_WORKERS", "2"))
+METRICS = [
+    m.strip()
+    for m in os.getenv("PREDICTIVE_METRICS", "device_cpu_usage,device_battery_level,device_dryer_temp_now").split(",")
+    if m.strip()
+]
+WINDOW = int(os.getenv("PREDICTIVE_WINDOW", "150"))
+MIN_POINTS = int(os.getenv("PREDICTIVE_MIN_POINTS", "60"))
+SHARD_SIZE = int(os.getenv("PREDICTIVE_SHARD_SIZE", "32"))
+MAX_SERIES_PER_CYCLE = int(os.getenv("PREDICTIVE_MAX_SERIES_PER_CYCLE", "20000"))
+# Запуск шардов растягивается на эту долю интервала, начало цикла сдвигается на +-JITTER
+SPREAD = float(os.getenv("PREDICTIVE_SPREAD", "0.25"))
+JITTER = float(os.getenv("PREDICTIVE_JITTER", "0.1"))
+# Переподгонки шарда одной пачкой через model/batch_forecast.py (только на проверенных версиях statsmodels/scipy)
+BATCH_FIT = os.getenv("PREDICTIVE_BATCH_FIT", "0") == "1"
+
+
+def _epoch(ts):
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def forecast_shard(shard, batch=False):
+    """
+    Pool worker: [(device_id, metric, values, new_values, state)] ->
+    [(device_id, metric, report, state, refitted)]; values are oldest first.
+    """
+    if batch:
+        reports = forecast_many_with_state([(values, new_values, state) for _, _, values, new_values, state in shard])
+        return [(device_id, metric, *report) for (device_id, metric, *_), report in zip(shard, reports)]
+    results = []
+    for device_id, metric, values, new_values, state in shard:
+        report, state, refitted = forecast_with_state(values, new_values, state)
+        results.append((device_id, metric, report, state, refitted))
+    return results
+
+
+class PredictiveScheduler:
+    """
+    Periodic Holt-Winters forecasts for every (device, metric) series in
+    METRICS. Only series that received new points since their last fit are
+    due: the telemetry writer reports written rows, so nothing is polled.
+    Due series are cut into shards of SHARD_SIZE; each shard's points are
+    read in a thread and its models fitted in a process pool, so the event
+    loop never runs statsmodels. Shard launches are spread over part of the
+    interval and cycle starts are jittered.
+
+    Model states live in an LRU cache: a series with a fresh state is only
+    rolled forward over its new points, and fully re-optimized when the
+    state is stale or drifting (see model/forecast_state.py). With
+    batch_fit, the refits of a shard are optimized together by
+    model/batch_forecast.py, with the same results.
+    """
+
+    def __init__(self, interval=INTERVAL, workers=WORKERS, metrics=METRICS, window=WINDOW,
+                 min_points=MIN_POINTS, shard_size=SHARD_SIZE, max_per_cycle=MAX_SERIES_PER_CYCLE,
+                 batch_fit=BATCH_FIT):
+        self.interval = interval
+        self.workers = workers
+        self.metrics = set(metrics)
+        self.window = window
+        self.min_points = min_points
+        self.shard_size = shard_size
+        self.max_per_cycle = max_per_cycle
+        self.batch_fit = batch_fit
+
+        self._dirty = {}   # (device_id, metric) -> время самой новой еще не учтенной точки
+        self.states = ModelStateCache()
+        self._seeded = False
+        self._pool = None
+        self._task = None
+
+        self.cycles = 0
+        self.overruns = 0
+        self.errors = 0
+        self.alerts_created = 0
+        self.refits = 0
+        self.incremental_updates = 0
+        self.last_cycle = {}
+        self.max_cycle_seconds = 0.0
+
+    def mark_dirty(self, rows):
+        """telemetry_writer hook: rows [(device_id, metric_name, value, created_at)]."""
+        for device_id, name, _, created_at in rows:
+            if name not in self.metrics:
+                continue
+            key = (device_id, name)
+            seen = self._dirty.get(key)
+            if seen is None or created_at > seen:
+                self._dirty[key] = created_at
+
+    def _seed(self):
+        # После старта не знаем, что уже посчитано — один раз берем все устройства
+        with SessionLocal() as db:
+            device_ids = [row.id for row in db.query(models.Device.id).all()]
+        for device_id in device_ids:
+            for metric in self.metrics:
+                self._dirty.setdefault((device_id, metric), None)
+
+    def _load(self, keys, states):
+        shard, marks = [], {}
+        with SessionLocal() as db:
+            for device_id, metric in keys:
+                points = telemetry_store.recent(db, device_id, metric, self.window)
+                if len(points) < self.min_points:
+                    continue
+                points = [(_epoch(ts), value) for ts, value in reversed(points)]
+                newest = points[-1][0]
+                state = states.get((device_id, metric))
+                new_values = []
+                if state is not None:
+                    if state["last_ts"] >= newest:
+                        continue
+                    new_values = [value for ts, value in points if ts > state["last_ts"]]
+                    # Все окно новое (устройство долго молчало) — состояние не продолжаем
+                    if len(new_values) == len(points):
+                        state, new_values = None, []
+                shard.append((device_id, metric, [value for _, value in points], new_values, state))
+                marks[(device_id, metric)] = newest
+        return shard, marks
+
+    def remove_device(self, db, device_id):
+        """Drops a device's predictive_alerts before the device is deleted; the caller commits."""
+        a = models.PredictiveAlert
+        db.query(a).filter(a.device_id == device_id).delete(synchronize_session=False)
+
+    def _save(self, results):
+        created = 0
+        with SessionLocal() as db:
+            alerting = {device_id for device_id, _, report, _, _ in results
+                        if report["status"] in ("warning", "critical")}
+            # Устройство могли удалить, пока шард считался
+            existing = {
+                row.id for row in db.query(models.Device.id).filter(models.Device.id.in_(alerting)).all()
+            } if alerting else set()
+            for device_id, metric, report, _, _ in results:
+                if report["status"] not in ("warning", "critical") or device_id not in existing:
+                    continue
+                db.add(models.PredictiveAlert(
+                    device_id=device_id,
+                    metric_name=metric,
+                    status=report["status"],
+                    minutes_to_failure=report["minutes_until_failure"],
+                    forecast_max=report["forecast_max"],
+                ))
+                created += 1
+            db.commit()
+        return created
+
+    async def _run_shard(self, keys, slots):
+        async with slots:
+            # Кэш трогаем только из event loop, в поток уходит снимок
+            states = {key: self.states.get(key) for key in keys}
+            shard, marks = await asyncio.to_thread(self._load, keys, states)
+            if not shard:
+                return 0
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self._pool, forecast_shard, shard, self.batch_fit)
+            self.alerts_created += await asyncio.to_thread(self._save, results)
+            for device_id, metric, report, state, refitted in results:
+                if state is not None:
+                    state["last_ts"] = marks[(device_id, metric)]
+                self.states.put((device_id, metric), state)
+                if refitted:
+                    self.refits += 1
+                elif state is not None:
+                    self.incremental_updates += 1
+            return len(shard)
+
+    async def run_cycle(self):
+        started = time.perf_counter()
+        if not self._seeded:
+            await asyncio.to_thread(self._seed)
+            self._seeded = True
+
+        # Сначала те, кто дольше ждет; остаток переходит в следующий цикл
+        due = sorted(self._dirty, key=lambda k: (self._dirty[k] is not None, self._dirty[k] or 0))
+        due = due[:self.max_per_cycle]
+        for key in due:
+            del self._dirty[key]
+
+        shards = [due[i:i + self.shard_size] for i in range(0, len(due), self.shard_size)]
+        # Читаем следующий шард, пока считается текущий, но не больше
+        slots = asyncio.Semaphore(self.workers + 1)
+        stagger = self.interval * SPREAD / len(shards) if shards else 0
+        tasks = []
+        for i, keys in enumerate(shards):
+            if i:
+                await asyncio.sleep(stagger)
+            tasks.append(asyncio.create_task(self._run_shard(keys, slots)))
+
+        self.states.evict_idle()
+        fitted = 0
+        for keys, result in zip(shards, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(result, Exception):
+                self.errors += 1
+                print(f"Predictive shard error: {result}")
+                for key in keys:
+                    self._dirty.setdefault(key, None)
+                continue
+            fitted += result
+
+        elapsed = time.perf_counter() - started
+        self.cycles += 1
+        if elapsed > self.interval:
+            self.overruns += 1
+        self.max_cycle_seconds = max(self.max_cycle_seconds, round(elapsed, 3))
+        self.last_cycle = {
+            "seconds": round(elapsed, 3),
+            "due": len(due),
+            "shards": len(shards),
+            "fitted": fitted,
+            "backlog": len(self._dirty),
+        }
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            try:
+                await self.run_cycle()
+            except Exception as e:
+                self.errors += 1
+                print(f"Predictive scheduler error: {e}")
+            elapsed = time.perf_counter() - started
+            # Случайный сдвиг, чтобы реплики и циклы не совпадали по фазе
+            await asyncio.sleep(max(self.interval - elapsed, 0) * random.uniform(1 - JITTER, 1 + JITTER))
+
+    def start(self):
+        if self.batch_fit and not batch_forecast.verified():
+            print(f"Predictive batch fit disabled: parity is only checked with {batch_forecast.VERIFIED_WITH}")
+            self.batch_fit = False
+        if self._task is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "batch_fit": self.batch_fit,
+            "interval_seconds": self.interval,
+            "model_states": self.states.stats(),
+            "refits": self.refits,
+            "incremental_updates": self.incremental_updates,
+            "backlog": len(self._dirty),
+            "cycles": self.cycles,
+            "overruns": self.overruns,
+            "errors": self.errors,
+            "alerts_created": self.alerts_created,
+            "last_cycle": self.last_cycle,
+            "max_cycle_seconds": self.max_cycle_seconds,
+        }
+
+
+predictive_scheduler = PredictiveScheduler()
+telemetry_writer.write_hooks.append(predictive_scheduler.mark_dirty)
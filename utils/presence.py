@@ -0,0 +1,118 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from schemas import DeviceStatusEnum
+from utils.alert_cache import alert_cache
+from utils.http_clients import http_clients
+from utils.last_seen import last_seen
+
+
+PROMETHEUS_QUERY_PATH = "/api/v1/query"
+
+# Устройство онлайн, если присылало телеметрию не раньше чем столько секунд назад
+ONLINE_TIMEOUT = float(os.getenv("PRESENCE_ONLINE_TIMEOUT", "30"))
+# warmup — спрашиваем Prometheus только первые ONLINE_TIMEOUT секунд после старта (память еще пустая);
+# always — всегда объединяем с Prometheus (несколько реплик делят MQTT-подписку); off — только память
+PROMETHEUS_FALLBACK = os.getenv("PRESENCE_PROMETHEUS_FALLBACK", "warmup")
+PROMETHEUS_TTL = float(os.getenv("PRESENCE_PROMETHEUS_TTL", "15"))
+
+
+class PresenceService:
+    """
+    Online/offline/problematic status of devices answered from memory: the
+    MQTT handler touches last_seen for every message, and a device is
+    online while its last message is younger than ONLINE_TIMEOUT. The old
+    Prometheus `changes(device_cpu_usage[...])` query is only a fallback,
+    cached for PROMETHEUS_TTL seconds. Call sync() once per request, then
+    status()/is_online() per device.
+    """
+
+    def __init__(self, timeout=ONLINE_TIMEOUT, fallback=PROMETHEUS_FALLBACK, prometheus_ttl=PROMETHEUS_TTL):
+        self.timeout = timeout
+        self.fallback = fallback
+        self.prometheus_ttl = prometheus_ttl
+        self._started = None  # выставляется в start() из lifespan, после миграций и бэкфиллов
+        self._prometheus_online = set()
+        self._prometheus_fetched_at = 0.0
+        self._refreshing = None
+
+        self.prometheus_refreshes = 0
+        self.prometheus_errors = 0
+
+    def _fallback_active(self):
+        if self.fallback == "always":
+            return True
+        if self.fallback == "warmup":
+            # До start() прием MQTT еще не начался — память пуста
+            return self._started is None or time.monotonic() - self._started < self.timeout
+        return False
+
+    async def _fetch_prometheus(self):
+        query = f"changes(device_cpu_usage[{int(self.timeout)}s]) > 0"
+        try:
+            resp = await http_clients.get("prometheus", PROMETHEUS_QUERY_PATH, params={"query": query}, timeout=3.0)
+            if resp.status_code == 200:
+                results = resp.json().get("data", {}).get("result", [])
+                self._prometheus_online = {r["metric"]["serial"] for r in results if "serial" in r.get("metric", {})}
+                self.prometheus_refreshes += 1
+            else:
+                self.prometheus_errors += 1
+        except Exception as e:
+            self.prometheus_errors += 1
+            print(f"Presence Prometheus error: {e}")
+        finally:
+            self._prometheus_fetched_at = time.monotonic()
+
+    async def _ensure_prometheus(self):
+        if time.monotonic() - self._prometheus_fetched_at < self.prometheus_ttl:
+            return
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._fetch_prometheus())
+            self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+        await asyncio.shield(self._refreshing)
+
+    async def sync(self, alerts=False):
+        """Refreshes the Prometheus fallback (and the alert index, if asked) when their TTL expired."""
+        tasks = []
+        if self._fallback_active():
+            tasks.append(self._ensure_prometheus())
+        if alerts:
+            tasks.append(alert_cache.all())
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    def is_online(self, serial, now=None):
+        seen = last_seen.get(serial)
+        if seen is not None:
+            now = now or datetime.now(timezone.utc)
+            if (now - seen).total_seconds() <= self.timeout:
+                return True
+        return self._fallback_active() and serial in self._prometheus_online
+
+    def status(self, serial, now=None, alerts=False):
+        if not self.is_online(serial, now):
+            return DeviceStatusEnum.OFFLINE
+        if alerts and alert_cache.peek(serial):
+            return DeviceStatusEnum.PROBLEMATIC
+        return DeviceStatusEnum.ONLINE
+
+    def start(self):
+        """Starts the warmup window; called from the lifespan right before MQTT is connected."""
+        self._started = time.monotonic()
+
+    def stats(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.timeout)
+        return {
+            "timeout_seconds": self.timeout,
+            "fallback": self.fallback,
+            "fallback_active": self._fallback_active(),
+            "online": last_seen.count_since(cutoff),
+            "prometheus_online": len(self._prometheus_online),
+            "prometheus_refreshes": self.prometheus_refreshes,
+            "prometheus_errors": self.prometheus_errors,
+        }
+
+
+presence = PresenceService()
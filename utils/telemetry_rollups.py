@@ -0,0 +1,184 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+from database import engine
+from utils.telemetry_store import telemetry_store
+
+
+# Разрешение (сек) -> сколько дней хранить корзины
+RESOLUTIONS = {
+    60: int(os.getenv("ROLLUP_1M_RETENTION_DAYS", "7")),
+    300: int(os.getenv("ROLLUP_5M_RETENTION_DAYS", "30")),
+    3600: int(os.getenv("ROLLUP_1H_RETENTION_DAYS", "365")),
+}
+
+
+def bucket_start(ts, resolution):
+    epoch = int(ts.timestamp()) if ts.tzinfo else int(ts.replace(tzinfo=timezone.utc).timestamp())
+    return datetime.fromtimestamp(epoch - epoch % resolution, tz=timezone.utc)
+
+
+def pick_resolution(hours, step, raw_days=None):
+    """
+    Coarsest rollup that still gives at least one bucket per `step` seconds
+    and is kept for `hours`. If none fits both, the finest rollup that is
+    kept for `hours`; steps finer than every rollup read raw points while
+    their retention covers `hours`. None means the request needs raw points.
+    """
+    for resolution in sorted(RESOLUTIONS, reverse=True):
+        if resolution <= step and hours <= RESOLUTIONS[resolution] * 24:
+            return resolution
+    raw_days = telemetry_store.retention_days if raw_days is None else raw_days
+    if step < min(RESOLUTIONS) and hours <= raw_days * 24:
+        return None
+    # Корзины крупнее шага лучше, чем сырые секции, в которых этого периода уже нет
+    for resolution in sorted(RESOLUTIONS):
+        if hours <= RESOLUTIONS[resolution] * 24:
+            return resolution
+    return None
+
+
+class TelemetryRollups:
+    """
+    Incrementally maintained min/max/sum/count/last buckets of
+    device_telemetry at 1m, 5m and 1h resolution. The writer merges every
+    batch into telemetry_rollups with an upsert in the same transaction as
+    the raw rows, so rollups never drift from raw data.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.resolutions = resolutions
+        self.buckets_merged = 0
+        self.buckets_dropped = 0
+
+    def aggregate(self, rows):
+        """rows: [(device_id, metric_name, value, created_at)] -> {pk: [min, max, sum, count, last, last_at]}."""
+        now = datetime.now(timezone.utc)
+        cutoffs = {res: now - timedelta(days=days) for res, days in self.resolutions.items()}
+        buckets = {}
+        for device_id, metric_name, value, created_at in rows:
+            if value is None:
+                continue
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            for resolution in self.resolutions:
+                if created_at < cutoffs[resolution]:
+                    continue
+                key = (device_id, metric_name, resolution, bucket_start(created_at, resolution))
+                agg = buckets.get(key)
+                if agg is None:
+                    buckets[key] = [value, value, value, 1, value, created_at]
+                    continue
+                agg[0] = min(agg[0], value)
+                agg[1] = max(agg[1], value)
+                agg[2] += value
+                agg[3] += 1
+                if created_at >= agg[5]:
+                    agg[4], agg[5] = value, created_at
+        return buckets
+
+    def merge(self, db, rows):
+        """Upserts the batch aggregates; committed by the caller together with the raw rows."""
+        buckets = self.aggregate(rows)
+        if not buckets:
+            return 0
+
+        dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+        least, greatest = (func.least, func.greatest) if dialect is postgresql else (func.min, func.max)
+        table = models.TelemetryRollup.__table__
+
+        stmt = dialect.insert(table)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.device_id, table.c.metric_name, table.c.resolution, table.c.bucket],
+            set_={
+                "min": least(table.c.min, excluded.min),
+                "max": greatest(table.c.max, excluded.max),
+                "sum": table.c.sum + excluded.sum,
+                "count": table.c.count + excluded.count,
+                "last": case((excluded.last_at >= table.c.last_at, excluded.last), else_=table.c.last),
+                "last_at": case((excluded.last_at >= table.c.last_at, excluded.last_at), else_=table.c.last_at),
+            },
+        )
+        db.execute(stmt, [
+            {
+                "device_id": device_id, "metric_name": metric_name, "resolution": resolution, "bucket": bucket,
+                "min": agg[0], "max": agg[1], "sum": agg[2], "count": agg[3], "last": agg[4], "last_at": agg[5],
+            }
+            for (device_id, metric_name, resolution, bucket), agg in buckets.items()
+        ])
+        self.buckets_merged += len(buckets)
+        return len(buckets)
+
+    def query(self, db, device_id, metric_name, start, end, resolution):
+        """Buckets in [start, end) at the given resolution, oldest first."""
+        r = models.TelemetryRollup
+        rows = db.query(r.bucket, r.min, r.max, r.sum, r.count, r.last).filter(
+            r.device_id == device_id,
+            r.metric_name == metric_name,
+            r.resolution == resolution,
+            r.bucket >= bucket_start(start, resolution),
+            r.bucket < end,
+        ).order_by(r.bucket).all()
+        return [
+            {
+                "time": int((b.bucket if b.bucket.tzinfo else b.bucket.replace(tzinfo=timezone.utc)).timestamp()),
+                "min": b.min,
+                "max": b.max,
+                "avg": b.sum / b.count if b.count else None,
+                "count": b.count,
+                "last": b.last,
+            }
+            for b in rows
+        ]
+
+    def history(self, db, device_id, metric_name, hours, step):
+        """
+        (resolution, points) for the last `hours`, using the coarsest rollup
+        that satisfies `step`; resolution None means raw points were read.
+        """
+        end = datetime.now(timezone.utc)
+        start = end - timedelta(hours=hours)
+        resolution = pick_resolution(hours, step)
+        if resolution is not None:
+            return resolution, self.query(db, device_id, metric_name, start, end, resolution)
+
+        points = []
+        for created_at, value in telemetry_store.between(db, device_id, metric_name, start, end):
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            points.append({
+                "time": int(created_at.timestamp()),
+                "min": value, "max": value, "avg": value, "count": 1, "last": value,
+            })
+        return None, points
+
+    def remove_device(self, db, device_id):
+        """Drops a device's buckets before the device is deleted; the caller commits."""
+        r = models.TelemetryRollup
+        self.buckets_dropped += db.query(r).filter(r.device_id == device_id).delete(synchronize_session=False)
+
+    def apply_retention(self, conn):
+        now = datetime.now(timezone.utc)
+        table = models.TelemetryRollup.__table__
+        for resolution, days in self.resolutions.items():
+            result = conn.execute(table.delete().where(
+                table.c.resolution == resolution,
+                table.c.bucket < now - timedelta(days=days),
+            ))
+            self.buckets_dropped += result.rowcount or 0
+
+    def stats(self):
+        return {
+            "resolutions": {str(res): days for res, days in self.resolutions.items()},
+            "buckets_merged": self.buckets_merged,
+            "buckets_dropped": self.buckets_dropped,
+        }
+
+
+telemetry_rollups = TelemetryRollups()
+telemetry_store.retention_hooks.append(telemetry_rollups.apply_retention)
@@ -0,0 +1,364 @@
+import asyncio
+import csv
+import io
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Column, DateTime, Float, Index, Integer, MetaData, String, Table, inspect, select, text
+
+from database import SessionLocal, engine
+
+
+BASE_TABLE = "device_telemetry"
+LEGACY_TABLE = "device_telemetry_legacy"
+DEFAULT_PARTITION = "device_telemetry_default"
+COLUMNS = ("device_id", "metric_name", "value", "created_at")
+
+RETENTION_DAYS = int(os.getenv("TELEMETRY_RETENTION_DAYS", "30"))
+PREMAKE_DAYS = int(os.getenv("TELEMETRY_PREMAKE_DAYS", "2"))
+MAINTENANCE_INTERVAL = float(os.getenv("TELEMETRY_MAINTENANCE_INTERVAL", "3600"))
+
+# Дневные секции: device_telemetry_p20260101 в Postgres, device_telemetry_c20260101 в SQLite
+PARTITION_RE = re.compile(r"^device_telemetry_[pc](\d{8})$")
+
+
+def day_of(ts):
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return ts.date()
+
+
+class TelemetryStore:
+    """
+    Day-partitioned storage for device_telemetry.
+
+    Postgres: device_telemetry is a native RANGE (created_at) partitioned
+    table with one partition per UTC day plus a DEFAULT partition; writes go
+    through the parent with COPY under psycopg2 and executemany under other
+    drivers. Other backends (SQLite): one chunk table per day, rows are
+    routed by the writer and reads walk chunks newest first. Both keep a (device_id, metric_name, created_at) index per
+    partition, so a recent-window query touches only the newest partitions.
+    Retention drops whole partitions older than RETENTION_DAYS.
+
+    Rows written before partitioning (device_telemetry_legacy on Postgres,
+    the plain device_telemetry table on SQLite) stay readable and are
+    trimmed by the same retention job.
+    """
+
+    def __init__(self, retention_days=RETENTION_DAYS, premake_days=PREMAKE_DAYS, interval=MAINTENANCE_INTERVAL):
+        self.retention_days = retention_days
+        self.premake_days = premake_days
+        self.interval = interval
+        self.native = engine.dialect.name == "postgresql"
+        # copy_expert есть только у psycopg2; psycopg3/asyncpg пишут через executemany в родительскую таблицу
+        self.copy = self.native and engine.dialect.driver == "psycopg2"
+
+        self._metadata = MetaData()
+        self._tables = {}
+        self._days = set()         # дни, для которых секция уже есть
+        self._has_legacy = None
+        self._task = None
+        # Доп. очистка в той же транзакции, что и ретенция секций (например, rollup-таблицы)
+        self.retention_hooks = []
+
+        self.partitions_created = 0
+        self.partitions_dropped = 0
+        self.legacy_rows_deleted = 0
+        self.device_rows_deleted = 0
+        self.expired_rows_skipped = 0
+        self.last_maintenance_seconds = 0.0
+
+    # --- Схема ---
+
+    def _table(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            table = Table(
+                name, self._metadata,
+                Column("id", Integer, primary_key=True),
+                Column("device_id", Integer),
+                Column("metric_name", String),
+                Column("value", Float),
+                Column("created_at", DateTime(timezone=True)),
+                Index(f"ix_{name}_device_metric_time", "device_id", "metric_name", "created_at"),
+            )
+            self._tables[name] = table
+        return table
+
+    def partition_name(self, day):
+        return f"{BASE_TABLE}_{'p' if self.native else 'c'}{day:%Y%m%d}"
+
+    def _list_partitions(self, conn):
+        """[(day, table name)] newest first."""
+        if self.native:
+            names = conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :parent"
+            ), {"parent": BASE_TABLE}).scalars().all()
+        else:
+            names = inspect(conn).get_table_names()
+        partitions = []
+        for name in names:
+            m = PARTITION_RE.match(name)
+            if m:
+                partitions.append((datetime.strptime(m.group(1), "%Y%m%d").date(), name))
+        partitions.sort(reverse=True)
+        return partitions
+
+    def _migrate_plain_table(self, conn):
+        """Moves a non-partitioned Postgres device_telemetry out of the way."""
+        relkind = conn.execute(
+            text("SELECT relkind FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p')"),
+            {"name": BASE_TABLE},
+        ).scalar()
+        if relkind == "p":
+            return
+        if relkind == "r":
+            if conn.execute(text(f"SELECT 1 FROM {BASE_TABLE} LIMIT 1")).first() is None:
+                conn.execute(text(f"DROP TABLE {BASE_TABLE}"))
+            else:
+                indexes = conn.execute(
+                    text("SELECT indexname FROM pg_indexes WHERE tablename = :name"), {"name": BASE_TABLE}
+                ).scalars().all()
+                conn.execute(text(f"ALTER TABLE {BASE_TABLE} RENAME TO {LEGACY_TABLE}"))
+                for index in indexes:
+                    new_name = index.replace(BASE_TABLE, LEGACY_TABLE, 1)[:63]
+                    conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{new_name}"'))
+                print(f"{BASE_TABLE}: existing rows kept in {LEGACY_TABLE}")
+
+        conn.execute(text(
+            f"CREATE TABLE {BASE_TABLE} ("
+            " id BIGSERIAL,"
+            " device_id INTEGER REFERENCES devices(id),"
+            " metric_name VARCHAR,"
+            " value DOUBLE PRECISION,"
+            " created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),"
+            " PRIMARY KEY (id, created_at)"
+            ") PARTITION BY RANGE (created_at)"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{BASE_TABLE}_device_metric_time "
+            f"ON {BASE_TABLE} (device_id, metric_name, created_at)"
+        ))
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {BASE_TABLE} DEFAULT"))
+
+    def _create_partition(self, conn, day):
+        name = self.partition_name(day)
+        if self.native:
+            start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {BASE_TABLE} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{(start + timedelta(days=1)).isoformat()}')"
+            ))
+        else:
+            self._table(name).create(conn, checkfirst=True)
+        self.partitions_created += 1
+
+    def ensure_days(self, days):
+        missing = [d for d in days if d not in self._days]
+        if not missing:
+            return
+        with engine.begin() as conn:
+            existing = {day for day, _ in self._list_partitions(conn)}
+            for day in missing:
+                if day not in existing:
+                    try:
+                        with conn.begin_nested():
+                            self._create_partition(conn, day)
+                    except Exception as e:
+                        # В Postgres строки без секции попадут в DEFAULT
+                        print(f"Telemetry partition error for {day}: {e}")
+                        continue
+                self._days.add(day)
+
+    def ensure_schema(self):
+        """Called once at startup, after metadata.create_all()."""
+        if self.native:
+            with engine.begin() as conn:
+                self._migrate_plain_table(conn)
+        today = datetime.now(timezone.utc).date()
+        self.ensure_days([today + timedelta(days=i) for i in range(self.premake_days + 1)])
+
+    def _legacy_table(self, conn):
+        if self._has_legacy is None:
+            self._has_legacy = inspect(conn).has_table(LEGACY_TABLE if self.native else BASE_TABLE)
+        if not self._has_legacy:
+            return None
+        return self._table(LEGACY_TABLE if self.native else BASE_TABLE)
+
+    # --- Запись ---
+
+    def write(self, db, rows):
+        """
+        rows: [(device_id, metric_name, value, created_at)], committed by the
+        caller. Returns the number of rows written: points older than the
+        retention window are skipped, they would be dropped anyway.
+        """
+        cutoff_day = datetime.now(timezone.utc).date() - timedelta(days=self.retention_days)
+        fresh = [r for r in rows if day_of(r[3]) >= cutoff_day]
+        self.expired_rows_skipped += len(rows) - len(fresh)
+        rows = fresh
+        if not rows:
+            return 0
+        self.ensure_days({day_of(r[3]) for r in rows})
+        if self.native:
+            if self.copy:
+                self._copy(db, rows)
+            else:
+                db.execute(self._table(BASE_TABLE).insert(), [dict(zip(COLUMNS, row)) for row in rows])
+            return len(rows)
+
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(day_of(row[3]), []).append(dict(zip(COLUMNS, row)))
+        for day, chunk in by_day.items():
+            # Один подготовленный INSERT на чанк (executemany) внутри транзакции вызывающего
+            db.execute(self._table(self.partition_name(day)).insert(), chunk)
+        return len(rows)
+
+    def _copy(self, db, rows):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(
+            (device_id, name, value, created_at.isoformat()) for device_id, name, value, created_at in rows
+        )
+        buf.seek(0)
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {BASE_TABLE} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+        finally:
+            cursor.close()
+
+    # --- Чтение ---
+
+    def _read_tables(self, conn, start=None, end=None):
+        """Tables to scan for [start, end), newest first."""
+        if self.native:
+            tables = [self._table(BASE_TABLE)]
+        else:
+            tables = [
+                self._table(name) for day, name in self._list_partitions(conn)
+                if (end is None or day <= day_of(end)) and (start is None or day >= day_of(start))
+            ]
+        legacy = self._legacy_table(conn)
+        if legacy is not None:
+            tables.append(legacy)
+        return tables
+
+    def recent(self, db, device_id, metric_name, limit):
+        """Last `limit` (created_at, value) points, newest first; stops at the first partitions that fill it."""
+        points = []
+        for table in self._read_tables(db.connection()):
+            rows = db.execute(
+                select(table.c.created_at, table.c.value)
+                .where(table.c.device_id == device_id, table.c.metric_name == metric_name)
+                .order_by(table.c.created_at.desc())
+                .limit(limit - len(points))
+            ).all()
+            points.extend((r.created_at, r.value) for r in rows)
+            if len(points) >= limit:
+                break
+        return points
+
+    def between(self, db, device_id, metric_name, start, end):
+        """(created_at, value) points in [start, end), oldest first."""
+        points = []
+        for table in self._read_tables(db.connection(), start, end):
+            rows = db.execute(
+                select(table.c.created_at, table.c.value)
+                .where(
+                    table.c.device_id == device_id,
+                    table.c.metric_name == metric_name,
+                    table.c.created_at >= start,
+                    table.c.created_at < end,
+                )
+            ).all()
+            points.extend((r.created_at, r.value) for r in rows)
+        points.sort(key=lambda p: p[0])
+        return points
+
+    def remove_device(self, db, device_id):
+        """Drops a device's raw points before the device is deleted; the caller commits."""
+        for table in self._read_tables(db.connection()):
+            self.device_rows_deleted += db.execute(table.delete().where(table.c.device_id == device_id)).rowcount or 0
+
+    # --- Ретенция ---
+
+    def apply_retention(self):
+        started = time.perf_counter()
+        cutoff_day = datetime.now(timezone.utc).date() - timedelta(days=self.retention_days)
+        cutoff = datetime(cutoff_day.year, cutoff_day.month, cutoff_day.day, tzinfo=timezone.utc)
+
+        today = datetime.now(timezone.utc).date()
+        self.ensure_days([today + timedelta(days=i) for i in range(self.premake_days + 1)])
+
+        with engine.begin() as conn:
+            for day, name in self._list_partitions(conn):
+                if day < cutoff_day:
+                    conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                    self._days.discard(day)
+                    self._tables.pop(name, None)
+                    self.partitions_dropped += 1
+
+            old_rows = [self._legacy_table(conn)]
+            if self.native:
+                old_rows.append(self._table(DEFAULT_PARTITION))
+            for table in old_rows:
+                if table is None:
+                    continue
+                result = conn.execute(table.delete().where(table.c.created_at < cutoff))
+                self.legacy_rows_deleted += result.rowcount or 0
+
+            legacy = self._legacy_table(conn)
+            if self.native and legacy is not None and conn.execute(select(legacy.c.id).limit(1)).first() is None:
+                conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+                self._has_legacy = False
+
+            for hook in self.retention_hooks:
+                hook(conn)
+
+        self.last_maintenance_seconds = round(time.perf_counter() - started, 4)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.apply_retention)
+            except Exception as e:
+                print(f"Telemetry retention error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        with SessionLocal() as db:
+            partitions = self._list_partitions(db.connection())
+        return {
+            "backend": "native" if self.native else "chunked",
+            "bulk_insert": "copy" if self.copy else "executemany",
+            "partitions": len(partitions),
+            "oldest": partitions[-1][0].isoformat() if partitions else None,
+            "newest": partitions[0][0].isoformat() if partitions else None,
+            "retention_days": self.retention_days,
+            "partitions_created": self.partitions_created,
+            "partitions_dropped": self.partitions_dropped,
+            "legacy_rows_deleted": self.legacy_rows_deleted,
+            "device_rows_deleted": self.device_rows_deleted,
+            "expired_rows_skipped": self.expired_rows_skipped,
+            "last_maintenance_seconds": self.last_maintenance_seconds,
+        }
+
+
+telemetry_store = TelemetryStore()
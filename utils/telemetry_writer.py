@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import models
+from database import SessionLocal
+from utils.telemetry_store import telemetry_store
+from utils.telemetry_rollups import telemetry_rollups
+
+
+FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "2"))
+MAX_BATCH_ROWS = int(os.getenv("TELEMETRY_MAX_BATCH_ROWS", "20000"))
+MAX_BUFFER_ROWS = int(os.getenv("TELEMETRY_MAX_BUFFER_ROWS", "200000"))
+RATE_WINDOW = 60.0
+
+# Время из будущего (сбитые часы устройства) заменяем временем приема
+MAX_CLOCK_SKEW = timedelta(seconds=float(os.getenv("TELEMETRY_MAX_CLOCK_SKEW", "300")))
+
+
+def metric_timestamp(metric, fallback):
+    ts = getattr(metric, "timestamp", None)
+    if ts is None or (ts.seconds == 0 and ts.nanos == 0):
+        return fallback
+    created_at = datetime.fromtimestamp(ts.seconds + ts.nanos / 1e9, tz=timezone.utc)
+    if created_at - fallback > MAX_CLOCK_SKEW:
+        return fallback
+    return created_at
+
+
+class TelemetryWriter:
+    """
+    Buffers metric samples from the MQTT handler and bulk-inserts them into
+    device_telemetry through telemetry_store: COPY on Postgres, one
+    executemany INSERT per day chunk elsewhere. A batch is written every
+    FLUSH_INTERVAL seconds or as soon as MAX_BATCH_ROWS samples are
+    buffered; one transaction per batch.
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL, max_batch=MAX_BATCH_ROWS, max_buffer=MAX_BUFFER_ROWS):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_buffer = max_buffer
+
+        self._buffer = []   # (serial, metric_name, value, created_at)
+        self._device_ids = {}  # serial -> devices.id
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._recent = deque()  # (monotonic time, rows) за последние RATE_WINDOW секунд
+        # Вызываются в event loop после записи пачки: hook(rows), rows — (device_id, metric_name, value, created_at)
+        self.write_hooks = []
+
+        self.accepted = 0
+        self.dropped = 0
+        self.unknown_device_rows = 0
+        self.written = 0
+        self.errors = 0
+        self.hook_errors = 0
+        self.flushes = 0
+        self.last_batch_rows = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def submit(self, serial, samples):
+        """samples: iterable of (metric_name, value, created_at)."""
+        for name, value, created_at in samples:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                continue
+            self._buffer.append((serial, name, value, created_at))
+            self.accepted += 1
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+
+    def _resolve_devices(self, db, serials):
+        missing = [s for s in serials if s not in self._device_ids]
+        if missing:
+            rows = db.query(models.Device.serial, models.Device.id).filter(models.Device.serial.in_(missing)).all()
+            self._device_ids.update({r.serial: r.id for r in rows})
+
+    def _write(self, batch):
+        with SessionLocal() as db:
+            self._resolve_devices(db, {serial for serial, *_ in batch})
+            rows = []
+            for serial, name, value, created_at in batch:
+                device_id = self._device_ids.get(serial)
+                if device_id is None:
+                    self.unknown_device_rows += 1
+                    continue
+                rows.append((device_id, name, value, created_at))
+            if not rows:
+                return 0, rows
+
+            written = telemetry_store.write(db, rows)
+            # Агрегаты 1m/5m/1h обновляются в той же транзакции, что и сырые точки
+            telemetry_rollups.merge(db, rows)
+            db.commit()
+            return written, rows
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch = self._buffer[:self.max_batch]
+        del self._buffer[:self.max_batch]
+        started = time.perf_counter()
+        try:
+            written, rows = await asyncio.to_thread(self._write, batch)
+            self.written += written
+            self._recent.append((time.monotonic(), written))
+        except Exception as e:
+            self.errors += 1
+            print(f"Telemetry write error: {e}")
+            # Устройство могло быть удалено — перечитаем serial -> id при следующей записи
+            self._device_ids.clear()
+            # Возвращаем пачку в начало буфера, пока есть место
+            room = max(self.max_buffer - len(self._buffer), 0)
+            self.dropped += max(len(batch) - room, 0)
+            self._buffer[:0] = batch[:room]
+            return
+        finally:
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.last_batch_rows = len(batch)
+            self.last_flush_seconds = round(elapsed, 4)
+            self.max_flush_seconds = max(self.max_flush_seconds, self.last_flush_seconds)
+
+        # Пачка уже закоммичена: ошибка подписчика не должна вернуть ее в буфер
+        for hook in self.write_hooks:
+            try:
+                hook(rows)
+            except Exception as e:
+                self.hook_errors += 1
+                print(f"Telemetry write hook error: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            # Если за время записи накопилась еще пачка — пишем сразу
+            while len(self._buffer) >= self.max_batch:
+                await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._buffer:
+            before = len(self._buffer)
+            await self.flush()
+            if len(self._buffer) >= before:
+                break
+
+    def rows_per_second(self):
+        cutoff = time.monotonic() - RATE_WINDOW
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+        return round(sum(rows for _, rows in self._recent) / RATE_WINDOW, 2)
+
+    def stats(self):
+        return {
+            "buffered": len(self._buffer),
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "unknown_device_rows": self.unknown_device_rows,
+            "written": self.written,
+            "errors": self.errors,
+            "hook_errors": self.hook_errors,
+            "flushes": self.flushes,
+            "rows_per_sec": self.rows_per_second(),
+            "last_batch_rows": self.last_batch_rows,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+
+telemetry_writer = TelemetryWriter()
@@ -0,0 +1,84 @@
+import os
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+import models
+from database import SessionLocal, engine
+from utils.coredump import read_memory_segments
+from utils.firmware_registry import firmware_registry
+
+
+MEMORY_CHUNK = int(os.getenv("TRACE_MEMORY_CHUNK", str(64 * 1024)))
+MAX_MEMORY_RANGE = int(os.getenv("TRACE_MEMORY_MAX_RANGE", str(4 * 1024 * 1024)))
+
+
+def ensure_segment_index():
+    """
+    create_all skips indexes of existing tables: adds the (trace_id, index)
+    unique index. Only if that fails, drops the segments duplicated by
+    concurrent first requests before it existed and retries.
+    """
+    s = models.TraceMemorySegment
+    for index in s.__table__.indexes:
+        try:
+            index.create(bind=engine, checkfirst=True)
+        except IntegrityError:
+            with SessionLocal() as db:
+                keep = db.query(func.min(s.id)).group_by(s.trace_id, s.index)
+                removed = db.query(s).filter(s.id.not_in(keep)).delete(synchronize_session=False)
+                db.commit()
+            print(f"trace_memory_segments: removed {removed} duplicate segments")
+            index.create(bind=engine, checkfirst=True)
+
+
+def _stored_segments(db, trace_id):
+    return db.query(models.TraceMemorySegment).filter(
+        models.TraceMemorySegment.trace_id == trace_id
+    ).order_by(models.TraceMemorySegment.index).all()
+
+
+def get_memory_segments(db, trace):
+    """
+    Segment list of a trace. Segments are cut out of raw_dump on first
+    access and stored in trace_memory_segments, later calls only read metadata.
+    """
+    segments = _stored_segments(db, trace.id)
+    if segments or trace.raw_dump is None:
+        return segments
+
+    prog = firmware_registry.resolve(trace.firmware_version)
+    for i, seg in enumerate(read_memory_segments(trace.raw_dump, prog)):
+        segment = models.TraceMemorySegment(
+            trace_id=trace.id,
+            index=i,
+            name=seg['name'],
+            address=seg['address'],
+            size=len(seg['data']),
+            attrs=seg['attrs'],
+            data=seg['data'],
+        )
+        db.add(segment)
+        segments.append(segment)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Параллельный первый запрос уже сохранил сегменты — берем их
+        db.rollback()
+        return _stored_segments(db, trace.id)
+    return segments
+
+
+def iter_segment_range(segment_id, offset, length, chunk=MEMORY_CHUNK):
+    """Yields [offset, offset + length) of a segment in chunks, never loading the whole blob."""
+    end = offset + length
+    with SessionLocal() as db:
+        while offset < end:
+            size = min(chunk, end - offset)
+            data = db.query(
+                func.substr(models.TraceMemorySegment.data, offset + 1, size)
+            ).filter(models.TraceMemorySegment.id == segment_id).scalar()
+            if not data:
+                return
+            yield bytes(data)
+            offset += len(data)